@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+ALPR Benchmark - Đo hiệu năng SimpleOCRService trên bộ ảnh biển số giả lập
+Kết quả JSON: latency p50/p95/p99 theo từng bước, throughput, peak RSS, độ chính xác
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import platform
+import logging
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from synthetic_plates import generate_corpus
+from frame_decoder import FrameDecoder
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def percentiles(values):
+    """p50/p95/p99/mean/max (ms) của danh sách thời gian (giây)"""
+    if not values:
+        return {'samples': 0}
+    array = np.asarray(values, dtype=float) * 1000
+    return {
+        'samples': len(values),
+        'mean_ms': round(float(array.mean()), 3),
+        'p50_ms': round(float(np.percentile(array, 50)), 3),
+        'p95_ms': round(float(np.percentile(array, 95)), 3),
+        'p99_ms': round(float(np.percentile(array, 99)), 3),
+        'max_ms': round(float(array.max()), 3)
+    }
+
+def peak_rss_mb():
+    """Peak RSS của process (ru_maxrss tính bằng KB trên Linux, byte trên macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(peak / float(divisor), 1)
+
+def best_plate(result):
+    plates = result.get('license_plates', [])
+    if not plates:
+        return None
+    return max(plates, key=lambda plate: plate.get('confidence', 0))['normalized_text']
+
+def crop_plate(sample, margin=0.1):
+    """Cắt vùng biển số (nới thêm margin mỗi phía) như ảnh gửi lên /api/recognize"""
+    x, y, w, h = sample['plate_box']
+    pad_x, pad_y = int(w * margin), int(h * margin)
+    height, width = sample['image'].shape[:2]
+    return sample['image'][max(0, y - pad_y):min(height, y + h + pad_y), max(0, x - pad_x):min(width, x + w + pad_x)]
+
+def run_benchmark(service, samples, batch_size=1, warmup=2, jpeg_quality=90, recognize_only=False):
+    """
+    Chạy benchmark trên bộ ảnh
+
+    Args:
+        service: Backend có process_images (SimpleOCRService hoặc OCRWorkerPool)
+        samples: Bộ ảnh từ generate_corpus
+        batch_size: Số ảnh mỗi lần gọi process_images
+        warmup: Số batch chạy trước, không tính vào kết quả
+        jpeg_quality: Chất lượng JPEG khi encode (bước decode được đo như request thật)
+        recognize_only: Chạy trên vùng biển số cắt sẵn, chỉ model recognition (như /api/recognize)
+
+    Returns:
+        dict: Kết quả benchmark
+    """
+    decoder = FrameDecoder()
+    inputs = [crop_plate(sample) if recognize_only else sample['image'] for sample in samples]
+    encoded = [cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])[1].tobytes() for image in inputs]
+
+    batches = [list(range(start, min(start + batch_size, len(samples)))) for start in range(0, len(samples), batch_size)]
+    for batch in batches[:warmup]:
+        service.process_images([inputs[i] for i in batch], recognize_only=recognize_only)
+
+    stage_times = {'decode': [], 'total': []}
+    accuracy = {}
+    correct = 0
+    failed = 0
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    for batch in batches:
+        images = []
+        decode_times = []
+        for i in batch:
+            image, _, decode_time = decoder.decode(encoded[i], reduction=1)
+            images.append(image)
+            decode_times.append(decode_time)
+
+        results = service.process_images(images, recognize_only=recognize_only)
+
+        for i, decode_time, result in zip(batch, decode_times, results):
+            sample = samples[i]
+            if not result.get('success'):
+                failed += 1
+                continue
+
+            stage_times['decode'].append(decode_time)
+            stage_times['total'].append(decode_time + result.get('processing_time', 0))
+            for stage, seconds in result.get('timings', {}).items():
+                stage_times.setdefault(stage, []).append(seconds)
+
+            hit = best_plate(result) == sample['expected']
+            correct += hit
+            for key in ('layout', 'font', 'condition'):
+                bucket = accuracy.setdefault(key, {}).setdefault(sample[key], {'total': 0, 'correct': 0})
+                bucket['total'] += 1
+                bucket['correct'] += hit
+
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.process_time() - cpu_start
+
+    for groups in accuracy.values():
+        for bucket in groups.values():
+            bucket['accuracy'] = round(bucket['correct'] / float(bucket['total']), 4)
+
+    processed = len(samples)
+    return {
+        'images': processed,
+        'mode': 'recognize_only' if recognize_only else 'full_pipeline',
+        'failed': failed,
+        'batch_size': batch_size,
+        'stages': {stage: percentiles(values) for stage, values in stage_times.items()},
+        'throughput': {
+            'wall_time_s': round(wall_time, 3),
+            'cpu_time_s': round(cpu_time, 3),
+            'images_per_second': round(processed / wall_time, 3) if wall_time else 0,
+            # Ảnh trên mỗi giây CPU (của process chính) ~ throughput trên một core
+            'images_per_cpu_second': round(processed / cpu_time, 3) if cpu_time else 0
+        },
+        'peak_rss_mb': peak_rss_mb(),
+        'accuracy': {
+            'correct': correct,
+            'exact_match': round(correct / float(processed), 4) if processed else 0,
+            'by': accuracy
+        }
+    }
+
+def compare(current, baseline_path):
+    """In chênh lệch p95 từng bước và độ chính xác so với một lần chạy trước"""
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)['results']
+
+    print(f"📊 Compared with {baseline_path}:")
+    for stage, stats in current['stages'].items():
+        before = baseline.get('stages', {}).get(stage, {}).get('p95_ms')
+        if before and stats.get('p95_ms') is not None:
+            change = (stats['p95_ms'] - before) / before * 100
+            print(f"   {stage:<12} p95 {before:>9.2f}ms -> {stats['p95_ms']:>9.2f}ms ({change:+.1f}%)")
+    before = baseline.get('accuracy', {}).get('exact_match')
+    if before is not None:
+        print(f"   accuracy     {before:.4f} -> {current['accuracy']['exact_match']:.4f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ALPR OCR trên bộ ảnh biển số giả lập')
+    parser.add_argument('--count', type=int, default=200, help='Số ảnh trong bộ ảnh')
+    parser.add_argument('--seed', type=int, default=0, help='Seed sinh bộ ảnh (cùng seed = cùng ảnh)')
+    parser.add_argument('--width', type=int, default=1280, help='Chiều rộng ảnh')
+    parser.add_argument('--height', type=int, default=720, help='Chiều cao ảnh')
+    parser.add_argument('--batch-size', type=int, default=1, help='Số ảnh mỗi lần gọi process_images')
+    parser.add_argument('--warmup', type=int, default=2, help='Số batch chạy trước để warm up')
+    parser.add_argument('--cpu-threads', type=int, default=None, help='Số thread CPU của OCR backend')
+    parser.add_argument('--backend', default='paddle', help='OCR backend: paddle, onnxruntime, openvino')
+    parser.add_argument('--model-dir', help='Thư mục model ONNX (backend onnxruntime/openvino)')
+    parser.add_argument('--precision', default='fp32', choices=['fp32', 'int8'], help='Model FP32 hoặc INT8')
+    parser.add_argument('--workers', type=int, default=0, help='Chạy qua OCRWorkerPool với số worker process này')
+    parser.add_argument('--no-plate-detector', action='store_true', help='Bỏ bước tìm vùng biển số')
+    parser.add_argument('--recognize-only', action='store_true', help='Chỉ chạy recognition trên vùng biển số cắt sẵn')
+    parser.add_argument('--output', help='Ghi kết quả JSON ra file (mặc định in ra stdout)')
+    parser.add_argument('--compare', help='File JSON của lần chạy trước để so sánh')
+    args = parser.parse_args()
+
+    logger.info(f"📸 Generating {args.count} synthetic plates (seed {args.seed})...")
+    samples = generate_corpus(args.count, seed=args.seed, frame_size=(args.width, args.height))
+
+    backend_options = {'backend': args.backend, 'model_dir': args.model_dir, 'precision': args.precision}
+    pool = None
+    if args.workers > 0:
+        from ocr_worker_pool import OCRWorkerPool
+        pool = OCRWorkerPool(size=args.workers, threads_per_worker=args.cpu_threads or 1, backend_options=backend_options)
+        pool.start()
+        service = pool
+    else:
+        from ocr_service import SimpleOCRService
+        service = SimpleOCRService(use_plate_detector=not args.no_plate_detector, cpu_threads=args.cpu_threads,
+                                   **backend_options)
+
+    try:
+        results = run_benchmark(service, samples, batch_size=args.batch_size, warmup=args.warmup,
+                                recognize_only=args.recognize_only)
+    finally:
+        if pool:
+            pool.stop()
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'config': vars(args),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__
+        },
+        'results': results
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+        logger.info(f"✅ Benchmark results written to {args.output}")
+    else:
+        print(output)
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ Cloudinary Service - Upload và quản lý ảnh trên Cloudinary
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
+import cloudinary.utils
 import logging
 from datetime import datetime
 import os
@@ -87,7 +88,32 @@ class CloudinaryService:
                 'error': str(e)
             }
     
-    def upload_parking_image(self, image_bytes, license_plate, parking_lot_id, image_type="entry"):
+    def build_parking_public_id(self, license_plate, parking_lot_id, image_type="entry", captured_at=None):
+        """
+        Tạo public_id cố định cho ảnh parking (gồm cả folder) trước khi upload
+        
+        Args:
+            license_plate: Biển số xe
+            parking_lot_id: ID bãi xe
+            image_type: Loại ảnh (entry/exit)
+            captured_at: Thời điểm chụp (datetime), mặc định là hiện tại
+            
+        Returns:
+            str: Public ID đầy đủ, vd. parking-system/<lot>/entry/parking_entry_51A12345_<lot>_20240101_120000_123
+        """
+        captured_at = captured_at or datetime.now()
+        timestamp = captured_at.strftime("%Y%m%d_%H%M%S_%f")[:-3]
+        name = f"parking_{image_type}_{license_plate}_{parking_lot_id}_{timestamp}"
+        return f"parking-system/{parking_lot_id}/{image_type}/{name}"
+    
+    def build_image_url(self, public_id):
+        """
+        Tạo URL ảnh từ public_id (dùng được trước khi upload xong)
+        """
+        url, _ = cloudinary.utils.cloudinary_url(public_id, secure=True, format="jpg")
+        return url
+    
+    def upload_parking_image(self, image_bytes, license_plate, parking_lot_id, image_type="entry", public_id=None):
         """
         Upload ảnh parking với metadata
         
@@ -96,6 +122,7 @@ class CloudinaryService:
             license_plate: Biển số xe
             parking_lot_id: ID bãi xe
             image_type: Loại ảnh (entry/exit)
+            public_id: Public ID đầy đủ đã tạo trước (build_parking_public_id)
             
         Returns:
             dict: Thông tin ảnh đã upload
@@ -103,13 +130,17 @@ class CloudinaryService:
         try:
             # Tạo public_id với thông tin metadata
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            public_id = f"parking_{image_type}_{license_plate}_{parking_lot_id}_{timestamp}"
+            if public_id:
+                upload_options = {'public_id': public_id, 'overwrite': True}
+            else:
+                upload_options = {
+                    'folder': f"parking-system/{parking_lot_id}/{image_type}",
+                    'public_id': f"parking_{image_type}_{license_plate}_{parking_lot_id}_{timestamp}"
+                }
             
             # Upload với context metadata
             result = cloudinary.uploader.upload(
                 image_bytes,
-                folder=f"parking-system/{parking_lot_id}/{image_type}",
-                public_id=public_id,
                 resource_type="image",
                 context={
                     "license_plate": license_plate,
@@ -120,7 +151,8 @@ class CloudinaryService:
                 transformation=[
                     {"width": 800, "height": 600, "crop": "limit"},
                     {"quality": "auto:good"}
-                ]
+                ],
+                **upload_options
             )
             
             logger.info(f"✅ Parking image uploaded: {result['public_id']}")
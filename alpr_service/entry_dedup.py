@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Entry Dedup - Bỏ entry lặp của cùng một xe tại cùng barrier trong một khoảng thời gian ngắn
+RFID retry và camera kích hoạt lại gửi cùng một xe hai lần: lần sau trả lại kết quả của lần đầu,
+không upload ảnh và không gọi server. Biển số lệch một ký tự (OCR đọc khác) vẫn coi là cùng xe
+Nhiều process (gunicorn worker) dùng chung bảng dedup trong file SQLite của entry journal
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dedup_entries (
+    barrier_key TEXT NOT NULL,
+    license_plate TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    outcome TEXT,
+    PRIMARY KEY (barrier_key, license_plate)
+);
+"""
+
+# Chu kỳ đọc lại bảng chung khi process khác đang gửi cùng lượt xe (giây)
+SHARED_POLL_INTERVAL = 0.05
+
+def within_edit_distance(a: str, b: str, max_distance=1) -> bool:
+    """Khoảng cách Levenshtein giữa a và b có <= max_distance không (0 hoặc 1 kiểm tra trực tiếp, không dựng bảng)"""
+    if a == b:
+        return True
+    if max_distance <= 0 or abs(len(a) - len(b)) > max_distance:
+        return False
+    if max_distance > 1:
+        previous = list(range(len(b) + 1))
+        for i, char_a in enumerate(a, 1):
+            current = [i]
+            for j, char_b in enumerate(b, 1):
+                current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+            previous = current
+        return previous[-1] <= max_distance
+
+    # Bỏ phần đầu giống nhau, phần còn lại phải khớp sau đúng một lần thay/thêm/xoá
+    if len(a) > len(b):
+        a, b = b, a
+    index = 0
+    while index < len(a) and a[index] == b[index]:
+        index += 1
+    if len(a) == len(b):
+        return a[index + 1:] == b[index + 1:]
+    return a[index:] == b[index + 1:]
+
+class DedupEntry:
+    """Một lượt xe đã (hoặc đang) gửi entry, lần gửi lặp chờ trên event rồi dùng lại kết quả"""
+
+    def __init__(self, barrier_key, license_plate):
+        self.barrier_key = barrier_key
+        self.license_plate = license_plate
+        self.created_at = time.monotonic()
+        self.done = threading.Event()
+        self.outcome = None  # (body, status HTTP)
+        self.duplicates = 0
+        self.shared = False  # Đã giữ chỗ trong bảng chung
+
+class EntryDedup:
+    def __init__(self, ttl=10, max_distance=1, max_entries_per_barrier=32, max_barriers=256, wait_timeout=15,
+                 path=None):
+        """
+        Khởi tạo bảng dedup
+
+        Args:
+            ttl: Thời gian (giây) một lượt xe còn được dùng để bỏ entry lặp
+            max_distance: Khoảng cách sửa tối đa giữa hai biển số để coi là cùng xe (0 = phải trùng hẳn)
+            max_entries_per_barrier: Số lượt xe tối đa giữ lại cho mỗi barrier (cũ nhất bị bỏ trước)
+            max_barriers: Số barrier tối đa giữ trong bảng (LRU)
+            wait_timeout: Thời gian tối đa chờ lần gửi đầu đang chạy (giây), quá thì gửi như entry mới
+            path: File SQLite dùng chung giữa các process (None = chỉ dedup trong process này)
+        """
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.max_entries_per_barrier = max_entries_per_barrier
+        self.max_barriers = max_barriers
+        self.wait_timeout = wait_timeout
+        self.path = path
+
+        # barrier_key -> OrderedDict(biển số -> DedupEntry), cũ trước
+        self._barriers = OrderedDict()
+        self._lock = threading.Lock()
+        # Connection SQLite mở lười theo pid: EntryDedup tạo trong gunicorn master trước khi fork
+        self._db = None
+        self._db_pid = None
+        self._db_lock = threading.Lock()
+        self._stats = {
+            'reserved_total': 0,
+            'duplicates_total': 0,
+            'fuzzy_matches_total': 0,
+            'waited_total': 0,
+            'wait_timeouts_total': 0,
+            'expired_total': 0,
+            'evictions_total': 0,
+            'shared_duplicates_total': 0,
+            'shared_errors_total': 0
+        }
+
+    def reserve(self, barrier_key, license_plate):
+        """
+        Giữ chỗ cho một entry, hoặc tìm lượt xe trùng
+
+        Returns:
+            tuple: (DedupEntry vừa giữ chỗ, None) nếu là entry mới (gọi complete khi gửi xong),
+                (None, (body, status)) nếu trùng lượt xe trước (kết quả của lần đầu),
+                (None, None) nếu chờ lần đầu quá wait_timeout (gửi như bình thường, không giữ chỗ)
+        """
+        with self._lock:
+            match = self._find(barrier_key, license_plate)
+            if match is None:
+                entry = DedupEntry(barrier_key, license_plate)
+                self._insert(entry)
+                if self.path is None:
+                    self._stats['reserved_total'] += 1
+                    return entry, None
+            else:
+                match.duplicates += 1
+                if match.license_plate != license_plate:
+                    self._stats['fuzzy_matches_total'] += 1
+                in_flight = not match.done.is_set()
+                if in_flight:
+                    self._stats['waited_total'] += 1
+
+        if match is None:
+            # Không có trong process này: lượt xe có thể đang/đã được process khác gửi
+            return self._reserve_shared(entry)
+
+        # Lần đầu đang gửi (upload/server): chờ kết quả thay vì gửi song song
+        if in_flight and not match.done.wait(self.wait_timeout):
+            with self._lock:
+                self._stats['wait_timeouts_total'] += 1
+            logger.warning(f"⚠️ Dedup wait timed out for {license_plate} at {'/'.join(barrier_key)}")
+            return None, None
+
+        with self._lock:
+            self._stats['duplicates_total'] += 1
+        logger.info(
+            f"♻️ Duplicate entry {license_plate} at {'/'.join(barrier_key)} "
+            f"(original {match.license_plate}, {time.monotonic() - match.created_at:.1f}s ago)"
+        )
+        return None, match.outcome
+
+    def complete(self, entry, body=None, status=None):
+        """
+        Ghi kết quả của entry đã giữ chỗ; chỉ kết quả thành công (2xx) được giữ để dùng lại,
+        lỗi thì bỏ chỗ để lần gửi lại sau được xử lý như entry mới (các request đang chờ vẫn nhận kết quả lỗi)
+        """
+        self._complete_local(entry, body, status)
+        if entry.shared:
+            try:
+                self._complete_shared(entry)
+            except sqlite3.Error as e:
+                with self._lock:
+                    self._stats['shared_errors_total'] += 1
+                logger.warning(f"⚠️ Cannot store dedup entry {entry.license_plate}: {e}")
+
+    def _complete_local(self, entry, body=None, status=None):
+        entry.outcome = (body, status) if body is not None else None
+        if body is None or status >= 300:
+            with self._lock:
+                entries = self._barriers.get(entry.barrier_key)
+                if entries is not None and entries.get(entry.license_plate) is entry:
+                    del entries[entry.license_plate]
+        entry.done.set()
+
+    def _connection(self):
+        """Connection SQLite của process hiện tại (gọi khi giữ _db_lock)"""
+        if self._db is None or self._db_pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.executescript(SCHEMA)
+            self._db, self._db_pid = db, os.getpid()
+        return self._db
+
+    def _reserve_shared(self, entry):
+        """
+        Giữ chỗ trong bảng chung, hoặc dùng kết quả của process khác (cùng quy ước trả về với reserve)
+        Lỗi SQLite thì coi như entry mới (chỉ dedup trong process này)
+        """
+        barrier_key = '/'.join(entry.barrier_key)
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            try:
+                match = self._claim_shared(barrier_key, entry.license_plate)
+            except sqlite3.Error as e:
+                with self._lock:
+                    self._stats['shared_errors_total'] += 1
+                logger.warning(f"⚠️ Shared dedup unavailable, deduplicating in this process only: {e}")
+                match = None
+            else:
+                entry.shared = match is None
+
+            if match is None:
+                with self._lock:
+                    self._stats['reserved_total'] += 1
+                return entry, None
+
+            plate, done, outcome = match
+            if done:
+                outcome = tuple(json.loads(outcome))
+                # Request khác của process này đang chờ entry này cũng nhận kết quả đó
+                self._complete_local(entry, *outcome)
+                with self._lock:
+                    self._stats['duplicates_total'] += 1
+                    self._stats['shared_duplicates_total'] += 1
+                    if plate != entry.license_plate:
+                        self._stats['fuzzy_matches_total'] += 1
+                logger.info(
+                    f"♻️ Duplicate entry {entry.license_plate} at {barrier_key} (original {plate}, other process)"
+                )
+                return None, outcome
+
+            # Process khác đang gửi lượt xe này: chờ kết quả như request cùng process
+            if time.monotonic() >= deadline:
+                self._complete_local(entry)
+                with self._lock:
+                    self._stats['wait_timeouts_total'] += 1
+                logger.warning(f"⚠️ Dedup wait timed out for {entry.license_plate} at {barrier_key}")
+                return None, None
+            time.sleep(SHARED_POLL_INTERVAL)
+
+    def _claim_shared(self, barrier_key, license_plate):
+        """Tìm lượt xe trùng trong bảng chung, không có thì giữ chỗ (một transaction), trả về (biển số, done, outcome) hoặc None"""
+        with self._db_lock:
+            db = self._connection()
+            now = time.time()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                # Lượt xe hết hạn; lượt đang gửi quá lâu (process chết giữa chừng) cũng bỏ
+                db.execute(
+                    'DELETE FROM dedup_entries WHERE barrier_key = ? AND created_at < ? AND (done = 1 OR created_at < ?)',
+                    (barrier_key, now - self.ttl, now - self.ttl - self.wait_timeout)
+                )
+                rows = db.execute(
+                    'SELECT license_plate, done, outcome FROM dedup_entries WHERE barrier_key = ? '
+                    'ORDER BY created_at DESC LIMIT ?',
+                    (barrier_key, self.max_entries_per_barrier)
+                ).fetchall()
+                match = next((row for row in rows if row[0] == license_plate), None) or next(
+                    (row for row in rows if within_edit_distance(row[0], license_plate, self.max_distance)), None)
+                if match is None:
+                    db.execute(
+                        'INSERT OR REPLACE INTO dedup_entries (barrier_key, license_plate, created_at) VALUES (?, ?, ?)',
+                        (barrier_key, license_plate, now)
+                    )
+                db.execute('COMMIT')
+            except Exception:
+                db.execute('ROLLBACK')
+                raise
+        return match
+
+    def _complete_shared(self, entry):
+        """Lưu kết quả thành công cho process khác dùng lại, lỗi thì bỏ chỗ"""
+        barrier_key = '/'.join(entry.barrier_key)
+        with self._db_lock:
+            db = self._connection()
+            if entry.outcome is None or entry.outcome[1] >= 300:
+                db.execute('DELETE FROM dedup_entries WHERE barrier_key = ? AND license_plate = ?',
+                           (barrier_key, entry.license_plate))
+            else:
+                db.execute('UPDATE dedup_entries SET done = 1, outcome = ? WHERE barrier_key = ? AND license_plate = ?',
+                           (json.dumps(entry.outcome), barrier_key, entry.license_plate))
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = sum(len(entries) for entries in self._barriers.values())
+            stats['barriers'] = len(self._barriers)
+        stats.update({
+            'ttl': self.ttl,
+            'max_distance': self.max_distance,
+            'shared': self.path is not None
+        })
+        return stats
+
+    def _find(self, barrier_key, license_plate):
+        entries = self._barriers.get(barrier_key)
+        if entries is None:
+            return None
+        self._barriers.move_to_end(barrier_key)
+
+        # Bỏ lượt xe hết hạn (cũ trước nên dừng ở lượt đầu tiên còn hạn), lượt đang gửi thì giữ lại
+        now = time.monotonic()
+        for key in list(entries):
+            entry = entries[key]
+            if now - entry.created_at <= self.ttl:
+                break
+            if entry.done.is_set():
+                del entries[key]
+                self._stats['expired_total'] += 1
+
+        exact = entries.get(license_plate)
+        if exact is not None:
+            return exact
+        for entry in reversed(entries.values()):
+            if within_edit_distance(entry.license_plate, license_plate, self.max_distance):
+                return entry
+        return None
+
+    def _insert(self, entry):
+        entries = self._barriers.get(entry.barrier_key)
+        if entries is None:
+            entries = OrderedDict()
+            self._barriers[entry.barrier_key] = entries
+            if len(self._barriers) > self.max_barriers:
+                self._barriers.popitem(last=False)
+                self._stats['evictions_total'] += 1
+        self._barriers.move_to_end(entry.barrier_key)
+
+        entries.pop(entry.license_plate, None)
+        entries[entry.license_plate] = entry
+        while len(entries) > self.max_entries_per_barrier:
+            entries.popitem(last=False)
+            self._stats['evictions_total'] += 1
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Entry Journal - Store-and-forward cho sự kiện xe vào khi server chính không trả lời
+Entry được ghi vào SQLite (WAL) trong vài ms, thread nền gửi lại cho server theo đúng thứ tự,
+theo batch, kèm idempotency key để gửi lặp không tạo phiên gửi xe trùng. Journal giữ lại qua restart
+"""
+
+import os
+import json
+import time
+import fcntl
+import random
+import sqlite3
+import logging
+import threading
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS rejected_entries (
+    seq INTEGER PRIMARY KEY,
+    idempotency_key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    rejected_at REAL NOT NULL,
+    status INTEGER NOT NULL,
+    response TEXT
+);
+"""
+
+class EntryJournal:
+    def __init__(self, path, send_batch, batch_size=20, retry_base_delay=1.0, retry_max_delay=60.0, poll_interval=1.0):
+        """
+        Khởi tạo journal
+
+        Args:
+            path: File SQLite (thư mục được tạo nếu chưa có)
+            send_batch: Hàm send_batch(list payload) -> list (status HTTP, body) theo đúng thứ tự gửi,
+                raise khi không gửi được cả batch
+            batch_size: Số entry tối đa mỗi lần gửi
+            retry_base_delay: Thời gian chờ cơ bản trước khi gửi lại (tăng gấp đôi mỗi lần lỗi liên tiếp)
+            retry_max_delay: Thời gian chờ tối đa giữa hai lần gửi lại
+            poll_interval: Chu kỳ kiểm tra entry mới do process khác ghi (gunicorn nhiều worker)
+        """
+        self.path = path
+        self.send_batch = send_batch
+        self.batch_size = max(1, int(batch_size))
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.poll_interval = poll_interval
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # WAL: ghi append không chặn đọc, synchronous=NORMAL vẫn an toàn khi process chết
+        self._db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._drain_lock_fd = None
+        self._failures = 0
+        self._stats = {
+            'appended_total': 0,
+            'delivered_total': 0,
+            'rejected_total': 0,
+            'send_failures_total': 0,
+            'batches_total': 0,
+            'last_error': None,
+            'last_delivered_at': None
+        }
+
+    def start(self):
+        """Khởi động thread gửi lại (entry còn trong journal từ lần chạy trước được gửi tiếp)"""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._drain_loop, name="entry-journal-drainer", daemon=True)
+        self._thread.start()
+        logger.info(f"✅ Entry journal started ({self.path}, backlog: {self.backlog()})")
+
+    def stop(self):
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._drain_lock_fd is not None:
+            os.close(self._drain_lock_fd)
+            self._drain_lock_fd = None
+
+    def append(self, payload: dict) -> int:
+        """
+        Ghi một entry (payload phải có idempotencyKey), trả về số thứ tự trong journal
+        Ghi trùng idempotency key thì giữ bản đầu tiên
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT OR IGNORE INTO entries (idempotency_key, payload, created_at) VALUES (?, ?, ?)',
+                (payload['idempotencyKey'], json.dumps(payload), time.time())
+            )
+            self._stats['appended_total'] += cursor.rowcount
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def has_backlog(self) -> bool:
+        """Còn entry chưa gửi được (kể cả do process khác ghi)"""
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM entries LIMIT 1').fetchone() is not None
+
+    def backlog(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            count, oldest, max_attempts = self._db.execute(
+                'SELECT COUNT(*), MIN(created_at), MAX(attempts) FROM entries'
+            ).fetchone()
+            rejected = self._db.execute('SELECT COUNT(*) FROM rejected_entries').fetchone()[0]
+        stats.update({
+            'path': self.path,
+            'backlog': count,
+            'oldest_age_seconds': round(time.time() - oldest, 1) if oldest else None,
+            'max_attempts': max_attempts or 0,
+            'rejected_stored': rejected,
+            'draining': self._drain_lock_fd is not None
+        })
+        return stats
+
+    def _acquire_drain_lock(self) -> bool:
+        """Chỉ một process gửi lại journal (flock, tự nhả khi process chết), các process khác chỉ ghi"""
+        if self._drain_lock_fd is not None:
+            return True
+        fd = os.open(self.path + '.drain.lock', os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._drain_lock_fd = fd
+        return True
+
+    def _drain_loop(self):
+        while not self._stop_event.is_set():
+            if not self._acquire_drain_lock():
+                self._stop_event.wait(self.poll_interval)
+                continue
+
+            with self._lock:
+                rows = self._db.execute(
+                    'SELECT seq, idempotency_key, payload, created_at FROM entries ORDER BY seq LIMIT ?',
+                    (self.batch_size,)
+                ).fetchall()
+
+            if not rows:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            if self._send(rows):
+                self._failures = 0
+            else:
+                self._failures += 1
+                delay = min(self.retry_max_delay, self.retry_base_delay * (2 ** (self._failures - 1)))
+                self._stop_event.wait(delay * random.uniform(0.8, 1.2))
+
+    def _send(self, rows) -> bool:
+        """Gửi một batch, xoá các entry đã xong theo thứ tự; trả về False nếu phải dừng để thử lại sau"""
+        try:
+            results = self.send_batch([json.loads(payload) for _, _, payload, _ in rows])
+            if len(results) != len(rows):
+                raise ValueError(f"Expected {len(rows)} results, got {len(results)}")
+        except Exception as e:
+            self._record_failure([seq for seq, _, _, _ in rows], str(e))
+            logger.warning(f"⚠️ Entry journal: cannot send {len(rows)} entries ({e}), backlog kept")
+            return False
+
+        delivered, rejected = [], []
+        blocked_error = None
+        for row, (status, body) in zip(rows, results):
+            if status < 300:
+                delivered.append(row)
+            elif status < 500:
+                # Server từ chối hẳn (dữ liệu không hợp lệ, xe đang có phiên): gửi lại cũng vậy, chuyển sang rejected
+                rejected.append((row, status, body))
+            else:
+                # Lỗi phía server: dừng ở đây để giữ thứ tự, các entry sau gửi lại cùng lúc
+                blocked_error = f"HTTP {status}"
+                break
+
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            self._db.executemany('DELETE FROM entries WHERE seq = ?', [(row[0],) for row in delivered])
+            for (seq, key, payload, created_at), status, body in rejected:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO rejected_entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (seq, key, payload, created_at, time.time(), status, json.dumps(body, default=str))
+                )
+                self._db.execute('DELETE FROM entries WHERE seq = ?', (seq,))
+            self._db.execute('COMMIT')
+            self._stats['batches_total'] += 1
+            self._stats['delivered_total'] += len(delivered)
+            self._stats['rejected_total'] += len(rejected)
+            if delivered:
+                self._stats['last_delivered_at'] = time.time()
+
+        for (_, key, _, created_at), status, body in rejected:
+            logger.warning(f"⚠️ Entry {key} rejected by server (HTTP {status}): {body}")
+        if delivered:
+            oldest_age = time.time() - delivered[0][3]
+            logger.info(f"📬 Entry journal: delivered {len(delivered)} entries (oldest waited {oldest_age:.1f}s)")
+
+        if blocked_error:
+            remaining = [row[0] for row in rows[len(delivered) + len(rejected):]]
+            self._record_failure(remaining, blocked_error)
+            return False
+        return True
+
+    def _record_failure(self, seqs, error):
+        with self._lock:
+            self._db.executemany(
+                'UPDATE entries SET attempts = attempts + 1, last_error = ? WHERE seq = ?',
+                [(error, seq) for seq in seqs]
+            )
+            self._stats['send_failures_total'] += 1
+            self._stats['last_error'] = error
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Export Models - Chuyển model detection/recognition của PaddleOCR sang ONNX và quantize INT8
+Kết quả là thư mục model cho backend onnxruntime/openvino (ALPR_OCR_MODEL_DIR)
+Dữ liệu calibration INT8 sinh từ synthetic_plates.py nên không cần ảnh thật
+"""
+
+import os
+import glob
+import shutil
+import argparse
+import logging
+import subprocess
+
+import numpy as np
+
+from ocr_backends import MODEL_FILES, DICT_FILE, preprocess_det, preprocess_rec
+from synthetic_plates import FONTS, LAYOUTS, CONDITIONS, generate_corpus, random_plate, render_plate, apply_condition
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def export_onnx(paddle_model_dir: str, output_path: str, opset=14):
+    """Chuyển một inference model của Paddle (inference.json hoặc inference.pdmodel) sang ONNX bằng paddle2onnx"""
+    if shutil.which('paddle2onnx') is None:
+        raise RuntimeError("paddle2onnx is not installed (pip install paddle2onnx)")
+
+    model_file = next(
+        (name for name in ('inference.json', 'inference.pdmodel') if os.path.exists(os.path.join(paddle_model_dir, name))),
+        None
+    )
+    if model_file is None:
+        raise FileNotFoundError(f"No inference.json/inference.pdmodel in {paddle_model_dir}")
+
+    subprocess.run([
+        'paddle2onnx',
+        '--model_dir', paddle_model_dir,
+        '--model_filename', model_file,
+        '--params_filename', 'inference.pdiparams',
+        '--save_file', output_path,
+        '--opset_version', str(opset)
+    ], check=True)
+    logger.info(f"✅ Exported {paddle_model_dir} -> {output_path}")
+
+def write_dict(rec_model_dir: str, output_path: str, dict_path=None):
+    """
+    Ghi bảng ký tự của model recognition: lấy từ file dict cho trước,
+    hoặc từ PostProcess.character_dict trong inference.yml của model
+    """
+    if dict_path:
+        shutil.copyfile(dict_path, output_path)
+        return
+
+    import yaml
+
+    with open(os.path.join(rec_model_dir, 'inference.yml'), 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    characters = config['PostProcess']['character_dict']
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(characters) + '\n')
+
+def det_calibration_tensors(count, seed=0):
+    """Ảnh toàn cảnh giả lập, đã tiền xử lý như lúc chạy model detection"""
+    return [preprocess_det(sample['image'])[0] for sample in generate_corpus(count, seed=seed)]
+
+def rec_calibration_tensors(count, seed=0):
+    """Dòng biển số giả lập (đủ font, layout, điều kiện chụp), đã tiền xử lý như lúc chạy model recognition"""
+    rng = np.random.RandomState(seed)
+    font_names = sorted(FONTS)
+    tensors = []
+    for index in range(count):
+        lines, _ = random_plate(rng, LAYOUTS[index % len(LAYOUTS)])
+        font = FONTS[font_names[index % len(font_names)]]
+        for line in lines:
+            crop = render_plate([line], font, plate_height=int(rng.randint(32, 96)))
+            crop = apply_condition(crop, CONDITIONS[index % len(CONDITIONS)], rng)
+            tensors.append(preprocess_rec([crop]))
+    return tensors
+
+def quantize_int8(model_path: str, output_path: str, tensors: list):
+    """Quantize tĩnh INT8 (QDQ, per-channel) bằng ONNX Runtime, calibration trên các tensor cho trước"""
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    input_name = ort.InferenceSession(model_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+
+    class _CalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self._inputs = iter([{input_name: tensor} for tensor in tensors])
+
+        def get_next(self):
+            return next(self._inputs, None)
+
+    prepared_path = output_path + '.prep.onnx'
+    try:
+        quant_pre_process(model_path, prepared_path, skip_symbolic_shape=True)
+        quantize_static(
+            prepared_path,
+            output_path,
+            _CalibrationReader(),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8
+        )
+    finally:
+        for path in glob.glob(prepared_path + '*'):
+            os.remove(path)
+    logger.info(f"✅ Quantized {model_path} -> {output_path} ({len(tensors)} calibration samples)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Export model PaddleOCR sang ONNX (FP32 + INT8) cho backend onnxruntime/openvino')
+    parser.add_argument('--det-model-dir', required=True, help='Inference model detection của PaddleOCR')
+    parser.add_argument('--rec-model-dir', required=True, help='Inference model recognition của PaddleOCR')
+    parser.add_argument('--output', required=True, help='Thư mục kết quả (ALPR_OCR_MODEL_DIR)')
+    parser.add_argument('--dict', help='File bảng ký tự (mặc định đọc từ inference.yml của model recognition)')
+    parser.add_argument('--opset', type=int, default=14, help='ONNX opset')
+    parser.add_argument('--quantize', action='store_true', help='Tạo thêm bản INT8')
+    parser.add_argument('--calibration-count', type=int, default=64, help='Số ảnh giả lập dùng để calibration INT8')
+    parser.add_argument('--seed', type=int, default=0, help='Seed sinh ảnh calibration')
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    det_path, rec_path = (os.path.join(args.output, name) for name in MODEL_FILES['fp32'])
+
+    export_onnx(args.det_model_dir, det_path, args.opset)
+    export_onnx(args.rec_model_dir, rec_path, args.opset)
+    write_dict(args.rec_model_dir, os.path.join(args.output, DICT_FILE), args.dict)
+
+    if args.quantize:
+        det_int8_path, rec_int8_path = (os.path.join(args.output, name) for name in MODEL_FILES['int8'])
+        quantize_int8(det_path, det_int8_path, det_calibration_tensors(args.calibration_count, args.seed))
+        quantize_int8(rec_path, rec_int8_path, rec_calibration_tensors(args.calibration_count, args.seed))
+
+    print(f"📦 Models written to {args.output}")
+    print(f"   ALPR_OCR_BACKEND=onnxruntime ALPR_OCR_MODEL_DIR={args.output} ALPR_OCR_PRECISION={'int8' if args.quantize else 'fp32'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Frame Cache - Cache kết quả OCR theo perceptual hash (dHash) của ảnh
+ESP32 gửi lại gần như cùng một ảnh khi RFID retry, ảnh gần giống sẽ dùng lại kết quả cũ
+"""
+
+import cv2
+import numpy as np
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def dhash(image, hash_size=8) -> int:
+    """
+    Tính difference hash của ảnh
+
+    Args:
+        image: Ảnh BGR hoặc grayscale
+        hash_size: Kích thước hash (hash_size x hash_size bit)
+
+    Returns:
+        int: Hash dạng số nguyên hash_size * hash_size bit
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    diff = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(diff).tobytes(), 'big')
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+class FrameCache:
+    def __init__(self, ttl=10, max_entries_per_barrier=16, max_barriers=256, hamming_threshold=6):
+        """
+        Khởi tạo frame cache
+
+        Args:
+            ttl: Thời gian sống của mỗi kết quả (giây)
+            max_entries_per_barrier: Số ảnh tối đa giữ lại cho mỗi barrier (LRU)
+            max_barriers: Số barrier tối đa giữ cache (LRU)
+            hamming_threshold: Khoảng cách Hamming tối đa để coi là cùng một ảnh (trên 64 bit)
+        """
+        self.ttl = ttl
+        self.max_entries_per_barrier = max_entries_per_barrier
+        self.max_barriers = max_barriers
+        self.hamming_threshold = hamming_threshold
+
+        # barrier_key -> OrderedDict(frame_hash -> (thời điểm lưu, kết quả))
+        self._barriers = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+
+    def lookup(self, barrier_key, frame_hash):
+        """
+        Tìm kết quả của ảnh gần giống trong cache của barrier
+
+        Returns:
+            dict: Kết quả process_image đã lưu, None nếu không có
+        """
+        now = time.monotonic()
+        with self._lock:
+            entries = self._barriers.get(barrier_key)
+            if entries is not None:
+                self._barriers.move_to_end(barrier_key)
+
+                # Bỏ các kết quả đã hết hạn
+                expired = [key for key, (stored_at, _) in entries.items() if now - stored_at > self.ttl]
+                for key in expired:
+                    del entries[key]
+                self._stats['expired'] += len(expired)
+
+                best_key, best_distance = None, None
+                for key in entries:
+                    distance = hamming_distance(key, frame_hash)
+                    if distance <= self.hamming_threshold and (best_distance is None or distance < best_distance):
+                        best_key, best_distance = key, distance
+
+                if best_key is not None:
+                    entries.move_to_end(best_key)
+                    self._stats['hits'] += 1
+                    return entries[best_key][1]
+
+            self._stats['misses'] += 1
+            return None
+
+    def store(self, barrier_key, frame_hash, result):
+        """Lưu kết quả process_image của ảnh"""
+        with self._lock:
+            entries = self._barriers.get(barrier_key)
+            if entries is None:
+                entries = OrderedDict()
+                self._barriers[barrier_key] = entries
+                if len(self._barriers) > self.max_barriers:
+                    self._barriers.popitem(last=False)
+                    self._stats['evictions'] += 1
+            self._barriers.move_to_end(barrier_key)
+
+            entries[frame_hash] = (time.monotonic(), result)
+            entries.move_to_end(frame_hash)
+            while len(entries) > self.max_entries_per_barrier:
+                entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def get_stats(self) -> dict:
+        """Thống kê hit/miss của cache"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = sum(len(entries) for entries in self._barriers.values())
+            stats['barriers'] = len(self._barriers)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0
+        stats.update({
+            'ttl': self.ttl,
+            'hamming_threshold': self.hamming_threshold
+        })
+        return stats
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Frame Decoder - Đọc và decode ảnh upload
+Đọc body vào buffer dùng lại giữa các request, decode JPEG thu nhỏ ngay trong miền DCT khi có thể
+"""
+
+import cv2
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Hệ số thu nhỏ khi decode -> flag của OpenCV (libjpeg scale 1/2, 1/4, 1/8 trong miền DCT)
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+# Marker SOF chứa kích thước ảnh (bỏ DHT C4, JPG C8, DAC CC)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def jpeg_size(data):
+    """
+    Đọc kích thước ảnh JPEG từ header, không decode
+
+    Returns:
+        tuple: (width, height), None nếu không phải JPEG hợp lệ
+    """
+    view = memoryview(data)
+    if len(view) < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+
+    position = 2
+    while position + 9 < len(view):
+        if view[position] != 0xFF:
+            return None
+        marker = view[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            position += 2
+            continue
+
+        segment_length = (view[position + 2] << 8) | view[position + 3]
+        if marker in _SOF_MARKERS:
+            height = (view[position + 5] << 8) | view[position + 6]
+            width = (view[position + 7] << 8) | view[position + 8]
+            return width, height
+        position += 2 + segment_length
+
+    return None
+
+class FrameTooLargeError(ValueError):
+    """Body ảnh vượt quá giới hạn cho phép"""
+
+class BufferPool:
+    def __init__(self, max_buffers=8, initial_size=512 * 1024):
+        """
+        Pool bytearray dùng lại để đọc body request
+
+        Args:
+            max_buffers: Số buffer tối đa giữ lại trong pool
+            initial_size: Kích thước ban đầu của mỗi buffer
+        """
+        self.max_buffers = max_buffers
+        self.initial_size = initial_size
+        self._free = []
+        self._lock = threading.Lock()
+        self._stats = {'acquired_total': 0, 'allocated_total': 0, 'grown_total': 0}
+
+    def acquire(self) -> bytearray:
+        with self._lock:
+            self._stats['acquired_total'] += 1
+            if self._free:
+                return self._free.pop()
+            self._stats['allocated_total'] += 1
+        return bytearray(self.initial_size)
+
+    def grow(self, buffer: bytearray, size: int):
+        """Nới buffer lên ít nhất size byte (buffer lớn được giữ lại cho lần sau)"""
+        if size <= len(buffer):
+            return
+        buffer.extend(bytes(size - len(buffer)))
+        with self._lock:
+            self._stats['grown_total'] += 1
+
+    def release(self, buffer: bytearray):
+        with self._lock:
+            if len(self._free) < self.max_buffers:
+                self._free.append(buffer)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['free_buffers'] = len(self._free)
+        return stats
+
+class FrameDecoder:
+    def __init__(self, plan_scale=None, max_buffers=8, initial_buffer_size=512 * 1024):
+        """
+        Khởi tạo frame decoder
+
+        Args:
+            plan_scale: Hàm (width, height) -> tỉ lệ thu nhỏ mà pipeline OCR cần (vd. plan_ocr_scale)
+            max_buffers: Số buffer đọc body giữ lại trong pool
+            initial_buffer_size: Kích thước ban đầu mỗi buffer
+        """
+        self.plan_scale = plan_scale
+        self.pool = BufferPool(max_buffers, initial_buffer_size)
+        self._lock = threading.Lock()
+        self._stats = {'decoded_total': 0, 'reduced_total': 0, 'decode_time_total': 0.0}
+
+    @contextmanager
+    def read(self, stream, size_hint=None, max_bytes=None):
+        """
+        Đọc toàn bộ stream vào buffer của pool
+
+        Args:
+            stream: Stream có readinto (file upload, request.stream kể cả body chunked)
+            size_hint: Kích thước dự kiến (Content-Length), nới buffer một lần trước khi đọc
+            max_bytes: Giới hạn kích thước, vượt quá thì raise FrameTooLargeError
+
+        Yields:
+            memoryview: Dữ liệu đã đọc (chỉ dùng trong khối with, buffer được trả về pool sau đó)
+        """
+        buffer = self.pool.acquire()
+        length = 0
+        try:
+            if size_hint and size_hint >= len(buffer):
+                # Đọc hết trong một buffer đủ lớn (+1 byte để nhận ra EOF mà không phải nới thêm)
+                self.pool.grow(buffer, size_hint + 1)
+            while True:
+                if max_bytes is not None and length > max_bytes:
+                    raise FrameTooLargeError(f"Frame larger than {max_bytes} bytes")
+                if length == len(buffer):
+                    # Buffer đầy -> nới gấp đôi
+                    self.pool.grow(buffer, 2 * len(buffer))
+                read = stream.readinto(memoryview(buffer)[length:])
+                if not read:
+                    break
+                length += read
+
+            view = memoryview(buffer)[:length]
+            try:
+                yield view
+            finally:
+                view.release()
+        finally:
+            self.pool.release(buffer)
+
+    def choose_reduction(self, data) -> int:
+        """Hệ số thu nhỏ lớn nhất (1/2/4/8) mà vẫn không nhỏ hơn tỉ lệ pipeline OCR cần"""
+        if self.plan_scale is None:
+            return 1
+        size = jpeg_size(data)
+        if size is None:
+            return 1
+
+        scale = self.plan_scale(*size)
+        reduction = 1
+        for candidate in (2, 4, 8):
+            if 1.0 / candidate >= scale:
+                reduction = candidate
+        return reduction
+
+    def decode(self, data, reduction=None):
+        """
+        Decode ảnh từ bytes/memoryview
+
+        Args:
+            data: Dữ liệu ảnh
+            reduction: Hệ số thu nhỏ (1/2/4/8), None thì tự chọn theo plan_scale
+
+        Returns:
+            tuple: (ảnh BGR hoặc None, hệ số thu nhỏ đã dùng, thời gian decode (giây))
+        """
+        start_time = time.perf_counter()
+        if reduction is None:
+            reduction = self.choose_reduction(data)
+
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), REDUCED_DECODE_FLAGS.get(reduction, cv2.IMREAD_COLOR))
+        decode_time = time.perf_counter() - start_time
+
+        with self._lock:
+            self._stats['decoded_total'] += 1
+            self._stats['decode_time_total'] += decode_time
+            if reduction > 1:
+                self._stats['reduced_total'] += 1
+
+        return image, reduction, decode_time
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        decoded = stats['decoded_total']
+        stats['avg_decode_ms'] = round(stats.pop('decode_time_total') / decoded * 1000, 2) if decoded else 0
+        stats['buffer_pool'] = self.pool.get_stats()
+        return stats
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Frame Prefilter - Loại nhanh (vài ms, NumPy) các ảnh chắc chắn không có biển số trước khi chạy OCR
+Làn trống, ảnh đêm chỉ thấy đèn pha, barrier đóng, ảnh nhoè: trả về lý do loại cụ thể
+Ngưỡng cấu hình riêng cho từng barrier, thống kê thời gian model tiết kiệm được
+"""
+
+import time
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Ngưỡng mặc định, chọn thận trọng: bộ ảnh synthetic_plates (kể cả blur/night) không bị loại ảnh nào
+DEFAULT_THRESHOLDS = {
+    'min_peak_brightness': 60,     # Phân vị 99.5 của độ sáng: thấp hơn = cả ảnh tối, không có gì được chiếu sáng
+    'max_mean_brightness': 240,    # Trung bình độ sáng: cao hơn = cháy sáng
+    'min_contrast': 8.0,           # Độ lệch chuẩn độ sáng: thấp hơn = ảnh phẳng (barrier đóng, ống kính bị che)
+    'min_sharpness': 20.0,         # Phương sai Laplacian: thấp hơn = nhoè
+    'min_edge_density': 0.004,     # Tỉ lệ pixel có cạnh dọc mạnh trên cả ảnh: thấp hơn = làn trống/ảnh phẳng
+    'min_window_density': 0.25     # Mật độ cạnh dọc lớn nhất trong cửa sổ hình biển số
+}
+
+REJECT_REASONS = ('too_dark', 'overexposed', 'blurred', 'no_edges', 'no_plate_shape')
+
+class FramePrefilter:
+    def __init__(self, thresholds=None, barrier_thresholds=None, work_width=320, edge_threshold=40,
+                 window_heights=(0.06, 0.09, 0.13, 0.2), window_aspects=(1.3, 2.5, 4.5)):
+        """
+        Khởi tạo prefilter
+
+        Args:
+            thresholds: Ghi đè ngưỡng mặc định (xem DEFAULT_THRESHOLDS)
+            barrier_thresholds: Ngưỡng riêng từng barrier, {"lot/barrier": {...}} ghi đè lên thresholds
+            work_width: Ảnh được thu nhỏ về chiều rộng này trước khi kiểm tra
+            edge_threshold: Chênh lệch độ sáng giữa hai pixel liền kề để tính là cạnh dọc
+            window_heights: Chiều cao cửa sổ tìm biển số theo tỉ lệ chiều cao ảnh
+            window_aspects: Tỉ lệ rộng/cao của cửa sổ (biển vuông 2 dòng đến biển dài 1 dòng)
+        """
+        self.thresholds = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+        self.barrier_thresholds = {
+            key: dict(self.thresholds, **overrides) for key, overrides in (barrier_thresholds or {}).items()
+        }
+        self.work_width = work_width
+        self.edge_threshold = edge_threshold
+        self.window_heights = window_heights
+        self.window_aspects = window_aspects
+
+        self._lock = threading.Lock()
+        self._ocr_seconds = None  # EMA thời gian OCR một ảnh, để ước lượng thời gian tiết kiệm
+        self._stats = {
+            'checked_total': 0,
+            'rejected_total': 0,
+            'check_seconds_total': 0.0,
+            'saved_seconds_total': 0.0,
+            'rejected_by_reason': {reason: 0 for reason in REJECT_REASONS}
+        }
+
+    def thresholds_for(self, barrier_key=None) -> dict:
+        """Ngưỡng áp dụng cho barrier (parkingLotId, barrierId)"""
+        if barrier_key is None:
+            return self.thresholds
+        return self.barrier_thresholds.get('/'.join(barrier_key), self.thresholds)
+
+    def check(self, image: np.ndarray, barrier_key=None) -> dict:
+        """
+        Kiểm tra một ảnh
+
+        Args:
+            image: Ảnh BGR (hoặc grayscale)
+            barrier_key: (parkingLotId, barrierId) để chọn ngưỡng
+
+        Returns:
+            dict: passed, reason (None nếu qua), các chỉ số đã đo, check_time (giây),
+                saved_time (ước lượng thời gian OCR tiết kiệm nếu bị loại)
+        """
+        start_time = time.perf_counter()
+        thresholds = self.thresholds_for(barrier_key)
+        measures = self.measure(image, thresholds)
+        reason = self._reject_reason(measures, thresholds)
+        check_time = time.perf_counter() - start_time
+
+        saved_time = 0.0
+        with self._lock:
+            self._stats['checked_total'] += 1
+            self._stats['check_seconds_total'] += check_time
+            if reason:
+                saved_time = max(0.0, (self._ocr_seconds or 0.0) - check_time)
+                self._stats['rejected_total'] += 1
+                self._stats['rejected_by_reason'][reason] += 1
+                self._stats['saved_seconds_total'] += saved_time
+
+        return dict(
+            measures,
+            passed=reason is None,
+            reason=reason,
+            check_time=round(check_time, 6),
+            saved_time=round(saved_time, 4)
+        )
+
+    def observe_ocr_time(self, seconds):
+        """Cập nhật thời gian OCR trung bình của ảnh đã qua prefilter"""
+        with self._lock:
+            if self._ocr_seconds is None:
+                self._ocr_seconds = seconds
+            else:
+                self._ocr_seconds = 0.9 * self._ocr_seconds + 0.1 * seconds
+
+    def measure(self, image: np.ndarray, thresholds=None) -> dict:
+        """
+        Đo độ sáng, độ nét, mật độ cạnh trên ảnh thu nhỏ; chỉ tìm cửa sổ hình biển số khi các bước rẻ hơn đã qua
+        """
+        thresholds = thresholds or self.thresholds
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        height, width = gray.shape[:2]
+        if width > self.work_width:
+            gray = cv2.resize(gray, (self.work_width, max(1, int(height * self.work_width / float(width)))),
+                              interpolation=cv2.INTER_AREA)
+        pixels = gray.astype(np.int16)
+
+        measures = {
+            'peak_brightness': float(np.percentile(gray, 99.5)),
+            'mean_brightness': round(float(gray.mean()), 2),
+            'contrast': round(float(gray.std()), 2)
+        }
+
+        # Laplacian 4 lân cận
+        laplacian = (4 * pixels[1:-1, 1:-1] - pixels[:-2, 1:-1] - pixels[2:, 1:-1]
+                     - pixels[1:-1, :-2] - pixels[1:-1, 2:])
+        measures['sharpness'] = round(float(laplacian.var()), 2) if laplacian.size else 0.0
+
+        # Ký tự biển số tạo nhiều cạnh dọc (gradient theo trục x)
+        edges = np.abs(np.diff(pixels, axis=1)) > self.edge_threshold
+        measures['edge_density'] = round(float(edges.mean()), 5) if edges.size else 0.0
+
+        measures['window_density'] = None
+        if measures['edge_density'] >= thresholds['min_edge_density']:
+            measures['window_density'] = round(self._best_window_density(edges), 4)
+        return measures
+
+    def _best_window_density(self, edges: np.ndarray) -> float:
+        """Mật độ cạnh lớn nhất trong các cửa sổ hình biển số (mọi vị trí, tính bằng integral image)"""
+        height, width = edges.shape
+        integral = np.zeros((height + 1, width + 1), dtype=np.int32)
+        integral[1:, 1:] = edges.cumsum(axis=0, dtype=np.int32).cumsum(axis=1)
+
+        best = 0.0
+        for height_ratio in self.window_heights:
+            window_h = max(2, int(round(height * height_ratio)))
+            for aspect in self.window_aspects:
+                window_w = max(2, int(round(window_h * aspect)))
+                if window_h > height or window_w > width:
+                    continue
+                sums = (integral[window_h:, window_w:] - integral[:-window_h, window_w:]
+                        - integral[window_h:, :-window_w] + integral[:-window_h, :-window_w])
+                best = max(best, float(sums.max()) / (window_h * window_w))
+        return best
+
+    @staticmethod
+    def _reject_reason(measures: dict, thresholds: dict):
+        if measures['peak_brightness'] < thresholds['min_peak_brightness']:
+            return 'too_dark'
+        if measures['mean_brightness'] > thresholds['max_mean_brightness']:
+            return 'overexposed'
+        if measures['contrast'] < thresholds['min_contrast']:
+            return 'no_edges'
+        if measures['sharpness'] < thresholds['min_sharpness']:
+            return 'blurred'
+        if measures['edge_density'] < thresholds['min_edge_density']:
+            return 'no_edges'
+        if measures['window_density'] < thresholds['min_window_density']:
+            return 'no_plate_shape'
+        return None
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats, rejected_by_reason=dict(self._stats['rejected_by_reason']))
+            ocr_seconds = self._ocr_seconds
+        checked = stats['checked_total']
+        stats.update({
+            'reject_rate': round(stats['rejected_total'] / checked, 4) if checked else 0.0,
+            'avg_check_ms': round(stats['check_seconds_total'] / checked * 1000, 3) if checked else 0.0,
+            'avg_ocr_ms': round(ocr_seconds * 1000, 2) if ocr_seconds else None,
+            'check_seconds_total': round(stats['check_seconds_total'], 4),
+            'saved_seconds_total': round(stats['saved_seconds_total'], 4),
+            'thresholds': self.thresholds,
+            'barrier_thresholds': self.barrier_thresholds
+        })
+        return stats
+
+def _hopeless_frames(rng, count, frame_size=(1280, 720)):
+    """Ảnh không có biển số: làn trống, đêm chỉ có đèn pha, ảnh tối, ảnh nhoè"""
+    frame_width, frame_height = frame_size
+    frames = []
+    for index in range(count):
+        kind = ('empty_lane', 'headlights', 'dark', 'blurred')[index % 4]
+        background = np.tile(np.linspace(60, 140, frame_width, dtype=np.uint8), (frame_height, 1))
+        frame = cv2.cvtColor(background, cv2.COLOR_GRAY2BGR)
+        if kind == 'empty_lane':
+            # Mặt đường và vạch kẻ
+            cv2.line(frame, (frame_width // 2, frame_height), (frame_width // 2 + int(rng.randint(-100, 100)), frame_height // 3),
+                     (230, 230, 230), 12)
+        elif kind == 'headlights':
+            frame = np.full((frame_height, frame_width, 3), int(rng.randint(3, 15)), np.uint8)
+            y = int(rng.randint(frame_height // 3, frame_height - 100))
+            for x in (int(rng.randint(200, 500)), int(rng.randint(700, 1000))):
+                cv2.circle(frame, (x, y), int(rng.randint(30, 60)), (255, 255, 255), -1)
+            frame = cv2.GaussianBlur(frame, (9, 9), 0)
+        elif kind == 'dark':
+            frame = (frame // 5).astype(np.uint8)
+        else:
+            frame = cv2.GaussianBlur(frame, (31, 31), 0)
+        noise = rng.normal(0, 3, frame.shape)
+        frames.append((kind, np.clip(frame.astype(np.float32) + noise, 0, 255).astype(np.uint8)))
+    return frames
+
+def benchmark_prefilter(count=200, seed=0):
+    """Tỉ lệ loại trên ảnh có biển số (phải gần 0) và ảnh không có biển số, thời gian kiểm tra mỗi ảnh"""
+    from synthetic_plates import generate_corpus
+
+    print("🧪 Benchmarking frame prefilter...")
+    prefilter = FramePrefilter()
+    rng = np.random.RandomState(seed)
+
+    plates = generate_corpus(count, seed=seed)
+    false_rejects = {}
+    start_time = time.perf_counter()
+    for sample in plates:
+        result = prefilter.check(sample['image'])
+        if not result['passed']:
+            key = f"{sample['condition']}:{result['reason']}"
+            false_rejects[key] = false_rejects.get(key, 0) + 1
+    plate_time = time.perf_counter() - start_time
+
+    hopeless = _hopeless_frames(rng, count)
+    missed = {}
+    start_time = time.perf_counter()
+    for kind, frame in hopeless:
+        if prefilter.check(frame)['passed']:
+            missed[kind] = missed.get(kind, 0) + 1
+    hopeless_time = time.perf_counter() - start_time
+
+    print(f"📊 {count} plate frames: {sum(false_rejects.values())} rejected {false_rejects or ''}")
+    print(f"   {count} plate-less frames: {count - sum(missed.values())} rejected, passed {missed or '{}'}")
+    print(f"   Avg check: {(plate_time + hopeless_time) / (2 * count) * 1000:.2f}ms per 1280x720 frame")
+    print(f"   By reason: {prefilter.get_stats()['rejected_by_reason']}")
+
+if __name__ == "__main__":
+    benchmark_prefilter()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Cấu hình gunicorn cho ALPR service: gunicorn -c gunicorn.conf.py wsgi:app
+Master load model một lần (preload_app), các worker fork ra dùng chung trọng số copy-on-write
+"""
+
+import gc
+import os
+import shutil
+import logging
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Metric của mọi worker được ghi ra thư mục này để /metrics gộp lại (phải đặt trước khi import main)
+prometheus_dir = os.getenv('ALPR_PROMETHEUS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool', 'prometheus'))
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', prometheus_dir)
+
+# Xoá file metric của lần chạy trước (pid cũ), trước khi master preload app
+shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+bind = f"0.0.0.0:{os.getenv('ALPR_SERVICE_PORT', 5001)}"
+backlog = int(os.getenv('ALPR_GUNICORN_BACKLOG', 64))
+
+# gthread: mỗi worker nhiều thread để InferenceScheduler gom các request đồng thời thành batch
+worker_class = 'gthread'
+workers = int(os.getenv('ALPR_GUNICORN_WORKERS', 2))
+threads = int(os.getenv('ALPR_GUNICORN_THREADS', 8))
+
+# OCR lúc tải cao có thể mất vài giây, timeout phải dài hơn ALPR_OCR_TIMEOUT
+timeout = int(os.getenv('ALPR_GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('ALPR_GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('ALPR_GUNICORN_KEEPALIVE', 5))
+
+# Thay worker sau N request để giới hạn bộ nhớ tăng dần, jitter để các worker không restart cùng lúc
+max_requests = int(os.getenv('ALPR_GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.getenv('ALPR_GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+# Luôn preload: đây là điều kiện để các worker dùng chung một bản model
+preload_app = True
+
+def pre_fork(server, worker):
+    # Chuyển các object đã có (model, module) sang vùng GC không quét,
+    # GC của worker không chạm vào các page đó nên chúng vẫn được chia sẻ sau khi fork
+    gc.freeze()
+
+def post_fork(server, worker):
+    import main
+
+    # Thread nền (upload, health prober, scheduler) không sống qua fork nên khởi động trong từng worker,
+    # model đã có sẵn từ master, worker chỉ warm-up rồi báo sẵn sàng
+    main.initialize_services(background=True)
+    logger.info(f"🚀 ALPR worker {worker.pid} started")
+
+def child_exit(server, worker):
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
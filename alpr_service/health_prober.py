@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Health Prober - Kiểm tra kết nối server chính ở thread nền
+/api/status và heartbeat của ESP32 đọc trạng thái đã cache thay vì gọi server mỗi lần
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class UpstreamHealthProber:
+    def __init__(self, server_client, interval=5, history_size=60):
+        """
+        Khởi tạo health prober
+
+        Args:
+            server_client: SmartParkingClient dùng để gọi /api/health
+            interval: Chu kỳ kiểm tra (giây)
+            history_size: Số mẫu RTT giữ lại
+        """
+        self.server_client = server_client
+        self.interval = interval
+
+        # Trạng thái được thay cả object khi cập nhật, đọc không cần lock
+        self._status = 'unknown'
+        self._details = {
+            'status': 'unknown',
+            'last_check': None,
+            'last_success': None,
+            'last_error': None,
+            'consecutive_failures': 0
+        }
+        self._rtt_history = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Khởi động thread kiểm tra định kỳ"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._probe_loop, name="upstream-health-prober", daemon=True)
+        self._thread.start()
+        logger.info(f"✅ Upstream health prober started (interval: {self.interval}s)")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def get_status(self) -> str:
+        """Trạng thái kết nối đã cache: connected / disconnected / unknown"""
+        return self._status
+
+    def get_details(self) -> dict:
+        """Chi tiết trạng thái và lịch sử RTT (ms)"""
+        details = dict(self._details)
+        with self._lock:
+            history = list(self._rtt_history)
+        details['rtt_ms'] = {
+            'last': round(history[-1], 2) if history else None,
+            'avg': round(sum(history) / len(history), 2) if history else None,
+            'max': round(max(history), 2) if history else None,
+            'history': [round(rtt, 2) for rtt in history]
+        }
+        details['interval'] = self.interval
+        return details
+
+    def check_now(self):
+        """Kiểm tra ngay một lần và cập nhật cache"""
+        ok, rtt_ms, error = self.server_client.probe('health')
+        now = datetime.now().isoformat()
+        details = dict(self._details)
+        details['last_check'] = now
+
+        if ok:
+            with self._lock:
+                self._rtt_history.append(rtt_ms)
+            if self._status != 'connected':
+                logger.info(f"✅ Smart Parking Server connected (RTT {rtt_ms:.1f}ms)")
+            details.update({
+                'status': 'connected',
+                'last_success': now,
+                'last_error': None,
+                'consecutive_failures': 0
+            })
+        else:
+            if self._status != 'disconnected':
+                logger.warning(f"⚠️ Smart Parking Server unreachable: {error}")
+            details.update({
+                'status': 'disconnected',
+                'last_error': error,
+                'consecutive_failures': details['consecutive_failures'] + 1
+            })
+
+        self._details = details
+        self._status = details['status']
+
+    def _probe_loop(self):
+        while not self._stop_event.is_set():
+            start_time = time.monotonic()
+            try:
+                self.check_now()
+            except Exception as e:
+                logger.error(f"❌ Error probing Smart Parking Server: {e}")
+            self._stop_event.wait(max(0.0, self.interval - (time.monotonic() - start_time)))
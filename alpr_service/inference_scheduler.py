@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Inference Scheduler - Gom các request /api/detect đồng thời thành batch
+Chạy một lần OCR cho cả batch rồi trả kết quả về từng request
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class InferenceScheduler:
+    def __init__(self, backend, max_batch_size=8, max_wait_ms=5, num_dispatchers=1):
+        """
+        Khởi tạo inference scheduler
+
+        Args:
+            backend: Đối tượng có process_images(images, recognize_only) -> list (SimpleOCRService, OCRWorkerPool)
+            max_batch_size: Số ảnh tối đa trong một batch
+            max_wait_ms: Thời gian tối đa chờ gom batch, tính từ request đầu tiên
+            num_dispatchers: Số batch được chạy song song
+        """
+        self.backend = backend
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self.num_dispatchers = max(1, int(num_dispatchers))
+
+        self._queue = queue.Queue()
+        self._threads = []
+        self._running = False
+        self._lock = threading.Lock()
+
+        # Khoảng cách trung bình giữa các request (EMA), dùng để quyết định có chờ gom batch không
+        self._last_arrival = None
+        self._arrival_gap = None
+
+        self._stats = {
+            'requests_total': 0,
+            'batches_total': 0,
+            'last_batch_size': 0,
+            'largest_batch_size': 0
+        }
+
+    def start(self):
+        """Khởi động các dispatcher thread"""
+        if self._running:
+            return
+        self._running = True
+        for index in range(self.num_dispatchers):
+            thread = threading.Thread(
+                target=self._dispatch_loop,
+                name=f"inference-dispatcher-{index}",
+                daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        logger.info(
+            f"✅ Inference scheduler started (max_batch_size={self.max_batch_size}, "
+            f"max_wait_ms={self.max_wait * 1000:.0f}, dispatchers={self.num_dispatchers})"
+        )
+
+    def stop(self):
+        """Dừng các dispatcher thread"""
+        if not self._running:
+            return
+        self._running = False
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def submit(self, image, recognize_only=False) -> Future:
+        """
+        Đưa một ảnh vào hàng đợi
+
+        Args:
+            image: Ảnh BGR
+            recognize_only: Ảnh đã là vùng biển số, chỉ chạy model recognition
+
+        Returns:
+            Future: Kết quả process_image của ảnh
+        """
+        future = Future()
+        now = time.monotonic()
+
+        with self._lock:
+            if self._last_arrival is not None:
+                gap = now - self._last_arrival
+                self._arrival_gap = gap if self._arrival_gap is None else 0.8 * self._arrival_gap + 0.2 * gap
+            self._last_arrival = now
+            self._stats['requests_total'] += 1
+
+        self._queue.put((image, future, now, recognize_only))
+        return future
+
+    def process_image(self, image, timeout=None, recognize_only=False) -> dict:
+        """Xử lý một ảnh qua scheduler, chặn tới khi có kết quả"""
+        return self.submit(image, recognize_only).result(timeout=timeout)
+
+    def get_stats(self) -> dict:
+        """Thống kê hàng đợi và batch"""
+        with self._lock:
+            stats = dict(self._stats)
+        batches = stats['batches_total']
+        stats.update({
+            'queue_depth': self._queue.qsize(),
+            'avg_batch_size': round(stats['requests_total'] / batches, 2) if batches else 0,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'dispatchers': self.num_dispatchers
+        })
+        return stats
+
+    def _traffic_is_dense(self) -> bool:
+        """Chỉ chờ gom batch khi các request đến dày hơn thời gian chờ tối đa"""
+        with self._lock:
+            return self._arrival_gap is not None and self._arrival_gap < self.max_wait
+
+    def _collect_batch(self, first_item) -> list:
+        """Gom thêm request vào batch cho tới khi đủ size hoặc hết thời gian chờ"""
+        batch = [first_item]
+        deadline = first_item[2] + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                # Lúc vắng thì chạy ngay, không làm chậm request đơn lẻ
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._traffic_is_dense():
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if item is None:
+                # Giữ lại tín hiệu dừng cho vòng lặp
+                self._queue.put(None)
+                break
+            batch.append(item)
+
+        return batch
+
+    def _run_batch(self, batch, recognize_only):
+        futures = [future for _, future, _, _ in batch]
+        try:
+            results = self.backend.process_images([image for image, _, _, _ in batch], recognize_only=recognize_only)
+            for future, result in zip(futures, results):
+                future.set_result(result)
+        except Exception as e:
+            logger.error(f"❌ Batch inference failed: {e}")
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+
+    def _dispatch_loop(self):
+        """Vòng lặp lấy batch từ hàng đợi và chạy OCR"""
+        while self._running:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            batch = self._collect_batch(item)
+
+            # Ảnh toàn cảnh và vùng biển số cắt sẵn chạy thành hai lần gọi riêng
+            for recognize_only in (False, True):
+                group = [entry for entry in batch if entry[3] == recognize_only]
+                if group:
+                    self._run_batch(group, recognize_only)
+
+            with self._lock:
+                self._stats['batches_total'] += 1
+                self._stats['last_batch_size'] = len(batch)
+                self._stats['largest_batch_size'] = max(self._stats['largest_batch_size'], len(batch))
@@ -7,20 +7,42 @@ Gửi dữ liệu trực tiếp đến server
 
 import os
 import sys
+import time
+import threading
 import logging
 import cv2
 import numpy as np
 import requests
 import json
-from datetime import datetime
-from flask import Flask, request, jsonify
+import uuid
+from datetime import datetime, timezone
+from flask import Flask, request, jsonify, make_response, Response, g, has_request_context
 from flask_cors import CORS
 import base64
+import hmac
+import sqlite3
+from contextlib import ExitStack, contextmanager
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from ocr_service import SimpleOCRService
+from ocr_service import SimpleOCRService, plan_ocr_scale
 from cloudinary_service import CloudinaryService
+from inference_scheduler import InferenceScheduler
+from ocr_worker_pool import OCRWorkerPool
+from upload_pipeline import UploadPipeline
+from entry_journal import EntryJournal
+from entry_dedup import EntryDedup
+from plate_index import PlateIndex, PlateIndexSync
+from server_client import SmartParkingClient
+from health_prober import UpstreamHealthProber
+from frame_cache import FrameCache, dhash
+from plate_voting import PlateVoter
+from frame_decoder import FrameDecoder, FrameTooLargeError
+from frame_prefilter import FramePrefilter
+from stream_ingest import StreamManager, parse_stream_config
+from synthetic_plates import FONTS, generate_corpus, render_plate
+from metrics import ALPRMetrics
+from profiler import RequestTrace, sample_stacks, merge_stacks, format_collapsed
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -33,47 +55,923 @@ CORS(app)
 # Global services
 ocr_service = None
 cloudinary_service = None
+inference_scheduler = None
+ocr_worker_pool = None
+upload_pipeline = None
+entry_journal = None
+stream_manager = None
+plate_index_sync = None
 
 # Server configuration
 SMART_PARKING_SERVER_URL = "http://192.168.102.3:8080"  # Server chính
 ALPR_SERVICE_PORT = 5001  # Port cho ALPR service
 
-def initialize_services():
-    """Initialize OCR and Cloudinary services"""
-    global ocr_service, cloudinary_service
+# Gom batch cho OCR
+OCR_BATCH_MAX_SIZE = int(os.getenv('ALPR_BATCH_MAX_SIZE', 8))
+OCR_BATCH_MAX_WAIT_MS = float(os.getenv('ALPR_BATCH_MAX_WAIT_MS', 5))
+OCR_REQUEST_TIMEOUT = float(os.getenv('ALPR_OCR_TIMEOUT', 30))
+
+# OCR backend: paddle (mặc định), onnxruntime hoặc openvino (model ONNX export bằng export_models.py)
+OCR_BACKEND = os.getenv('ALPR_OCR_BACKEND', 'paddle')
+OCR_MODEL_DIR = os.getenv('ALPR_OCR_MODEL_DIR')
+OCR_PRECISION = os.getenv('ALPR_OCR_PRECISION', 'fp32')
+OCR_BACKEND_OPTIONS = {'backend': OCR_BACKEND, 'model_dir': OCR_MODEL_DIR, 'precision': OCR_PRECISION}
+
+# Worker pool OCR nhiều process (0 = chạy OCR trong process chính)
+OCR_WORKERS = int(os.getenv('ALPR_OCR_WORKERS', 0))
+OCR_THREADS_PER_WORKER = int(os.getenv('ALPR_OCR_THREADS_PER_WORKER', 1))
+OCR_SHM_SLOT_MB = int(os.getenv('ALPR_OCR_SHM_SLOT_MB', 8))
+
+# Upload Cloudinary chạy nền
+UPLOAD_SPOOL_DIR = os.getenv('ALPR_UPLOAD_SPOOL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool', 'uploads'))
+UPLOAD_QUEUE_SIZE = int(os.getenv('ALPR_UPLOAD_QUEUE_SIZE', 100))
+UPLOAD_MAX_RETRIES = int(os.getenv('ALPR_UPLOAD_MAX_RETRIES', 5))
+# Thời gian tối đa báo lại kết quả upload khi server lỗi hoặc chưa có phiên gửi xe (giây, tính từ lần lỗi đầu tiên)
+UPLOAD_REPORT_WINDOW = float(os.getenv('ALPR_UPLOAD_REPORT_WINDOW', 600))
+
+# Journal entry khi server chính không trả lời (SQLite WAL, gửi lại theo thứ tự, có idempotency key)
+JOURNAL_ENABLED = os.getenv('ALPR_JOURNAL', 'true').lower() == 'true'
+JOURNAL_PATH = os.getenv('ALPR_JOURNAL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool', 'entries.db'))
+JOURNAL_BATCH_SIZE = int(os.getenv('ALPR_JOURNAL_BATCH_SIZE', 20))
+
+# HTTP client đến server chính (keep-alive, retry, circuit breaker)
+SERVER_POOL_SIZE = int(os.getenv('ALPR_SERVER_POOL_SIZE', 10))
+SERVER_MAX_RETRIES = int(os.getenv('ALPR_SERVER_MAX_RETRIES', 2))
+SERVER_BREAKER_FAILURES = int(os.getenv('ALPR_SERVER_BREAKER_FAILURES', 5))
+SERVER_BREAKER_RESET = float(os.getenv('ALPR_SERVER_BREAKER_RESET', 10))
+SERVER_PROBE_INTERVAL = float(os.getenv('ALPR_SERVER_PROBE_INTERVAL', 5))
+
+# Cache kết quả OCR theo perceptual hash của ảnh (theo từng barrier)
+FRAME_CACHE_TTL = float(os.getenv('ALPR_FRAME_CACHE_TTL', 10))
+FRAME_CACHE_SIZE = int(os.getenv('ALPR_FRAME_CACHE_SIZE', 16))
+FRAME_CACHE_HAMMING = int(os.getenv('ALPR_FRAME_CACHE_HAMMING', 6))
+
+# Bỏ entry lặp của cùng xe tại cùng barrier (RFID retry, camera kích hoạt lại), biển số lệch tối đa ALPR_DEDUP_MAX_DISTANCE ký tự
+DEDUP_ENABLED = os.getenv('ALPR_DEDUP', 'true').lower() == 'true'
+DEDUP_TTL = float(os.getenv('ALPR_DEDUP_TTL', 10))
+DEDUP_MAX_DISTANCE = int(os.getenv('ALPR_DEDUP_MAX_DISTANCE', 1))
+DEDUP_SIZE = int(os.getenv('ALPR_DEDUP_SIZE', 32))
+# Bảng dedup dùng chung giữa các process (gunicorn) trong file SQLite của journal
+DEDUP_SHARED = os.getenv('ALPR_DEDUP_SHARED', 'true').lower() == 'true'
+
+# Sửa biển số tin cậy thấp theo danh sách xe đã đăng ký (đồng bộ từ server chính)
+PLATE_INDEX_ENABLED = os.getenv('ALPR_PLATE_INDEX', 'true').lower() == 'true'
+PLATE_INDEX_MAX_DISTANCE = int(os.getenv('ALPR_PLATE_INDEX_MAX_DISTANCE', 1))
+PLATE_INDEX_SYNC_INTERVAL = float(os.getenv('ALPR_PLATE_INDEX_SYNC_INTERVAL', 60))
+PLATE_INDEX_FULL_SYNC_INTERVAL = float(os.getenv('ALPR_PLATE_INDEX_FULL_SYNC_INTERVAL', 3600))
+# Token dùng chung với server (ALPR_SERVICE_TOKEN ở server), bắt buộc để tải danh sách xe đã đăng ký
+SERVICE_TOKEN = os.getenv('ALPR_SERVICE_TOKEN', '')
+PLATE_SNAP_CONFIDENCE = float(os.getenv('ALPR_PLATE_SNAP_CONFIDENCE', 0.9))
+PLATE_SNAP_MAX_COST = float(os.getenv('ALPR_PLATE_SNAP_MAX_COST', 0.5))
+
+# Burst nhiều ảnh: dừng khi kết quả bỏ phiếu đạt ngưỡng tin cậy
+BURST_MAX_FRAMES = int(os.getenv('ALPR_BURST_MAX_FRAMES', 8))
+BURST_CONSENSUS_THRESHOLD = float(os.getenv('ALPR_BURST_THRESHOLD', 0.9))
+
+# Số vùng biển số tối đa trong một request /api/recognize
+RECOGNIZE_MAX_CROPS = int(os.getenv('ALPR_RECOGNIZE_MAX_CROPS', 16))
+
+# Decode JPEG thu nhỏ (1/2, 1/4, 1/8) khi ảnh lớn hơn mức OCR cần, buffer đọc body dùng lại
+REDUCED_DECODE_ENABLED = os.getenv('ALPR_REDUCED_DECODE', 'true').lower() == 'true'
+DECODE_BUFFERS = int(os.getenv('ALPR_DECODE_BUFFERS', 16))
+
+# Ảnh gửi thẳng trong body (/api/detect/raw): kích thước tối đa và content type được nhận
+MAX_FRAME_BYTES = int(float(os.getenv('ALPR_MAX_FRAME_MB', 10)) * 1024 * 1024)
+RAW_FRAME_MIMETYPES = ('image/jpeg', 'application/octet-stream')
+
+# Loại nhanh ảnh chắc chắn không có biển số trước OCR, ngưỡng riêng theo barrier
+# (JSON {"default": {...}, "lot/barrier": {...}}, xem DEFAULT_THRESHOLDS trong frame_prefilter.py)
+PREFILTER_ENABLED = os.getenv('ALPR_PREFILTER', 'true').lower() == 'true'
+PREFILTER_THRESHOLDS = json.loads(os.getenv('ALPR_PREFILTER_THRESHOLDS', '') or '{}')
+
+# Đọc camera liên tục theo barrier (JSON list, xem README), OCR khi có chuyển động trong ROI
+STREAMS_CONFIG = os.getenv('ALPR_STREAMS', '')
+STREAM_BUFFER_FRAMES = int(os.getenv('ALPR_STREAM_BUFFER_FRAMES', 16))
+STREAM_MOTION_THRESHOLD = float(os.getenv('ALPR_STREAM_MOTION_THRESHOLD', 0.02))
+STREAM_OCR_INTERVAL = float(os.getenv('ALPR_STREAM_OCR_INTERVAL', 0.5))
+STREAM_SETTLE_FRAMES = int(os.getenv('ALPR_STREAM_SETTLE_FRAMES', 5))
+STREAM_RESULT_MAX_AGE = float(os.getenv('ALPR_STREAM_RESULT_MAX_AGE', 10))
+# Thư mục chung của stream giữa các process (gunicorn): một process đọc camera, mọi process lấy kết quả ở đây
+# (để trống khi chỉ chạy một process)
+STREAM_SHARED_DIR = os.getenv('ALPR_STREAM_SHARED_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool', 'streams'))
+
+# Số ảnh giả lập chạy warm-up sau khi load model
+WARMUP_FRAMES = int(os.getenv('ALPR_WARMUP_FRAMES', 3))
+
+# /debug/profile chỉ bật khi có token (header X-Debug-Token)
+DEBUG_TOKEN = os.getenv('ALPR_DEBUG_TOKEN', '')
+DEBUG_PROFILE_MAX_SECONDS = 60
+
+# Client dùng chung cho mọi request đến server chính
+server_client = SmartParkingClient(
+    SMART_PARKING_SERVER_URL,
+    pool_size=SERVER_POOL_SIZE,
+    max_retries=SERVER_MAX_RETRIES,
+    failure_threshold=SERVER_BREAKER_FAILURES,
+    reset_timeout=SERVER_BREAKER_RESET
+)
+
+# Kiểm tra kết nối server chính ở thread nền, các endpoint chỉ đọc cache
+health_prober = UpstreamHealthProber(server_client, interval=SERVER_PROBE_INTERVAL)
+
+# Ảnh gần giống gửi lại từ cùng barrier dùng lại kết quả OCR
+frame_cache = FrameCache(
+    ttl=FRAME_CACHE_TTL,
+    max_entries_per_barrier=FRAME_CACHE_SIZE,
+    hamming_threshold=FRAME_CACHE_HAMMING
+)
+
+# Lượt xe đã gửi entry gần đây theo barrier
+entry_dedup = EntryDedup(
+    ttl=DEDUP_TTL,
+    max_distance=DEDUP_MAX_DISTANCE,
+    max_entries_per_barrier=DEDUP_SIZE,
+    path=JOURNAL_PATH if DEDUP_SHARED else None
+) if DEDUP_ENABLED else None
+
+# Biển số xe đã đăng ký, tra biển số gần nhất với kết quả OCR
+plate_index = PlateIndex(max_distance=PLATE_INDEX_MAX_DISTANCE) if PLATE_INDEX_ENABLED else None
+
+# Kiểm tra độ sáng/độ nét/cạnh trước OCR
+frame_prefilter = FramePrefilter(
+    thresholds=PREFILTER_THRESHOLDS.get('default'),
+    barrier_thresholds={key: value for key, value in PREFILTER_THRESHOLDS.items() if key != 'default'}
+) if PREFILTER_ENABLED else None
+
+# Prometheus metrics (/metrics)
+alpr_metrics = ALPRMetrics()
+
+# Trạng thái khởi động: starting -> loading_model -> warming_up -> ready (hoặc failed)
+PROCESS_STARTED_AT = time.monotonic()
+service_state = {'phase': 'starting', 'error': None, 'ready_at': None, 'startup_seconds': None}
+services_ready = threading.Event()
+
+# Đọc body vào buffer dùng lại và chọn mức decode theo tỉ lệ OCR cần
+frame_decoder = FrameDecoder(
+    plan_scale=plan_ocr_scale if REDUCED_DECODE_ENABLED else None,
+    max_buffers=DECODE_BUFFERS
+)
+
+def initialize_services(background=False):
+    """
+    Initialize OCR and Cloudinary services
+    
+    Args:
+        background: Load model và warm-up ở thread nền (port được bind ngay, /readyz báo khi xong)
+    """
+    global cloudinary_service, upload_pipeline, entry_journal, stream_manager, plate_index_sync
     try:
-        # Initialize OCR service
-        ocr_service = SimpleOCRService()
-        logger.info("✅ OCR service initialized successfully")
+        health_prober.start()
         
         # Initialize Cloudinary service
         cloudinary_service = CloudinaryService()
         logger.info("✅ Cloudinary service initialized successfully")
         
+        # Upload ảnh chạy nền, ghi spool trên đĩa trước để không mất ảnh khi restart
+        upload_pipeline = UploadPipeline(
+            cloudinary_service,
+            spool_dir=UPLOAD_SPOOL_DIR,
+            max_queue=UPLOAD_QUEUE_SIZE,
+            max_retries=UPLOAD_MAX_RETRIES,
+            on_complete=report_upload_result,
+            report_window=UPLOAD_REPORT_WINDOW
+        )
+        upload_pipeline.start()
+        
+        # Entry chưa gửi được cho server nằm trong journal, gửi lại nền theo thứ tự
+        if JOURNAL_ENABLED:
+            entry_journal = EntryJournal(JOURNAL_PATH, _send_entry_batch, batch_size=JOURNAL_BATCH_SIZE)
+            entry_journal.start()
+        
+        # Danh sách xe đã đăng ký tải ở thread nền, chưa tải xong thì không sửa biển số
+        if plate_index is not None:
+            plate_index_sync = PlateIndexSync(
+                plate_index,
+                _fetch_registered_plates,
+                interval=PLATE_INDEX_SYNC_INTERVAL,
+                full_sync_interval=PLATE_INDEX_FULL_SYNC_INTERVAL
+            )
+            plate_index_sync.start()
+        
+        # Độ sâu hàng đợi đọc lúc Prometheus scrape
+        alpr_metrics.add_queue('inference', lambda: inference_scheduler.get_stats()['queue_depth'])
+        alpr_metrics.add_queue('upload', lambda: upload_pipeline.get_stats()['queue_depth'])
+        alpr_metrics.add_queue('upload_spool', lambda: upload_pipeline.get_stats()['spooled'])
+        alpr_metrics.add_queue('entry_journal', lambda: entry_journal.backlog() if entry_journal else None)
+        
+        # Camera từng barrier: frame đọc liên tục, OCR chạy trước khi có sự kiện RFID
+        stream_configs = parse_stream_config(STREAMS_CONFIG)
+        if stream_configs:
+            stream_manager = StreamManager(
+                _submit_stream_frame,
+                buffer_size=STREAM_BUFFER_FRAMES,
+                motion_threshold=STREAM_MOTION_THRESHOLD,
+                ocr_interval=STREAM_OCR_INTERVAL,
+                settle_frames=STREAM_SETTLE_FRAMES,
+                shared_dir=STREAM_SHARED_DIR or None
+            )
+            for config in stream_configs:
+                stream_manager.add(config)
+            stream_manager.start()
+        
     except Exception as e:
         logger.error(f"❌ Failed to initialize services: {e}")
         raise
+    
+    if background:
+        threading.Thread(target=_start_ocr_in_background, name="ocr-model-loader", daemon=True).start()
+    else:
+        start_ocr()
+
+def start_ocr():
+    """Load model OCR, warm-up rồi mới nhận request (trạng thái ở service_state, /readyz)"""
+    global ocr_service, inference_scheduler, ocr_worker_pool
+    try:
+        service_state['phase'] = 'loading_model'
+        load_start = time.monotonic()
+        
+        if OCR_WORKERS > 0:
+            # Mỗi worker process có PaddleOCR riêng, ảnh chuyển qua shared memory
+            ocr_worker_pool = OCRWorkerPool(
+                size=OCR_WORKERS,
+                threads_per_worker=OCR_THREADS_PER_WORKER,
+                slot_bytes=OCR_SHM_SLOT_MB * 1024 * 1024,
+                backend_options=OCR_BACKEND_OPTIONS,
+                max_batch_size=OCR_BATCH_MAX_SIZE,
+                dispatchers=max(1, OCR_WORKERS),
+                task_timeout=OCR_REQUEST_TIMEOUT
+            )
+            ocr_worker_pool.start()
+            if ocr_worker_pool.wait_ready() == 0:
+                raise RuntimeError('No OCR worker could load the model')
+            alpr_metrics.add_queue('ocr_workers', lambda: ocr_worker_pool.get_stats()['queue_depth'])
+            ocr_backend = ocr_worker_pool
+        else:
+            # Initialize OCR service (đã load sẵn trong gunicorn master thì dùng lại bản chia sẻ copy-on-write)
+            if ocr_service is None:
+                ocr_service = SimpleOCRService(**OCR_BACKEND_OPTIONS)
+                logger.info("✅ OCR service initialized successfully")
+            ocr_backend = ocr_service
+        
+        load_time = time.monotonic() - load_start
+        service_state['phase'] = 'warming_up'
+        warm_up_start = time.monotonic()
+        _warm_up(ocr_backend)
+        warm_up_time = time.monotonic() - warm_up_start
+        
+        # Scheduler gom các request đồng thời thành một batch OCR,
+        # mỗi worker nhận một batch nên số dispatcher bằng số worker
+        inference_scheduler = InferenceScheduler(
+            ocr_backend,
+            max_batch_size=OCR_BATCH_MAX_SIZE,
+            max_wait_ms=OCR_BATCH_MAX_WAIT_MS,
+            num_dispatchers=max(1, OCR_WORKERS)
+        )
+        inference_scheduler.start()
+        
+        startup_time = time.monotonic() - PROCESS_STARTED_AT
+        service_state.update({
+            'phase': 'ready',
+            'ready_at': datetime.now().isoformat(),
+            'startup_seconds': round(startup_time, 2),
+            'model_load_seconds': round(load_time, 2),
+            'warm_up_seconds': round(warm_up_time, 2)
+        })
+        services_ready.set()
+        logger.info(
+            f"✅ ALPR service ready {startup_time:.1f}s after start "
+            f"(model load {load_time:.1f}s, warm-up {warm_up_time:.1f}s)"
+        )
+        
+    except Exception as e:
+        service_state.update({'phase': 'failed', 'error': str(e)})
+        logger.error(f"❌ Failed to load OCR model: {e}")
+        raise
+
+def preload_model():
+    """
+    Load SimpleOCRService trong gunicorn master trước khi fork (wsgi.py),
+    các worker dùng chung trọng số read-only qua copy-on-write thay vì mỗi process một bản
+    """
+    global ocr_service
+    if OCR_WORKERS > 0:
+        logger.warning("⚠️ ALPR_OCR_WORKERS > 0: OCR worker processes load their own model, preload skipped")
+        return
+    if ocr_service is None:
+        load_start = time.monotonic()
+        # Chỉ load, không warm-up: thread pool của inference không còn hợp lệ sau khi fork
+        ocr_service = SimpleOCRService(**OCR_BACKEND_OPTIONS)
+        logger.info(f"✅ OCR model preloaded in {time.monotonic() - load_start:.1f}s, shared with forked workers")
+
+def _start_ocr_in_background():
+    try:
+        start_ocr()
+    except Exception:
+        # Đã ghi log và trạng thái failed, /readyz trả 503
+        pass
+
+def _warm_up(ocr_backend):
+    """Chạy vài ảnh giả lập qua OCR để lần nhận diện đầu tiên không phải chịu chi phí khởi động"""
+    if WARMUP_FRAMES <= 0:
+        return
+    
+    frames = [sample['image'] for sample in generate_corpus(WARMUP_FRAMES, seed=0)]
+    # Vùng biển số cắt sẵn (1 dòng và 2 dòng) để load/warm-up cả đường chỉ chạy recognition
+    plates = [render_plate(['51A-123.45'], FONTS['simplex']), render_plate(['59-X1', '123.45'], FONTS['simplex'])]
+    if ocr_worker_pool:
+        # Gửi đồng thời đủ ảnh để mọi worker đều nhận được ảnh warm-up
+        futures = [ocr_worker_pool.submit([frame]) for _ in range(ocr_worker_pool.size) for frame in frames]
+        futures += [ocr_worker_pool.submit(plates, recognize_only=True) for _ in range(ocr_worker_pool.size)]
+        for future in futures:
+            future.result(timeout=OCR_REQUEST_TIMEOUT)
+    else:
+        for frame in frames:
+            ocr_backend.process_image(frame)
+        ocr_backend.process_images(plates, recognize_only=True)
+    logger.info(f"🔥 Warm-up done ({len(frames)} synthetic frames)")
+
+def _submit_stream_frame(frame):
+    """Gửi frame của stream cho OCR (cùng scheduler với request), None khi model chưa sẵn sàng"""
+    if not services_ready.is_set():
+        return None
+    return inference_scheduler.submit(frame)
+
+def _not_ready_response():
+    """Trả 503 khi model chưa load xong, client thử lại sau"""
+    return jsonify({
+        'success': False,
+        'error': 'ALPR service is not ready',
+        'phase': service_state['phase']
+    }), 503, {'Retry-After': '5'}
+
+def _clean_ocr_result(ocr_result):
+    """Chỉ giữ lại thông tin cần thiết từ ocr_result để trả về JSON"""
+    clean_ocr_result = {
+        'license_plates': [],
+        'all_texts': [],
+        'processing_time': ocr_result.get('processing_time', 0),
+        'decode_time': ocr_result.get('decode_time', 0),
+        'decode_reduction': ocr_result.get('decode_reduction', 1),
+        'detection_path': ocr_result.get('detection_path', 'full_frame'),
+        'cache_hit': ocr_result.get('cache_hit', False)
+    }
+    if ocr_result.get('prefilter'):
+        clean_ocr_result['prefilter'] = ocr_result['prefilter']
+    
+    # Chỉ lấy thông tin cần thiết từ license_plates
+    for plate in ocr_result.get('license_plates', []):
+        clean_plate = {
+            'text': plate.get('text', ''),
+            'normalized_text': plate.get('normalized_text', ''),
+            'confidence': plate.get('confidence', 0),
+            'is_valid': plate.get('is_valid', False),
+            'lines': plate.get('lines', 1)
+        }
+        clean_ocr_result['license_plates'].append(clean_plate)
+    
+    # Chỉ lấy thông tin cần thiết từ all_texts
+    for text_info in ocr_result.get('all_texts', []):
+        clean_text = {
+            'text': text_info.get('text', ''),
+            'confidence': text_info.get('confidence', 0)
+        }
+        clean_ocr_result['all_texts'].append(clean_text)
+    
+    return clean_ocr_result
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
+    """Health check endpoint (luôn 200, trạng thái model ở 'ready'/'phase', chặn traffic dùng /readyz)"""
+    ready = services_ready.is_set()
     return jsonify({
         'status': 'healthy',
+        'ready': ready,
+        'phase': service_state['phase'],
         'timestamp': datetime.now().isoformat(),
         'service': 'ALPR Service for Smart Parking',
         'models': {
-            'license_plate_recognition': 'PaddleOCR'
+            'license_plate_recognition': OCR_BACKEND,
+            'precision': OCR_PRECISION,
+            'loaded': ready
         },
-        'server_url': "http://192.168.102.3:8080",
+        'startup': service_state,
+        'server_url': SMART_PARKING_SERVER_URL,
         'port': ALPR_SERVICE_PORT
     })
 
+@app.route('/livez', methods=['GET'])
+def liveness():
+    """Process còn sống và trả lời được request (không phụ thuộc model)"""
+    return jsonify({
+        'status': 'alive',
+        'uptime_seconds': round(time.monotonic() - PROCESS_STARTED_AT, 1)
+    })
+
+@app.route('/readyz', methods=['GET'])
+def readiness():
+    """Sẵn sàng nhận request nhận diện: model đã load và warm-up xong"""
+    if services_ready.is_set():
+        return jsonify({'status': 'ready', 'startup_seconds': service_state['startup_seconds']})
+    return jsonify({
+        'status': service_state['phase'],
+        'error': service_state['error']
+    }), 503
+
+def _record_stage(stage, seconds, parking_lot_id, barrier_id):
+    """Ghi thời gian một bước vào metrics và vào trace của request (nếu client gửi header X-ALPR-Trace)"""
+    alpr_metrics.observe_stage(stage, seconds, parking_lot_id, barrier_id)
+    trace = g.get('alpr_trace') if has_request_context() else None
+    if trace is not None and seconds is not None:
+        trace.add(stage, seconds)
+
+@contextmanager
+def _timed_stage(stage, parking_lot_id, barrier_id):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record_stage(stage, time.perf_counter() - start_time, parking_lot_id, barrier_id)
+
+@app.before_request
+def start_request_trace():
+    """Bật trace từng bước khi request có header X-ALPR-Trace"""
+    if request.headers.get('X-ALPR-Trace'):
+        g.alpr_trace = RequestTrace()
+
+@app.after_request
+def attach_request_trace(response):
+    """Trả thời gian từng bước (ms) trong header Server-Timing và trường trace của JSON"""
+    trace = g.get('alpr_trace')
+    if trace is None:
+        return response
+    
+    response.headers['Server-Timing'] = trace.server_timing()
+    if response.is_json:
+        data = response.get_json(silent=True)
+        if isinstance(data, dict):
+            data['trace'] = trace.to_dict()
+            response.set_data(json.dumps(data))
+    return response
+
+def _decode_image(image_data, reduction=None):
+    """Decode ảnh, trả về (ảnh hoặc None nếu không hợp lệ, hệ số thu nhỏ, thời gian decode)"""
+    return frame_decoder.decode(image_data, reduction)
+
+def _scale_result(ocr_result, factor, offset=(0, 0)):
+    """Đổi bbox trong kết quả OCR của ảnh decode thu nhỏ (hoặc vùng cắt tại offset) về toạ độ ảnh gốc"""
+    def scale_items(items):
+        return [
+            dict(item, bbox=(np.asarray(item['bbox'], dtype=float) * factor + offset).tolist()) if item.get('bbox') else item
+            for item in items
+        ]
+    
+    return dict(
+        ocr_result,
+        license_plates=scale_items(ocr_result.get('license_plates', [])),
+        all_texts=scale_items(ocr_result.get('all_texts', []))
+    )
+
+def _parse_crop(value):
+    """
+    Đọc crop hint của /api/detect: "full" (cả ảnh là biển số) hoặc "x,y,w,h" (vùng biển số, pixel ảnh gốc)
+    
+    Returns:
+        'full', tuple (x, y, w, h) hoặc None nếu không có hint
+    
+    Raises:
+        ValueError: Hint không hợp lệ
+    """
+    if not value:
+        return None
+    if value.strip().lower() == 'full':
+        return 'full'
+    
+    x, y, w, h = (int(part) for part in value.split(','))
+    if x < 0 or y < 0 or w <= 0 or h <= 0:
+        raise ValueError(f"Invalid crop '{value}'")
+    return x, y, w, h
+
+def _recognize(image_data, parking_lot_id, barrier_id, crop=None, use_cache=True):
+    """
+    Decode và chạy OCR cho một ảnh, dùng lại kết quả nếu ảnh gần giống ảnh vừa xử lý ở barrier này
+    
+    Args:
+        crop: Vùng biển số biết trước (xem _parse_crop), có thì chỉ chạy model recognition
+        use_cache: False thì luôn chạy OCR (burst: mỗi ảnh phải là một lần nhận diện độc lập để bỏ phiếu)
+    
+    Returns:
+        dict: Kết quả OCR (có decode_time tách riêng với processing_time), None nếu ảnh không hợp lệ
+    """
+    if crop is not None:
+        return _recognize_crop(image_data, crop, parking_lot_id, barrier_id)
+    
+    image, reduction, decode_time = _decode_image(image_data)
+    _record_stage('decode', decode_time, parking_lot_id, barrier_id)
+    if image is None:
+        return None
+    
+    barrier_key = (parking_lot_id, barrier_id)
+    with _timed_stage('cache_lookup', parking_lot_id, barrier_id):
+        frame_hash = dhash(image)
+        ocr_result = frame_cache.lookup(barrier_key, frame_hash) if use_cache else None
+    
+    if ocr_result is not None:
+        return dict(ocr_result, cache_hit=True, decode_time=round(decode_time, 4))
+    
+    # Ảnh tối/nhoè/không có vùng nào giống biển số thì không tốn một lần OCR
+    if frame_prefilter is not None:
+        prefilter = frame_prefilter.check(image, barrier_key)
+        _record_stage('prefilter', prefilter['check_time'], parking_lot_id, barrier_id)
+        if not prefilter['passed']:
+            logger.info(f"🚫 Frame rejected before OCR ({prefilter['reason']}), saved ~{prefilter['saved_time'] * 1000:.0f}ms")
+            alpr_metrics.count_prefilter_rejection(prefilter['reason'], prefilter['saved_time'], parking_lot_id, barrier_id)
+            return {
+                'success': True,
+                'timestamp': datetime.now().isoformat(),
+                'processing_time': 0,
+                'detection_path': 'prefilter',
+                'license_plates': [],
+                'all_texts': [],
+                'prefilter': prefilter,
+                'decode_time': round(decode_time, 4),
+                'decode_reduction': reduction
+            }
+    
+    # Process image with OCR service (qua scheduler để gom batch)
+    ocr_result = _run_ocr(image, parking_lot_id, barrier_id)
+    if frame_prefilter is not None and ocr_result.get('success'):
+        frame_prefilter.observe_ocr_time(ocr_result.get('processing_time', 0))
+    decode_retry = False
+    
+    if reduction > 1 and ocr_result.get('success') and not ocr_result.get('license_plates'):
+        # Ảnh thu nhỏ không ra biển số -> decode lại đầy đủ và thử thêm một lần
+        full_image, _, full_decode_time = _decode_image(image_data, reduction=1)
+        if full_image is not None:
+            logger.info(f"🔁 No plate at 1/{reduction} decode, retrying at full resolution")
+            decode_time += full_decode_time
+            _record_stage('decode', full_decode_time, parking_lot_id, barrier_id)
+            ocr_result = _run_ocr(full_image, parking_lot_id, barrier_id)
+            reduction = 1
+            decode_retry = True
+    
+    if reduction > 1:
+        ocr_result = _scale_result(ocr_result, reduction)
+    ocr_result = dict(
+        ocr_result,
+        decode_time=round(decode_time, 4),
+        decode_reduction=reduction,
+        decode_retry=decode_retry
+    )
+    
+    if ocr_result.get('success'):
+        frame_cache.store(barrier_key, frame_hash, ocr_result)
+    return ocr_result
+
+def _recognize_crop(image_data, crop, parking_lot_id, barrier_id):
+    """Chỉ chạy model recognition trên vùng biển số biết trước, bbox trả về theo toạ độ ảnh gốc"""
+    # Toạ độ crop theo ảnh gốc nên decode đầy đủ, vùng cắt nhỏ nên OCR vẫn rẻ
+    image, _, decode_time = _decode_image(image_data, reduction=1)
+    _record_stage('decode', decode_time, parking_lot_id, barrier_id)
+    if image is None:
+        return None
+    
+    x, y = 0, 0
+    if crop != 'full':
+        x, y, w, h = crop
+        image = image[y:y + h, x:x + w]
+    if image.size == 0:
+        return {
+            'success': False,
+            'error': 'Crop is outside the image',
+            'timestamp': datetime.now().isoformat()
+        }
+    
+    ocr_result = _run_ocr(image, parking_lot_id, barrier_id, recognize_only=True)
+    if x or y:
+        ocr_result = _scale_result(ocr_result, 1, (x, y))
+    return dict(
+        ocr_result,
+        decode_time=round(decode_time, 4),
+        decode_reduction=1,
+        decode_retry=False,
+        crop=[x, y, image.shape[1], image.shape[0]]
+    )
+
+def _run_ocr(image, parking_lot_id, barrier_id, recognize_only=False):
+    """Chạy OCR qua scheduler, ghi thời gian từng bước và thời gian chờ trong hàng đợi"""
+    start_time = time.perf_counter()
+    ocr_result = inference_scheduler.process_image(image, timeout=OCR_REQUEST_TIMEOUT, recognize_only=recognize_only)
+    _record_ocr_timings(ocr_result, time.perf_counter() - start_time, parking_lot_id, barrier_id)
+    return ocr_result
+
+def _record_ocr_timings(ocr_result, elapsed, parking_lot_id, barrier_id):
+    if ocr_result.get('success'):
+        for stage, seconds in ocr_result.get('timings', {}).items():
+            _record_stage(stage, seconds, parking_lot_id, barrier_id)
+        _record_stage('queue_wait', elapsed - ocr_result.get('processing_time', 0), parking_lot_id, barrier_id)
+
+def _snap_plate(license_plate, confidence, parking_lot_id, barrier_id):
+    """
+    Biển số tin cậy thấp không có trong danh sách xe đã đăng ký: thay bằng biển số đã đăng ký gần nhất
+    (chỉ khi có đúng một biển số gần nhất, lệch ở các ký tự OCR hay nhầm)
+    
+    Returns:
+        tuple: (biển số dùng cho entry, thông tin sửa hoặc None)
+    """
+    if plate_index_sync is None or not plate_index_sync.is_ready() or confidence >= PLATE_SNAP_CONFIDENCE:
+        return license_plate, None
+    
+    with _timed_stage('plate_snap', parking_lot_id, barrier_id):
+        matches = plate_index.search(license_plate, PLATE_SNAP_MAX_COST)
+    if not matches:
+        alpr_metrics.count_plate_snap('no_match', parking_lot_id, barrier_id)
+        return license_plate, None
+    cost, registered_plate = matches[0]
+    if cost == 0:
+        alpr_metrics.count_plate_snap('registered', parking_lot_id, barrier_id)
+        return license_plate, None
+    if len(matches) > 1 and matches[1][0] == cost:
+        logger.info(f"🤔 Plate {license_plate} is equally close to {[plate for c, plate in matches if c == cost]}, not corrected")
+        alpr_metrics.count_plate_snap('ambiguous', parking_lot_id, barrier_id)
+        return license_plate, None
+    
+    logger.info(f"🎯 Plate {license_plate} corrected to registered {registered_plate} (cost {cost}, confidence {confidence:.2f})")
+    alpr_metrics.count_plate_snap('corrected', parking_lot_id, barrier_id)
+    return registered_plate, {
+        'detected': license_plate,
+        'corrected': registered_plate,
+        'cost': cost,
+        'candidates': len(matches)
+    }
+
+def _fetch_registered_plates(cursor):
+    """Một trang xe đã đăng ký thay đổi sau cursor (None = từ đầu), xác thực bằng token dùng chung"""
+    if not SERVICE_TOKEN:
+        raise RuntimeError('ALPR_SERVICE_TOKEN is not configured')
+    response = server_client.get(
+        'registered_plates',
+        params={'since': cursor} if cursor else None,
+        headers={'X-ALPR-Service-Token': SERVICE_TOKEN}
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f"HTTP {response.status_code}")
+    return response.json()
+
+def _submit_entry(image_bytes, ocr_result, license_plate, confidence, parking_lot_id, barrier_id, extra=None):
+    """Gửi entry cho server chính, entry lặp của lượt xe vừa gửi trả lại kết quả cũ, trả về Flask response"""
+    license_plate, correction = _snap_plate(license_plate, confidence, parking_lot_id, barrier_id)
+    if correction is not None:
+        extra = dict(extra or {}, plate_correction=correction)
+    
+    if entry_dedup is None:
+        return _post_entry(image_bytes, ocr_result, license_plate, confidence, parking_lot_id, barrier_id, extra)
+    
+    with _timed_stage('dedup', parking_lot_id, barrier_id):
+        dedup_entry, original = entry_dedup.reserve((parking_lot_id, barrier_id), license_plate)
+    if original is not None:
+        # Cùng xe vừa gửi (hoặc đang gửi): không upload ảnh, không gọi server
+        body, status = original
+        alpr_metrics.count_outcome('duplicate', parking_lot_id, barrier_id)
+        return jsonify(dict(body, duplicate=True, detected_license_plate=license_plate)), status
+    if dedup_entry is None:
+        return _post_entry(image_bytes, ocr_result, license_plate, confidence, parking_lot_id, barrier_id, extra)
+    
+    response = None
+    try:
+        response = make_response(
+            _post_entry(image_bytes, ocr_result, license_plate, confidence, parking_lot_id, barrier_id, extra)
+        )
+        return response
+    finally:
+        if response is not None:
+            entry_dedup.complete(dedup_entry, response.get_json(silent=True), response.status_code)
+        else:
+            entry_dedup.complete(dedup_entry)
+
+def _post_entry(image_bytes, ocr_result, license_plate, confidence, parking_lot_id, barrier_id, extra=None):
+    """Đưa ảnh vào hàng đợi upload và gửi entry cho server chính, trả về Flask response"""
+    extra = extra or {}
+    
+    # Ghi ảnh vào spool, upload Cloudinary chạy nền sau khi gửi entry cho server
+    try:
+        with _timed_stage('spool', parking_lot_id, barrier_id):
+            pending_image = upload_pipeline.enqueue(
+                image_bytes=image_bytes,
+                license_plate=license_plate,
+                parking_lot_id=parking_lot_id,
+                image_type="entry",
+                barrier_id=barrier_id
+            )
+    except OSError as e:
+        logger.error(f"❌ Failed to spool image for upload: {e}")
+        alpr_metrics.count_outcome('upload_failure', parking_lot_id, barrier_id)
+        return jsonify({
+            'success': False,
+            'error': 'Failed to store image for upload'
+        }), 500
+    
+    # Tạo payload cho server với URL Cloudinary (đang chờ upload),
+    # idempotency key để server bỏ qua entry đã nhận nếu journal gửi lại
+    server_payload = {
+        'licensePlate': license_plate,
+        'parkingLotId': parking_lot_id,
+        'entryImageUrl': pending_image['url'],
+        'entryImagePublicId': pending_image['public_id'],
+        'entryImageStatus': pending_image['status'],
+        'barrierId': barrier_id,
+        'detectionConfidence': confidence,
+        'idempotencyKey': uuid.uuid4().hex
+    }
+    
+    # Clean ocr_result để tránh JSON serialization error
+    clean_ocr_result = _clean_ocr_result(ocr_result)
+    
+    # Journal còn entry chưa gửi: gửi thẳng sẽ vượt lên trước entry cũ (và gần như chắc chắn phải chờ timeout)
+    if entry_journal is not None and entry_journal.has_backlog():
+        return _journal_entry(server_payload, clean_ocr_result, parking_lot_id, barrier_id, 'journal backlog', extra)
+    
+    # Gửi đến server chính
+    try:
+        with _timed_stage('server_post', parking_lot_id, barrier_id):
+            response = server_client.post('parking_entry', json=server_payload)
+        
+        if response.status_code >= 500 and entry_journal is not None:
+            logger.error(f"Server error: {response.status_code} - {response.text}")
+            return _journal_entry(server_payload, clean_ocr_result, parking_lot_id, barrier_id,
+                                  f'Server error: {response.status_code}', extra)
+        
+        if response.status_code == 200:
+            server_response = response.json()
+            alpr_metrics.count_outcome('success', parking_lot_id, barrier_id)
+            return jsonify({
+                'success': True,
+                'license_plate': license_plate,
+                'confidence': confidence,
+                'server_response': server_response,
+                'ocr_result': clean_ocr_result,
+                **extra
+            })
+        else:
+            logger.error(f"Server error: {response.status_code} - {response.text}")
+            alpr_metrics.count_outcome('server_error', parking_lot_id, barrier_id)
+            return jsonify({
+                'success': False,
+                'error': f'Server error: {response.status_code}',
+                'license_plate': license_plate,
+                'confidence': confidence,
+                'ocr_result': clean_ocr_result,
+                **extra
+            }), 500
+            
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Connection error: {e}")
+        if entry_journal is not None:
+            return _journal_entry(server_payload, clean_ocr_result, parking_lot_id, barrier_id,
+                                  f'Cannot connect to server: {str(e)}', extra)
+        alpr_metrics.count_outcome('server_error', parking_lot_id, barrier_id)
+        return jsonify({
+            'success': False,
+            'error': f'Cannot connect to server: {str(e)}',
+            'license_plate': license_plate,
+            'confidence': confidence,
+            'ocr_result': clean_ocr_result,
+            **extra
+        }), 500
+
+def _journal_entry(server_payload, clean_ocr_result, parking_lot_id, barrier_id, reason, extra):
+    """Ghi entry vào journal thay vì bỏ sự kiện, trả về 202 (server sẽ nhận khi journal gửi lại)"""
+    # Thời điểm xe vào thật, không phải lúc journal gửi được cho server
+    server_payload = dict(server_payload, entryTime=datetime.now(timezone.utc).isoformat())
+    try:
+        with _timed_stage('journal', parking_lot_id, barrier_id):
+            entry_journal.append(server_payload)
+    except sqlite3.Error as e:
+        logger.error(f"❌ Failed to journal entry: {e}")
+        alpr_metrics.count_outcome('server_error', parking_lot_id, barrier_id)
+        return jsonify({
+            'success': False,
+            'error': f'{reason}; failed to journal entry',
+            'license_plate': server_payload['licensePlate'],
+            'confidence': server_payload['detectionConfidence'],
+            'ocr_result': clean_ocr_result,
+            **extra
+        }), 500
+    
+    logger.info(f"📝 Entry {server_payload['licensePlate']} journaled ({reason})")
+    alpr_metrics.count_outcome('journaled', parking_lot_id, barrier_id)
+    return jsonify({
+        'success': True,
+        'queued': True,
+        'queue_reason': reason,
+        'idempotency_key': server_payload['idempotencyKey'],
+        'license_plate': server_payload['licensePlate'],
+        'confidence': server_payload['detectionConfidence'],
+        'ocr_result': clean_ocr_result,
+        **extra
+    }), 202
+
+def _send_entry_batch(entries):
+    """Gửi một batch entry của journal, trả về (status, body) của từng entry theo thứ tự"""
+    response = server_client.post('parking_entry_batch', json={'entries': entries})
+    if response.status_code != 200:
+        raise RuntimeError(f"HTTP {response.status_code}")
+    return [(result.get('status', 500), result) for result in response.json().get('results', [])]
+
+def _detect_and_submit(image_bytes, parking_lot_id, barrier_id, crop=None):
+    """Nhận diện biển số trong một ảnh và gửi entry cho server chính, trả về Flask response"""
+    ocr_result = _recognize(image_bytes, parking_lot_id, barrier_id, crop)
+    return _submit_ocr_result(image_bytes, ocr_result, parking_lot_id, barrier_id)
+
+def _submit_ocr_result(image_bytes, ocr_result, parking_lot_id, barrier_id, extra=None):
+    """Kiểm tra kết quả OCR, có biển số thì gửi entry cho server chính, trả về Flask response"""
+    if ocr_result is None:
+        alpr_metrics.count_outcome('invalid_image', parking_lot_id, barrier_id)
+        return jsonify({
+            'success': False,
+            'error': 'Invalid image format'
+        }), 400
+    
+    if not ocr_result.get('success'):
+        alpr_metrics.count_outcome('ocr_error', parking_lot_id, barrier_id)
+        # Clean error result
+        clean_result = {
+            'success': False,
+            'error': ocr_result.get('error', 'Unknown error'),
+            'timestamp': ocr_result.get('timestamp', datetime.now().isoformat())
+        }
+        return jsonify(clean_result), 400
+    
+    # Lấy biển số đầu tiên được detect
+    license_plates = ocr_result.get('license_plates', [])
+    if not license_plates:
+        prefilter = ocr_result.get('prefilter')
+        alpr_metrics.count_outcome('prefiltered' if prefilter else 'no_plate', parking_lot_id, barrier_id)
+        # Clean ocr_result để tránh JSON serialization error
+        clean_ocr_result = _clean_ocr_result(ocr_result)
+        
+        return jsonify({
+            'success': False,
+            'error': f"No license plate in frame ({prefilter['reason']})" if prefilter else 'No valid license plate detected',
+            'ocr_result': clean_ocr_result
+        }), 400
+    
+    # Lấy biển số đầu tiên
+    first_plate = license_plates[0]
+    license_plate = first_plate['normalized_text']
+    confidence = first_plate['confidence']
+    
+    return _submit_entry(image_bytes, ocr_result, license_plate, confidence, parking_lot_id, barrier_id, extra)
+
+def _detect_from_stream(stream, parking_lot_id, barrier_id):
+    """
+    Trả lời /api/detect từ stream của barrier: kết quả tốt nhất đã OCR khi xe vào ROI,
+    chưa có thì OCR frame mới nhất trong ring buffer
+    """
+    # Kết quả chỉ dùng cho một lượt xe (lấy và bỏ trong một bước)
+    best = stream.take(STREAM_RESULT_MAX_AGE)
+    if best is not None:
+        frame_time, frame, ocr_result = best
+    else:
+        latest = stream.latest_frame()
+        if latest is None or time.time() - latest[0] > STREAM_RESULT_MAX_AGE:
+            return jsonify({
+                'success': False,
+                'error': 'No recent frame from camera stream'
+            }), 503
+        frame_time, frame = latest
+        ocr_result = _run_ocr(stream.crop_roi(frame), parking_lot_id, barrier_id)
+    
+    if stream.roi:
+        ocr_result = _scale_result(ocr_result, 1, stream.roi[:2])
+    
+    # Ảnh entry lưu cả frame, chỉ encode JPEG lúc cần
+    with _timed_stage('encode', parking_lot_id, barrier_id):
+        _, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    extra = {
+        'source': 'stream',
+        'frame_age': round(time.time() - frame_time, 3),
+        'precomputed': best is not None
+    }
+    return _submit_ocr_result(encoded.tobytes(), ocr_result, parking_lot_id, barrier_id, extra)
+
 @app.route('/api/detect', methods=['POST'])
 def detect_license_plate():
     """Detect license plates in image and send to server"""
     try:
+        if not services_ready.is_set():
+            return _not_ready_response()
+        
+        # Lấy thông tin từ request
+        parking_lot_id = request.form.get('parkingLotId', 'default')
+        barrier_id = request.form.get('barrierId', 'default')
+        
         # Check if image is provided
         if 'image' not in request.files:
+            # Barrier có camera stream: trả lời từ ring buffer thay vì chờ ảnh
+            stream = stream_manager.get(parking_lot_id, barrier_id) if stream_manager else None
+            if stream is not None:
+                with alpr_metrics.track_in_flight('detect'), alpr_metrics.time_stage('total', parking_lot_id, barrier_id):
+                    return _detect_from_stream(stream, parking_lot_id, barrier_id)
             return jsonify({
                 'success': False,
                 'error': 'No image provided'
@@ -82,199 +980,320 @@ def detect_license_plate():
         # Get image file
         image_file = request.files['image']
         
-        # Read and decode image
-        image_bytes = image_file.read()
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if image is None:
+        # Camera chĩa sát biển số: bỏ detection, chỉ chạy recognition trên cả ảnh hoặc vùng cho trước
+        try:
+            crop = _parse_crop(request.form.get('crop'))
+        except ValueError:
             return jsonify({
                 'success': False,
-                'error': 'Invalid image format'
+                'error': 'Invalid crop, expected "full" or "x,y,w,h"'
             }), 400
         
-        # Process image with OCR service
-        ocr_result = ocr_service.process_image(image)
+        # Đọc ảnh vào buffer dùng lại, buffer trả về pool khi xử lý xong
+        with alpr_metrics.track_in_flight('detect'), alpr_metrics.time_stage('total', parking_lot_id, barrier_id):
+            with frame_decoder.read(image_file.stream) as image_bytes:
+                return _detect_and_submit(image_bytes, parking_lot_id, barrier_id, crop)
         
-        if not ocr_result.get('success'):
-            # Clean error result
-            clean_result = {
+    except Exception as e:
+        logger.error(f"Error in detect_license_plate: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+@app.route('/api/detect/raw', methods=['POST'])
+def detect_license_plate_raw():
+    """
+    Như /api/detect nhưng body là ảnh JPEG nguyên (không base64, không multipart), thông tin barrier trong header:
+    X-Parking-Lot-Id, X-Barrier-Id, X-Crop (tuỳ chọn). Body có thể gửi chunked
+    """
+    try:
+        if not services_ready.is_set():
+            return _not_ready_response()
+        
+        if request.mimetype not in RAW_FRAME_MIMETYPES:
+            return jsonify({
                 'success': False,
-                'error': ocr_result.get('error', 'Unknown error'),
-                'timestamp': ocr_result.get('timestamp', datetime.now().isoformat())
-            }
-            return jsonify(clean_result), 400
+                'error': f"Unsupported content type '{request.mimetype}', expected image/jpeg"
+            }), 415
         
-        # Lấy biển số đầu tiên được detect
-        license_plates = ocr_result.get('license_plates', [])
-        if not license_plates:
-            # Clean ocr_result để tránh JSON serialization error
-            clean_ocr_result = {
-                'license_plates': [],
-                'all_texts': [],
-                'processing_time': ocr_result.get('processing_time', 0)
-            }
-            
-            # Chỉ lấy thông tin cần thiết từ license_plates
-            for plate in ocr_result.get('license_plates', []):
-                clean_plate = {
-                    'text': plate.get('text', ''),
-                    'normalized_text': plate.get('normalized_text', ''),
-                    'confidence': plate.get('confidence', 0),
-                    'is_valid': plate.get('is_valid', False)
-                }
-                clean_ocr_result['license_plates'].append(clean_plate)
-            
-            # Chỉ lấy thông tin cần thiết từ all_texts
-            for text_info in ocr_result.get('all_texts', []):
-                clean_text = {
-                    'text': text_info.get('text', ''),
-                    'confidence': text_info.get('confidence', 0)
-                }
-                clean_ocr_result['all_texts'].append(clean_text)
-            
+        content_length = request.content_length
+        if content_length is not None and content_length > MAX_FRAME_BYTES:
             return jsonify({
                 'success': False,
-                'error': 'No valid license plate detected',
-                'ocr_result': clean_ocr_result
+                'error': f'Image larger than {MAX_FRAME_BYTES} bytes'
+            }), 413
+        
+        parking_lot_id = request.headers.get('X-Parking-Lot-Id', 'default')
+        barrier_id = request.headers.get('X-Barrier-Id', 'default')
+        try:
+            crop = _parse_crop(request.headers.get('X-Crop'))
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid X-Crop, expected "full" or "x,y,w,h"'
             }), 400
         
-        # Lấy biển số đầu tiên
-        first_plate = license_plates[0]
-        license_plate = first_plate['normalized_text']
-        confidence = first_plate['confidence']
+        # Body được đọc một lần thẳng vào buffer của pool (đủ lớn theo Content-Length), decoder dùng trực tiếp buffer đó
+        with alpr_metrics.track_in_flight('detect_raw'), alpr_metrics.time_stage('total', parking_lot_id, barrier_id):
+            with frame_decoder.read(request.stream, size_hint=content_length, max_bytes=MAX_FRAME_BYTES) as image_bytes:
+                if not len(image_bytes):
+                    return jsonify({
+                        'success': False,
+                        'error': 'No image provided'
+                    }), 400
+                return _detect_and_submit(image_bytes, parking_lot_id, barrier_id, crop)
+        
+    except FrameTooLargeError:
+        return jsonify({
+            'success': False,
+            'error': f'Image larger than {MAX_FRAME_BYTES} bytes'
+        }), 413
+    except Exception as e:
+        logger.error(f"Error in detect_license_plate_raw: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+@app.route('/api/detect/burst', methods=['POST'])
+def detect_license_plate_burst():
+    """Nhận nhiều ảnh của cùng một lượt xe, bỏ phiếu biển số và dừng sớm khi đủ tin cậy"""
+    try:
+        if not services_ready.is_set():
+            return _not_ready_response()
+        
+        image_files = request.files.getlist('images')
+        if not image_files:
+            return jsonify({
+                'success': False,
+                'error': 'No images provided'
+            }), 400
         
         # Lấy thông tin từ request
         parking_lot_id = request.form.get('parkingLotId', 'default')
         barrier_id = request.form.get('barrierId', 'default')
         
-        # Upload ảnh lên Cloudinary
-        cloudinary_result = cloudinary_service.upload_parking_image(
-            image_bytes=image_bytes,
-            license_plate=license_plate,
-            parking_lot_id=parking_lot_id,
-            image_type="entry"
-        )
+        with alpr_metrics.track_in_flight('detect_burst'), alpr_metrics.time_stage('total', parking_lot_id, barrier_id):
+            with ExitStack() as buffers:
+                return _detect_burst(image_files, parking_lot_id, barrier_id, buffers)
         
-        if not cloudinary_result['success']:
-            logger.error(f"❌ Failed to upload image to Cloudinary: {cloudinary_result['error']}")
-            return jsonify({
-                'success': False,
-                'error': 'Failed to upload image to Cloudinary'
-            }), 500
+    except Exception as e:
+        logger.error(f"Error in detect_license_plate_burst: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+def _detect_burst(image_files, parking_lot_id, barrier_id, buffers):
+    """Bỏ phiếu biển số trên các ảnh của burst, buffer đọc ảnh giữ trong buffers đến khi trả response"""
+    voter = PlateVoter(threshold=BURST_CONSENSUS_THRESHOLD)
+    frames = []
+    
+    # Xử lý lần lượt từng ảnh, ảnh tốt thì chỉ tốn một lần OCR
+    for frame_index, image_file in enumerate(image_files[:BURST_MAX_FRAMES]):
+        image_bytes = buffers.enter_context(frame_decoder.read(image_file.stream))
+        # Ảnh trong burst gần như giống nhau: lấy từ cache thì một lần OCR bị tính thành nhiều phiếu
+        ocr_result = _recognize(image_bytes, parking_lot_id, barrier_id, use_cache=False)
+        if ocr_result is None or not ocr_result.get('success'):
+            continue
         
-        # Tạo payload cho server với URL Cloudinary
-        server_payload = {
-            'licensePlate': license_plate,
-            'parkingLotId': parking_lot_id,
-            'entryImageUrl': cloudinary_result['url'],
-            'entryImagePublicId': cloudinary_result['public_id'],
-            'barrierId': barrier_id,
-            'detectionConfidence': confidence
+        frames.append((image_bytes, ocr_result))
+        voter.add(ocr_result, len(frames) - 1)
+        if voter.is_confident():
+            break
+    
+    consensus = voter.consensus()
+    burst_info = {
+        'burst': {
+            'frames_received': len(image_files),
+            'frames_processed': voter.frames_seen,
+            'early_exit': voter.is_confident() and voter.frames_seen < len(image_files),
+            'consensus': consensus
         }
+    }
+    
+    if consensus is None:
+        alpr_metrics.count_outcome('no_plate' if frames else 'invalid_image', parking_lot_id, barrier_id)
+        return jsonify({
+            'success': False,
+            'error': 'No valid license plate detected',
+            'ocr_result': _clean_ocr_result(frames[-1][1]) if frames else None,
+            **burst_info
+        }), 400
+    
+    # Upload ảnh tốt nhất trong các ảnh khớp với kết quả bỏ phiếu
+    image_bytes, ocr_result = frames[consensus['frame_index']]
+    return _submit_entry(
+        image_bytes,
+        ocr_result,
+        consensus['text'],
+        consensus['confidence'],
+        parking_lot_id,
+        barrier_id,
+        extra=burst_info
+    )
+
+@app.route('/api/recognize', methods=['POST'])
+def recognize_plates():
+    """Chỉ nhận diện (không text detection, không gửi entry) một batch ảnh đã cắt sẵn vùng biển số"""
+    try:
+        if not services_ready.is_set():
+            return _not_ready_response()
         
-        # Gửi đến server chính
-        try:
-            response = requests.post(
-                f"{SMART_PARKING_SERVER_URL}/api/parking/entry",
-                json=server_payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                server_response = response.json()
-                # Clean ocr_result để tránh JSON serialization error
-                clean_ocr_result = {
-                    'license_plates': [],
-                    'all_texts': [],
-                    'processing_time': ocr_result.get('processing_time', 0)
-                }
-                
-                # Chỉ lấy thông tin cần thiết từ license_plates
-                for plate in ocr_result.get('license_plates', []):
-                    clean_plate = {
-                        'text': plate.get('text', ''),
-                        'normalized_text': plate.get('normalized_text', ''),
-                        'confidence': plate.get('confidence', 0),
-                        'is_valid': plate.get('is_valid', False)
-                    }
-                    clean_ocr_result['license_plates'].append(clean_plate)
-                
-                # Chỉ lấy thông tin cần thiết từ all_texts
-                for text_info in ocr_result.get('all_texts', []):
-                    clean_text = {
-                        'text': text_info.get('text', ''),
-                        'confidence': text_info.get('confidence', 0)
-                    }
-                    clean_ocr_result['all_texts'].append(clean_text)
-                
-                return jsonify({
-                    'success': True,
-                    'license_plate': license_plate,
-                    'confidence': confidence,
-                    'server_response': server_response,
-                    'ocr_result': clean_ocr_result
-                })
-            else:
-                logger.error(f"Server error: {response.status_code} - {response.text}")
-                # Clean ocr_result để tránh JSON serialization error
-                clean_ocr_result = {
-                    'license_plates': [],
-                    'all_texts': [],
-                    'processing_time': ocr_result.get('processing_time', 0)
-                }
-                
-                # Chỉ lấy thông tin cần thiết từ license_plates
-                for plate in ocr_result.get('license_plates', []):
-                    clean_plate = {
-                        'text': plate.get('text', ''),
-                        'normalized_text': plate.get('normalized_text', ''),
-                        'confidence': plate.get('confidence', 0),
-                        'is_valid': plate.get('is_valid', False)
-                    }
-                    clean_ocr_result['license_plates'].append(clean_plate)
-                
-                # Chỉ lấy thông tin cần thiết từ all_texts
-                for text_info in ocr_result.get('all_texts', []):
-                    clean_text = {
-                        'text': text_info.get('text', ''),
-                        'confidence': text_info.get('confidence', 0)
-                    }
-                    clean_ocr_result['all_texts'].append(clean_text)
-                
-                return jsonify({
-                    'success': False,
-                    'error': f'Server error: {response.status_code}',
-                    'license_plate': license_plate,
-                    'confidence': confidence,
-                    'ocr_result': clean_ocr_result
-                }), 500
-                
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Connection error: {e}")
+        image_files = request.files.getlist('images') or request.files.getlist('image')
+        if not image_files:
             return jsonify({
                 'success': False,
-                'error': f'Cannot connect to server: {str(e)}',
-                'license_plate': license_plate,
-                'confidence': confidence,
-                'ocr_result': ocr_result
-            }), 500
+                'error': 'No images provided'
+            }), 400
+        if len(image_files) > RECOGNIZE_MAX_CROPS:
+            return jsonify({
+                'success': False,
+                'error': f'Too many images (max {RECOGNIZE_MAX_CROPS})'
+            }), 400
+        
+        # Lấy thông tin từ request
+        parking_lot_id = request.form.get('parkingLotId', 'default')
+        barrier_id = request.form.get('barrierId', 'default')
+        
+        with alpr_metrics.track_in_flight('recognize'), alpr_metrics.time_stage('total', parking_lot_id, barrier_id):
+            return _recognize_batch(image_files, parking_lot_id, barrier_id)
         
     except Exception as e:
-        logger.error(f"Error in detect_license_plate: {e}")
+        logger.error(f"Error in recognize_plates: {e}")
         return jsonify({
             'success': False,
             'error': str(e),
             'timestamp': datetime.now().isoformat()
         }), 500
 
+def _recognize_batch(image_files, parking_lot_id, barrier_id):
+    start_time = time.perf_counter()
+    crops = []
+    decode_times = []
+    for image_file in image_files:
+        with frame_decoder.read(image_file.stream) as image_bytes:
+            image, _, decode_time = _decode_image(image_bytes, reduction=1)
+        _record_stage('decode', decode_time, parking_lot_id, barrier_id)
+        crops.append(image)
+        decode_times.append(round(decode_time, 4))
+    
+    # Gửi mọi vùng cắt vào scheduler cùng lúc để chúng được gom vào chung một lần chạy model
+    submit_time = time.perf_counter()
+    futures = [
+        inference_scheduler.submit(crop, recognize_only=True) if crop is not None else None
+        for crop in crops
+    ]
+    
+    results = []
+    for index, future in enumerate(futures):
+        if future is None:
+            results.append({'index': index, 'success': False, 'error': 'Invalid image format'})
+            continue
+        
+        ocr_result = future.result(timeout=OCR_REQUEST_TIMEOUT)
+        _record_ocr_timings(ocr_result, time.perf_counter() - submit_time, parking_lot_id, barrier_id)
+        if not ocr_result.get('success'):
+            results.append({'index': index, 'success': False, 'error': ocr_result.get('error', 'Unknown error')})
+            continue
+        
+        license_plates = ocr_result.get('license_plates', [])
+        results.append({
+            'index': index,
+            'success': bool(license_plates),
+            'license_plate': license_plates[0]['normalized_text'] if license_plates else None,
+            'confidence': license_plates[0]['confidence'] if license_plates else 0,
+            'ocr_result': _clean_ocr_result(dict(ocr_result, decode_time=decode_times[index]))
+        })
+    
+    return jsonify({
+        'success': any(result['success'] for result in results),
+        'results': results,
+        'processing_time': round(time.perf_counter() - start_time, 4),
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
+@app.route('/debug/profile', methods=['GET'])
+def debug_profile():
+    """
+    Lấy mẫu stack của process Flask và các OCR worker trong N giây (?seconds=N, mặc định 10)
+    Trả về file collapsed stack cho flamegraph.pl / speedscope, cần header X-Debug-Token
+    """
+    if not DEBUG_TOKEN:
+        return jsonify({
+            'success': False,
+            'error': 'Profiling is disabled (ALPR_DEBUG_TOKEN not set)'
+        }), 404
+    
+    if not hmac.compare_digest(request.headers.get('X-Debug-Token', ''), DEBUG_TOKEN):
+        return jsonify({
+            'success': False,
+            'error': 'Invalid debug token'
+        }), 401
+    
+    try:
+        seconds = min(DEBUG_PROFILE_MAX_SECONDS, max(0.1, float(request.args.get('seconds', 10))))
+        interval = max(0.001, float(request.args.get('interval_ms', 5)) / 1000)
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'seconds and interval_ms must be numbers'
+        }), 400
+    
+    logger.info(f"🔬 Profiling for {seconds}s (interval {interval * 1000:.1f}ms)")
+    
+    # Lấy mẫu các worker song song với process chính
+    worker_stacks = {}
+    worker_thread = None
+    if ocr_worker_pool:
+        worker_thread = threading.Thread(
+            target=lambda: worker_stacks.update(ocr_worker_pool.profile(seconds, interval)),
+            name="profile-workers",
+            daemon=True
+        )
+        worker_thread.start()
+    
+    stacks = sample_stacks(seconds, interval, prefix=f"flask-{os.getpid()}")
+    if worker_thread:
+        worker_thread.join(timeout=seconds + 15)
+    stacks = merge_stacks(stacks, *worker_stacks.values())
+    
+    filename = f"alpr-profile-{datetime.now().strftime('%Y%m%d_%H%M%S')}.collapsed"
+    return Response(
+        format_collapsed(stacks),
+        content_type='text/plain; charset=utf-8',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics"""
+    body, content_type = alpr_metrics.render()
+    return Response(body, content_type=content_type)
+
 @app.route('/api/status', methods=['GET'])
 def get_system_status():
     """Get system status"""
     return jsonify({
-        'alpr_status': 'active' if ocr_service else 'inactive',
+        'alpr_status': 'active' if services_ready.is_set() else 'inactive',
+        'startup': service_state,
         'server_connection': check_server_connection(),
+        'server_health': health_prober.get_details(),
+        'inference_scheduler': inference_scheduler.get_stats() if inference_scheduler else None,
+        'ocr_worker_pool': ocr_worker_pool.get_stats() if ocr_worker_pool else None,
+        'upload_pipeline': upload_pipeline.get_stats() if upload_pipeline else None,
+        'entry_journal': entry_journal.get_stats() if entry_journal else None,
+        'server_client': server_client.get_stats(),
+        'frame_cache': frame_cache.get_stats(),
+        'entry_dedup': entry_dedup.get_stats() if entry_dedup else None,
+        'plate_index': dict(plate_index.get_stats(), sync=plate_index_sync.get_stats() if plate_index_sync else None) if plate_index else None,
+        'frame_decoder': frame_decoder.get_stats(),
+        'frame_prefilter': frame_prefilter.get_stats() if frame_prefilter else None,
+        'streams': stream_manager.get_stats() if stream_manager else None,
         'system_type': 'smart_parking_alpr',
         'timestamp': datetime.now().isoformat()
     })
@@ -295,12 +1314,36 @@ def test_endpoint():
     })
 
 def check_server_connection():
-    """Kiểm tra kết nối đến server chính"""
+    """Trạng thái kết nối đến server chính (đọc từ cache của health prober)"""
+    return health_prober.get_status()
+
+def report_upload_result(job, status):
+    """Báo kết quả upload ảnh chạy nền về server chính"""
+    parking_lot_id, barrier_id = job['parking_lot_id'], job.get('barrier_id') or 'default'
+    if 'upload_time' in job and not job.get('upload_observed'):
+        # Chỉ ghi một lần, job có thể được báo lại nhiều lần khi server lỗi
+        job['upload_observed'] = True
+        alpr_metrics.observe_stage('upload', job['upload_time'], parking_lot_id, barrier_id)
+        if status == 'failed':
+            alpr_metrics.count_outcome('upload_failure', parking_lot_id, barrier_id)
+    
     try:
-        response = requests.get(f"{SMART_PARKING_SERVER_URL}/api/health", timeout=5)
-        return 'connected' if response.status_code == 200 else 'disconnected'
-    except:
-        return 'disconnected'
+        response = server_client.post('entry_image', json={
+            'entryImagePublicId': job['public_id'],
+            'entryImageUrl': job['url'],
+            'status': status
+        })
+        
+        if response.status_code == 404:
+            # Phiên gửi xe có thể chưa có: upload xong trước khi entry tới server, hoặc entry còn nằm trong journal.
+            # Pipeline báo lại (có backoff) trong UPLOAD_REPORT_WINDOW, quá thì job vào thư mục failed
+            logger.info(f"⏳ No parking session yet for image {job['public_id']}, will report again")
+            return False
+        
+        return response.status_code == 200
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Cannot report upload result: {e}")
+        return False
 
 @app.route('/api/esp32/vehicle_detected', methods=['POST'])
 def vehicle_detected():
@@ -311,12 +1354,7 @@ def vehicle_detected():
         
         # Forward to server
         try:
-            response = requests.post(
-                f"{SMART_PARKING_SERVER_URL}/api/iot/vehicle_detected",
-                json=data,
-                headers={'Content-Type': 'application/json'},
-                timeout=5
-            )
+            response = server_client.post('vehicle_detected', json=data)
             
             if response.status_code == 200:
                 server_response = response.json()
@@ -354,12 +1392,7 @@ def update_barrier_status():
         
         # Forward to server
         try:
-            response = requests.post(
-                f"{SMART_PARKING_SERVER_URL}/api/iot/barrier-control",
-                json=data,
-                headers={'Content-Type': 'application/json'},
-                timeout=5
-            )
+            response = server_client.post('barrier_control', json=data)
             
             if response.status_code == 200:
                 server_response = response.json()
@@ -425,21 +1458,24 @@ def internal_error(error):
 
 if __name__ == '__main__':
     try:
-        initialize_services()
+        # Bind port ngay, model load ở thread nền (/readyz báo khi sẵn sàng)
+        initialize_services(background=True)
         print("🚗 ALPR Service for Smart Parking")
         print("=" * 50)
         print(f"📍 Port: {ALPR_SERVICE_PORT}")
         print(f"🔗 Smart Parking Server: {SMART_PARKING_SERVER_URL}")
         print(f"☁️  Cloudinary Integration: Enabled")
-        print(f"📡 Health Check: http://localhost:{ALPR_SERVICE_PORT}/health")
+        print(f"📡 Health Check: http://localhost:{ALPR_SERVICE_PORT}/health (/livez, /readyz)")
         print(f"🔍 Detection API: http://localhost:{ALPR_SERVICE_PORT}/api/detect")
+        print(f"✂️  Recognition API: http://localhost:{ALPR_SERVICE_PORT}/api/recognize")
         print(f"🧪 Test API: http://localhost:{ALPR_SERVICE_PORT}/api/test")
         print("=" * 50)
         
         app.run(
             host='0.0.0.0',
             port=ALPR_SERVICE_PORT,
-            debug=False
+            debug=False,
+            threaded=True
         )
     except Exception as e:
         logger.error(f"Failed to start ALPR service: {e}")
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Metrics - Prometheus metrics cho ALPR service
+Histogram thời gian từng bước theo parkingLotId/barrierId, counter kết quả, gauge request đang xử lý và độ sâu hàng đợi
+Chạy nhiều worker (gunicorn) thì đặt PROMETHEUS_MULTIPROC_DIR để /metrics gộp số liệu của mọi worker
+"""
+
+import os
+import time
+import logging
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, ProcessCollector,
+    generate_latest, multiprocess, CONTENT_TYPE_LATEST
+)
+from prometheus_client.core import GaugeMetricFamily
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bucket (giây) từ vài ms (decode, kiểm tra biển số) đến vài giây (OCR lúc tải cao, upload)
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Kết quả cuối của một request nhận diện
+OUTCOMES = ('success', 'journaled', 'duplicate', 'no_plate', 'prefiltered', 'invalid_image', 'ocr_error', 'upload_failure', 'server_error')
+
+class _QueueDepthCollector:
+    """Đọc độ sâu các hàng đợi lúc Prometheus scrape, không cần cập nhật gauge mỗi request"""
+
+    def __init__(self):
+        self.sources = {}
+
+    def collect(self):
+        family = GaugeMetricFamily('alpr_queue_depth', 'Number of items waiting in each internal queue', labels=['queue'])
+        for name, source in list(self.sources.items()):
+            try:
+                value = source()
+            except Exception as e:
+                logger.debug(f"Queue depth source {name} failed: {e}")
+                continue
+            if value is not None:
+                family.add_metric([name], value)
+        yield family
+
+class ALPRMetrics:
+    def __init__(self, registry=None):
+        """
+        Khởi tạo các metric
+
+        Args:
+            registry: CollectorRegistry dùng riêng (mặc định tạo mới, kèm metric CPU/RSS của process)
+        """
+        # Multiprocess: mỗi worker ghi giá trị ra file trong PROMETHEUS_MULTIPROC_DIR, lúc scrape mới gộp lại
+        self.multiprocess_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+        if registry is None:
+            registry = CollectorRegistry()
+            if not self.multiprocess_dir:
+                ProcessCollector(registry=registry)
+        self.registry = registry
+
+        self.stage_seconds = Histogram(
+            'alpr_stage_duration_seconds',
+            'Time spent in each step of a detect request',
+            ['stage', 'parkingLotId', 'barrierId'],
+            buckets=STAGE_BUCKETS,
+            registry=registry
+        )
+        self.outcomes = Counter(
+            'alpr_detect_outcomes_total',
+            'Final outcome of detect requests',
+            ['outcome', 'parkingLotId', 'barrierId'],
+            registry=registry
+        )
+        self.prefilter_rejections = Counter(
+            'alpr_prefilter_rejections_total',
+            'Frames rejected before OCR by the prefilter',
+            ['reason', 'parkingLotId', 'barrierId'],
+            registry=registry
+        )
+        self.prefilter_saved_seconds = Counter(
+            'alpr_prefilter_saved_seconds_total',
+            'Estimated OCR time saved by prefilter rejections',
+            ['parkingLotId', 'barrierId'],
+            registry=registry
+        )
+        self.plate_snaps = Counter(
+            'alpr_plate_snaps_total',
+            'Low-confidence plates looked up in the registered-plate index',
+            ['result', 'parkingLotId', 'barrierId'],
+            registry=registry
+        )
+        self.in_flight = Gauge(
+            'alpr_requests_in_flight',
+            'Requests currently being processed',
+            ['endpoint'],
+            registry=registry,
+            multiprocess_mode='livesum'
+        )
+
+        # Độ sâu hàng đợi đọc trực tiếp trong process, nên không đi qua file multiprocess
+        self._queues = _QueueDepthCollector()
+        if not self.multiprocess_dir:
+            registry.register(self._queues)
+
+    def observe_stage(self, stage, seconds, parking_lot_id, barrier_id):
+        if seconds is None:
+            return
+        self.stage_seconds.labels(stage, parking_lot_id, barrier_id).observe(max(0.0, seconds))
+
+    def observe_stages(self, timings: dict, parking_lot_id, barrier_id):
+        """Ghi nhiều bước cùng lúc, vd. timings của process_images"""
+        for stage, seconds in timings.items():
+            self.observe_stage(stage, seconds, parking_lot_id, barrier_id)
+
+    @contextmanager
+    def time_stage(self, stage, parking_lot_id, barrier_id):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - start_time, parking_lot_id, barrier_id)
+
+    def count_outcome(self, outcome, parking_lot_id, barrier_id):
+        self.outcomes.labels(outcome, parking_lot_id, barrier_id).inc()
+
+    def count_prefilter_rejection(self, reason, saved_seconds, parking_lot_id, barrier_id):
+        self.prefilter_rejections.labels(reason, parking_lot_id, barrier_id).inc()
+        self.prefilter_saved_seconds.labels(parking_lot_id, barrier_id).inc(max(0.0, saved_seconds))
+
+    def count_plate_snap(self, result, parking_lot_id, barrier_id):
+        self.plate_snaps.labels(result, parking_lot_id, barrier_id).inc()
+
+    def track_in_flight(self, endpoint):
+        """Context manager/decorator tăng gauge khi request bắt đầu, giảm khi xong"""
+        return self.in_flight.labels(endpoint).track_inprogress()
+
+    def add_queue(self, name, source):
+        """
+        Đăng ký một hàng đợi
+
+        Args:
+            name: Tên hàng đợi (label queue)
+            source: Hàm trả về độ sâu hiện tại, None nếu hàng đợi chưa chạy
+        """
+        self._queues.sources[name] = source
+
+    def render(self):
+        """Nội dung và content type cho endpoint /metrics"""
+        if not self.multiprocess_dir:
+            return generate_latest(self.registry), CONTENT_TYPE_LATEST
+
+        # Gộp số liệu mọi worker, độ sâu hàng đợi là của worker đang trả lời scrape
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=self.multiprocess_dir)
+        registry.register(self._queues)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def mark_process_dead(pid):
+    """Xoá gauge livesum của worker đã thoát (gọi từ hook child_exit của gunicorn)"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
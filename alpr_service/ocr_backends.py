@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+OCR Backends - Chạy model detection/recognition của PP-OCR trên các runtime CPU khác nhau
+PaddleOCR (mặc định), ONNX Runtime và OpenVINO (model ONNX export bằng export_models.py, FP32 hoặc INT8)
+Mọi backend trả về cùng format rec_texts/rec_scores/rec_polys mà SimpleOCRService đã xử lý
+"""
+
+import os
+import abc
+import logging
+
+import cv2
+import numpy as np
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Tiền xử lý/hậu xử lý giống cấu hình mặc định của PaddleOCR để kết quả so sánh được
+DET_LIMIT_SIDE = 960
+DET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+DET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+DET_THRESH = 0.3
+DET_BOX_THRESH = 0.6
+DET_UNCLIP_RATIO = 1.5
+DET_MIN_SIZE = 3
+DET_MAX_CANDIDATES = 1000
+
+REC_IMAGE_HEIGHT = 48
+REC_IMAGE_WIDTH = 320
+REC_BATCH_SIZE = 6
+
+# Tên file trong thư mục model (export_models.py tạo ra)
+MODEL_FILES = {
+    'fp32': ('det.onnx', 'rec.onnx'),
+    'int8': ('det.int8.onnx', 'rec.int8.onnx')
+}
+DICT_FILE = 'dict.txt'
+
+def preprocess_det(image: np.ndarray):
+    """
+    Resize (cạnh dài tối đa DET_LIMIT_SIDE, bội số của 32) và chuẩn hoá ảnh cho model detection
+
+    Returns:
+        tuple: (tensor 1x3xHxW float32, (tỉ lệ theo chiều cao, tỉ lệ theo chiều rộng))
+    """
+    height, width = image.shape[:2]
+    ratio = min(1.0, DET_LIMIT_SIDE / float(max(height, width)))
+    resized_height = max(32, int(round(height * ratio / 32)) * 32)
+    resized_width = max(32, int(round(width * ratio / 32)) * 32)
+    resized = cv2.resize(image, (resized_width, resized_height))
+
+    tensor = (resized.astype(np.float32) / 255.0 - DET_MEAN) / DET_STD
+    return tensor.transpose(2, 0, 1)[np.newaxis], (resized_height / float(height), resized_width / float(width))
+
+def preprocess_rec(crops: list) -> np.ndarray:
+    """Resize các dòng text về cao REC_IMAGE_HEIGHT, giữ tỉ lệ, pad về cùng chiều rộng của batch"""
+    max_ratio = max([REC_IMAGE_WIDTH / float(REC_IMAGE_HEIGHT)] + [crop.shape[1] / float(crop.shape[0]) for crop in crops])
+    batch_width = int(np.ceil(REC_IMAGE_HEIGHT * max_ratio))
+
+    tensor = np.zeros((len(crops), 3, REC_IMAGE_HEIGHT, batch_width), dtype=np.float32)
+    for index, crop in enumerate(crops):
+        width = min(batch_width, int(np.ceil(REC_IMAGE_HEIGHT * crop.shape[1] / float(crop.shape[0]))))
+        resized = cv2.resize(crop, (max(1, width), REC_IMAGE_HEIGHT)).astype(np.float32)
+        tensor[index, :, :, :resized.shape[1]] = ((resized / 255.0 - 0.5) / 0.5).transpose(2, 0, 1)
+    return tensor
+
+def _order_points(points: np.ndarray) -> np.ndarray:
+    """Sắp 4 đỉnh theo thứ tự trên-trái, trên-phải, dưới-phải, dưới-trái"""
+    by_x = points[np.argsort(points[:, 0])]
+    left = by_x[:2][np.argsort(by_x[:2, 1])]
+    right = by_x[2:][np.argsort(by_x[2:, 1])]
+    return np.array([left[0], right[0], right[1], left[1]], dtype=np.float32)
+
+def _box_score(probability: np.ndarray, box: np.ndarray) -> float:
+    """Xác suất trung bình bên trong box (chỉ xét vùng bao quanh box)"""
+    height, width = probability.shape
+    x0 = int(np.clip(np.floor(box[:, 0].min()), 0, width - 1))
+    x1 = int(np.clip(np.ceil(box[:, 0].max()), 0, width - 1))
+    y0 = int(np.clip(np.floor(box[:, 1].min()), 0, height - 1))
+    y1 = int(np.clip(np.ceil(box[:, 1].max()), 0, height - 1))
+
+    mask = np.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=np.uint8)
+    cv2.fillPoly(mask, [(box - (x0, y0)).astype(np.int32)], 1)
+    return cv2.mean(probability[y0:y1 + 1, x0:x1 + 1], mask)[0]
+
+def postprocess_det(probability: np.ndarray, ratios, image_shape) -> list:
+    """
+    Tách box text từ bản đồ xác suất của model detection (DB)
+
+    Args:
+        probability: Bản đồ xác suất HxW
+        ratios: Tỉ lệ resize (chiều cao, chiều rộng) từ preprocess_det
+        image_shape: Kích thước ảnh gốc
+
+    Returns:
+        list: Các box 4 đỉnh (float32, toạ độ ảnh gốc), từ trên xuống dưới, trái sang phải
+    """
+    height, width = image_shape[:2]
+    ratio_height, ratio_width = ratios
+    bitmap = (probability > DET_THRESH).astype(np.uint8) * 255
+    contours, _ = cv2.findContours(bitmap, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+    boxes = []
+    for contour in contours[:DET_MAX_CANDIDATES]:
+        (center, (rect_width, rect_height), angle) = cv2.minAreaRect(contour)
+        if min(rect_width, rect_height) < DET_MIN_SIZE:
+            continue
+
+        box = _order_points(cv2.boxPoints((center, (rect_width, rect_height), angle)))
+        if _box_score(probability, box) < DET_BOX_THRESH:
+            continue
+
+        # Nới box ra như unclip của DB: khoảng cách = diện tích * ratio / chu vi
+        distance = rect_width * rect_height * DET_UNCLIP_RATIO / (2.0 * (rect_width + rect_height))
+        expanded = (rect_width + 2 * distance, rect_height + 2 * distance)
+        if min(expanded) < DET_MIN_SIZE + 2:
+            continue
+
+        box = _order_points(cv2.boxPoints((center, expanded, angle)))
+        box[:, 0] = np.clip(box[:, 0] / ratio_width, 0, width - 1)
+        box[:, 1] = np.clip(box[:, 1] / ratio_height, 0, height - 1)
+        boxes.append(box)
+
+    # Cùng thứ tự đọc với PaddleOCR: theo dòng (sai lệch dưới 10px coi như cùng dòng), rồi từ trái sang phải
+    return sorted(boxes, key=lambda box: (int(box[0, 1] // 10), box[0, 0]))
+
+def crop_text_box(image: np.ndarray, box: np.ndarray) -> np.ndarray:
+    """Cắt và nắn thẳng vùng text theo box 4 đỉnh, dòng text dựng đứng được xoay ngang"""
+    crop_width = int(max(np.linalg.norm(box[0] - box[1]), np.linalg.norm(box[2] - box[3])))
+    crop_height = int(max(np.linalg.norm(box[0] - box[3]), np.linalg.norm(box[1] - box[2])))
+    target = np.float32([[0, 0], [crop_width, 0], [crop_width, crop_height], [0, crop_height]])
+    matrix = cv2.getPerspectiveTransform(box.astype(np.float32), target)
+    crop = cv2.warpPerspective(image, matrix, (max(1, crop_width), max(1, crop_height)),
+                               borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_CUBIC)
+    if crop.shape[0] >= crop.shape[1] * 1.5:
+        crop = np.rot90(crop)
+    return crop
+
+def decode_ctc(predictions: np.ndarray, characters: list) -> list:
+    """
+    Greedy CTC decode output của model recognition (NxTxC)
+
+    Returns:
+        list: (text, score) cho từng dòng
+    """
+    indexes = predictions.argmax(axis=2)
+    probabilities = predictions.max(axis=2)
+
+    results = []
+    for sequence, sequence_probabilities in zip(indexes, probabilities):
+        keep = sequence != 0
+        keep[1:] &= sequence[1:] != sequence[:-1]
+        text = ''.join(characters[index] for index in sequence[keep])
+        score = float(sequence_probabilities[keep].mean()) if keep.any() else 0.0
+        results.append((text, score))
+    return results
+
+def load_characters(path: str) -> list:
+    """Bảng ký tự của model recognition: blank (CTC) + từng dòng trong dict + khoảng trắng"""
+    with open(path, 'r', encoding='utf-8') as f:
+        characters = [line.rstrip('\r\n') for line in f if line.rstrip('\r\n')]
+    return ['blank'] + characters + [' ']
+
+class PaddleBackend:
+    name = 'paddle'
+
+    def __init__(self, cpu_threads=None, model_dir=None, precision='fp32'):
+        """
+        PaddleOCR (model và tiền xử lý mặc định của PaddleOCR, model_dir/precision không dùng)
+
+        Args:
+            cpu_threads: Số thread CPU cho PaddleOCR (None = mặc định của PaddleOCR)
+        """
+        from paddleocr import PaddleOCR
+
+        ocr_kwargs = {'lang': 'en'}
+        if cpu_threads:
+            ocr_kwargs['cpu_threads'] = cpu_threads
+        self._ocr = PaddleOCR(**ocr_kwargs)
+        self._cpu_threads = cpu_threads
+        self._recognizer = None
+
+    def ocr(self, images: list) -> list:
+        return self._ocr.ocr(images) or []
+
+    def recognize(self, crops: list) -> list:
+        """
+        Chỉ chạy model recognition trên các dòng text đã cắt sẵn
+
+        Returns:
+            list: (text, score) cho từng ảnh
+        """
+        if self._recognizer is None:
+            # Load lần đầu cần dùng (warm-up của service gọi trước khi nhận request)
+            try:
+                from paddleocr import TextRecognition
+            except ImportError:
+                # Bản PaddleOCR không có TextRecognition: chạy cả pipeline ocr() trên từng vùng cắt
+                logger.warning("⚠️ paddleocr.TextRecognition not available, recognizing crops with the full OCR pipeline")
+                self._recognizer = False
+            else:
+                self._recognizer = TextRecognition(cpu_threads=self._cpu_threads) if self._cpu_threads else TextRecognition()
+        if self._recognizer is False:
+            return [self._recognize_with_ocr(crop) for crop in crops]
+        return [(result['rec_text'], float(result['rec_score'])) for result in self._recognizer.predict(crops)]
+
+    def _recognize_with_ocr(self, crop: np.ndarray) -> tuple:
+        """Lấy dòng text có score cao nhất khi chạy ocr() trên vùng cắt"""
+        best = ('', 0.0)
+        for result in self.ocr([crop]):
+            for text, score in zip(result.get('rec_texts', []), result.get('rec_scores', [])):
+                if float(score) > best[1]:
+                    best = (text, float(score))
+        return best
+
+class _ExportedModelBackend(abc.ABC):
+    """Chạy model PP-OCR đã export sang ONNX: detection (DB) -> cắt dòng text -> recognition (CTC)"""
+
+    name = None
+
+    def __init__(self, cpu_threads=None, model_dir=None, precision='fp32'):
+        """
+        Args:
+            cpu_threads: Số thread tính toán của runtime (None = mặc định của runtime)
+            model_dir: Thư mục chứa det/rec ONNX và dict.txt (xem export_models.py)
+            precision: 'fp32' hoặc 'int8' (model đã quantize)
+        """
+        if not model_dir:
+            raise ValueError(f"OCR backend '{self.name}' requires a model directory (ALPR_OCR_MODEL_DIR)")
+        if precision not in MODEL_FILES:
+            raise ValueError(f"Unknown precision '{precision}' (available: {', '.join(MODEL_FILES)})")
+
+        det_file, rec_file = MODEL_FILES[precision]
+        self.precision = precision
+        self.characters = load_characters(os.path.join(model_dir, DICT_FILE))
+        self._det = self._load(os.path.join(model_dir, det_file), cpu_threads)
+        self._rec = self._load(os.path.join(model_dir, rec_file), cpu_threads)
+        logger.info(f"✅ {self.name} OCR models loaded from {model_dir} ({precision})")
+
+    @abc.abstractmethod
+    def _load(self, path, cpu_threads):
+        """Load một file model, trả về object của runtime"""
+
+    @abc.abstractmethod
+    def _infer(self, model, tensor: np.ndarray) -> np.ndarray:
+        """Chạy model với một tensor đầu vào, trả về output đầu tiên"""
+
+    def ocr(self, images: list) -> list:
+        """OCR một batch ảnh, cùng format với PaddleOCR.ocr (rec_texts, rec_scores, rec_polys)"""
+        results = []
+        crops = []
+        owners = []
+        for image in images:
+            tensor, ratios = preprocess_det(image)
+            probability = self._infer(self._det, tensor)[0, 0]
+            boxes = postprocess_det(probability, ratios, image.shape)
+
+            results.append({'rec_texts': [], 'rec_scores': [], 'rec_polys': []})
+            for box in boxes:
+                crops.append(crop_text_box(image, box))
+                owners.append((len(results) - 1, box))
+
+        for (index, box), (text, score) in zip(owners, self.recognize(crops)):
+            results[index]['rec_texts'].append(text)
+            results[index]['rec_scores'].append(score)
+            results[index]['rec_polys'].append(np.round(box).astype(np.int16))
+        return results
+
+    def recognize(self, crops: list) -> list:
+        """
+        Nhận diện các dòng text đã cắt sẵn
+
+        Returns:
+            list: (text, score) cho từng ảnh
+        """
+        # Gom các dòng có tỉ lệ gần nhau vào cùng batch để ít phải pad
+        order = sorted(range(len(crops)), key=lambda i: crops[i].shape[1] / float(crops[i].shape[0]))
+        results = [None] * len(crops)
+        for start in range(0, len(order), REC_BATCH_SIZE):
+            batch = order[start:start + REC_BATCH_SIZE]
+            predictions = self._infer(self._rec, preprocess_rec([crops[i] for i in batch]))
+            for i, decoded in zip(batch, decode_ctc(predictions, self.characters)):
+                results[i] = decoded
+        return results
+
+class OnnxRuntimeBackend(_ExportedModelBackend):
+    name = 'onnxruntime'
+
+    def _load(self, path, cpu_threads):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if cpu_threads:
+            options.intra_op_num_threads = cpu_threads
+            options.inter_op_num_threads = 1
+        session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        return session, session.get_inputs()[0].name
+
+    def _infer(self, model, tensor):
+        session, input_name = model
+        return session.run(None, {input_name: tensor})[0]
+
+class OpenVINOBackend(_ExportedModelBackend):
+    name = 'openvino'
+
+    def _load(self, path, cpu_threads):
+        import openvino as ov
+
+        config = {'PERFORMANCE_HINT': 'LATENCY'}
+        if cpu_threads:
+            config['INFERENCE_NUM_THREADS'] = cpu_threads
+        compiled = ov.Core().compile_model(path, 'CPU', config)
+        return compiled, compiled.output(0)
+
+    def _infer(self, model, tensor):
+        compiled, output = model
+        return compiled(tensor)[output]
+
+BACKENDS = {
+    PaddleBackend.name: PaddleBackend,
+    OnnxRuntimeBackend.name: OnnxRuntimeBackend,
+    OpenVINOBackend.name: OpenVINOBackend
+}
+
+def create_backend(name='paddle', cpu_threads=None, model_dir=None, precision='fp32'):
+    """
+    Tạo OCR backend theo tên (ALPR_OCR_BACKEND)
+
+    Args:
+        name: 'paddle', 'onnxruntime' hoặc 'openvino'
+        cpu_threads: Số thread CPU
+        model_dir: Thư mục model ONNX (backend onnxruntime/openvino)
+        precision: 'fp32' hoặc 'int8'
+    """
+    backend_class = BACKENDS.get(name)
+    if backend_class is None:
+        raise ValueError(f"Unknown OCR backend '{name}' (available: {', '.join(BACKENDS)})")
+    return backend_class(cpu_threads=cpu_threads, model_dir=model_dir, precision=precision)
@@ -1,41 +1,79 @@
 #!/usr/bin/env python3
 """
 Simple OCR Service - Chỉ tập trung vào nhận diện biển số xe
-Bỏ vehicle detection, chỉ dùng PaddleOCR
+Bỏ vehicle detection, OCR chạy qua backend chọn lúc khởi động (PaddleOCR, ONNX Runtime, OpenVINO)
 """
 
 import cv2
 import numpy as np
 import re
+import time
 import logging
 from datetime import datetime
-from paddleocr import PaddleOCR
+from ocr_backends import create_backend
+from plate_detector import PlateDetector
+from plate_validator import PlateValidator
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Vùng biển số cắt sẵn hẹp hơn tỉ lệ này (rộng/cao) là biển vuông 2 dòng (xe máy), biển 1 dòng khoảng 4.7
+TWO_LINE_MAX_ASPECT = 2.5
+
+def plan_ocr_scale(width: int, height: int, plate_height_ratio=0.08, target_plate_height=48, min_side=320) -> float:
+    """
+    Tỉ lệ thu nhỏ ảnh trước OCR sao cho biển số vẫn cao khoảng target_plate_height pixel
+    
+    Returns:
+        float: Tỉ lệ trong khoảng (0, 1], 1.0 là giữ nguyên
+    """
+    expected_plate_height = height * plate_height_ratio
+    if expected_plate_height <= 0:
+        return 1.0
+    
+    scale = target_plate_height / expected_plate_height
+    scale = max(scale, min_side / float(min(width, height)))
+    
+    # Giảm ít hơn 5% thì không đáng resize
+    return 1.0 if scale >= 0.95 else scale
+
 class SimpleOCRService:
-    def __init__(self):
+    def __init__(self, use_plate_detector=True, cpu_threads=None,
+                 plate_height_ratio=0.08, target_plate_height=48, min_side=320,
+                 backend='paddle', model_dir=None, precision='fp32'):
         """
         Khởi tạo OCR service
+        
+        Args:
+            use_plate_detector: Tìm vùng biển số trước khi chạy OCR trên toàn ảnh
+            cpu_threads: Số thread CPU cho OCR backend (None = mặc định của backend)
+            plate_height_ratio: Chiều cao biển số dự kiến so với chiều cao ảnh
+            target_plate_height: Chiều cao biển số (pixel) cần giữ lại khi thu nhỏ ảnh
+            min_side: Cạnh ngắn tối thiểu của ảnh sau khi thu nhỏ
+            backend: OCR backend ('paddle', 'onnxruntime', 'openvino'), xem ocr_backends.py
+            model_dir: Thư mục model ONNX (backend onnxruntime/openvino)
+            precision: 'fp32' hoặc 'int8'
         """
         try:
-            # Khởi tạo PaddleOCR
-            logger.info("🔄 Initializing PaddleOCR...")
-            self.ocr = PaddleOCR(lang='en')
-            logger.info("✅ PaddleOCR initialized successfully")
-            
-            # Vietnamese license plate patterns
-            self.license_plate_patterns = [
-                r'^\d{2}[A-Z]\d{4,5}$',      # 51A1234, 51A12345
-                r'^\d{2}[A-Z]\d{3}[A-Z]\d{2}$',  # 51A123A12
-                r'^\d{2}[A-Z]\d{2}[A-Z]\d{3}$',  # 51A12A123
-                r'^\d{2}[A-Z]\d{4}$',        # 51A1234
-                r'^\d{2}[A-Z]\d{3}[A-Z]\d{2}$',  # 51A123A12
-                r'^\d{2}[A-Z]\d{2}[A-Z]\d{3}$',  # 51A12A123
-                r'^\d{2}[A-Z]\d{3}$',        # 51A123 (thêm pattern này)
-            ]
+            # Khởi tạo OCR backend (mọi backend trả về cùng format rec_texts/rec_scores/rec_polys)
+            logger.info(f"🔄 Initializing OCR backend ({backend})...")
+            self.ocr = create_backend(backend, cpu_threads=cpu_threads, model_dir=model_dir, precision=precision)
+            self.backend_name = backend
+            self.precision = precision
+            logger.info(f"✅ OCR backend {backend} initialized successfully")
+            
+            # Bước tìm vùng biển số (contour/edge) trước khi nhận diện
+            self.plate_detector = PlateDetector() if use_plate_detector else None
+            
+            # Thu nhỏ ảnh trước OCR theo kích thước biển số dự kiến
+            self.plate_height_ratio = plate_height_ratio
+            self.target_plate_height = target_plate_height
+            self.min_side = min_side
+            self._seconds_per_pixel = None  # EMA thời gian OCR trên mỗi pixel, để ước lượng thời gian tiết kiệm
+            
+            # Kiểm tra, chuẩn hoá biển số Việt Nam (một lần duyệt, có sửa nhầm lẫn OCR)
+            self.plate_validator = PlateValidator()
             
             logger.info("✅ Simple OCR Service initialized for license plate recognition")
             
@@ -47,98 +85,355 @@ class SimpleOCRService:
         """
         Xử lý ảnh và tìm biển số xe
         """
+        return self.process_images([image])[0]
+    
+    def process_images(self, images: list, recognize_only=False) -> list:
+        """
+        Xử lý một batch ảnh, gộp OCR của cả batch thành một lần gọi OCR backend
+        
+        Args:
+            images: Danh sách ảnh BGR
+            recognize_only: Ảnh đã là vùng biển số (camera chĩa sát biển số hoặc ROI cắt sẵn),
+                bỏ qua tìm vùng biển số và text detection, chỉ chạy model recognition
+            
+        Returns:
+            list: Kết quả cho từng ảnh, cùng format với process_image
+        """
         try:
             start_time = datetime.now()
             
-            # Chạy OCR trên toàn bộ ảnh
-            ocr_results = self.ocr.ocr(image)
-            
             # Tìm biển số xe
-            license_plates = []
-            all_texts = []
+            frames = [{
+                'license_plates': [],
+                'all_texts': [],
+                'detection_path': 'full_frame',
+                'plate_regions': [],
+                'timings': {}  # Thời gian từng bước (giây), bước chạy chung cả batch được tính cho mọi ảnh
+            } for _ in images]
             
-            # Xử lý format mới của PaddleOCR
-            if ocr_results and len(ocr_results) > 0:
-                result = ocr_results[0]  # Lấy kết quả đầu tiên
+            if recognize_only:
+                self._run_recognition(images, frames)
+            
+            # Tìm vùng biển số trước, chỉ chạy OCR trên các vùng cắt
+            crops = []
+            crop_owners = []
+            for index, image in enumerate([] if recognize_only else images):
+                stage_start = time.perf_counter()
+                plate_regions = self.plate_detector.detect(image) if self.plate_detector else []
+                self._add_timing(frames[index], 'detect', stage_start)
+                frames[index]['plate_regions'] = plate_regions
+                for (x, y, w, h) in plate_regions:
+                    crops.append(image[y:y + h, x:x + w])
+                    crop_owners.append((index, (x, y)))
+            
+            if crops:
+                stage_start = time.perf_counter()
+                crop_results = self.ocr.ocr(crops) or []
+                for index in set(index for index, _ in crop_owners):
+                    self._add_timing(frames[index], 'ocr', stage_start)
+                
+                for (index, offset), result in zip(crop_owners, crop_results):
+                    frame = frames[index]
+                    stage_start = time.perf_counter()
+                    self._collect_texts(result, offset, frame['license_plates'], frame['all_texts'])
+                    self._add_timing(frame, 'postprocess', stage_start)
                 
-                # Lấy text và confidence từ format mới
-                if 'rec_texts' in result and 'rec_scores' in result:
-                    texts = result['rec_texts']
-                    scores = result['rec_scores']
-                    polys = result.get('rec_polys', [])
-                    
-                    for i, (text, confidence) in enumerate(zip(texts, scores)):
-                        # Lấy bounding box nếu có
-                        bbox = polys[i] if i < len(polys) else []
-                        
-                        # Convert bbox to list nếu là numpy array
-                        bbox_list = bbox.tolist() if hasattr(bbox, 'tolist') else bbox
-                        
-                        # Lưu tất cả text
-                        all_texts.append({
-                            'text': text,
-                            'confidence': float(confidence),
-                            'bbox': bbox_list
-                        })
-                        
-                        # Kiểm tra có phải biển số không
-                        if self._validate_license_plate(text):
-                            license_plates.append({
-                                'text': text,
-                                'normalized_text': self._normalize_license_plate(text),
-                                'confidence': float(confidence),
-                                'bbox': bbox_list,
-                                'is_valid': True
-                            })
+                for frame in frames:
+                    if frame['license_plates']:
+                        frame['detection_path'] = 'plate_regions'
+                    else:
+                        # Không có biển số hợp lệ trong các vùng cắt -> chạy lại trên toàn bộ ảnh
+                        frame['all_texts'] = []
+            
+            # Chạy OCR trên toàn bộ ảnh (đã thu nhỏ theo kích thước biển số dự kiến) cho các ảnh chưa có kết quả
+            full_frame_indexes = [i for i, frame in enumerate(frames) if frame['detection_path'] == 'full_frame']
+            if full_frame_indexes:
+                scaled = []
+                for i in full_frame_indexes:
+                    stage_start = time.perf_counter()
+                    scaled.append(self._resize_for_ocr(images[i]))
+                    self._add_timing(frames[i], 'resize', stage_start)
+                self._run_full_frame(full_frame_indexes, scaled, images, frames)
+                
+                # Ảnh thu nhỏ không có biển số hợp lệ -> thử lại một lần ở độ phân giải gốc
+                retry_indexes = [
+                    i for i, (_, scale) in zip(full_frame_indexes, scaled)
+                    if scale < 1.0 and not frames[i]['license_plates']
+                ]
+                if retry_indexes:
+                    for i in retry_indexes:
+                        frames[i]['all_texts'] = []
+                        frames[i]['resolution_retry'] = True
+                    self._run_full_frame(retry_indexes, [(images[i], 1.0) for i in retry_indexes], images, frames)
+                
+                for i in full_frame_indexes:
+                    frame = frames[i]
+                    height, width = images[i].shape[:2]
+                    logger.info(
+                        f"📐 OCR input {width}x{height} -> {frame['input_size'][0]}x{frame['input_size'][1]}"
+                        f"{' (retried at full resolution)' if frame.get('resolution_retry') else ''}, "
+                        f"saved ~{frame['time_saved'] * 1000:.0f}ms"
+                    )
             
             processing_time = (datetime.now() - start_time).total_seconds()
+            timestamp = datetime.now().isoformat()
             
-            return {
+            return [{
                 'success': True,
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': timestamp,
                 'processing_time': processing_time,
-                'license_plates': license_plates,
-                'all_texts': all_texts,
-                'total_texts_found': len(all_texts),
-                'valid_plates_found': len(license_plates)
-            }
+                'batch_size': len(images),
+                'detection_path': frame['detection_path'],
+                'plate_regions_found': len(frame['plate_regions']),
+                'input_size': frame.get('input_size'),
+                'resolution_retry': frame.get('resolution_retry', False),
+                'time_saved': round(frame.get('time_saved', 0.0), 4),
+                'license_plates': frame['license_plates'],
+                'all_texts': frame['all_texts'],
+                'total_texts_found': len(frame['all_texts']),
+                'valid_plates_found': len(frame['license_plates']),
+                'timings': {stage: round(seconds, 6) for stage, seconds in frame['timings'].items()}
+            } for frame in frames]
             
         except Exception as e:
             logger.error(f"Error processing image: {e}")
-            return {
+            return [{
                 'success': False,
                 'error': str(e),
                 'timestamp': datetime.now().isoformat()
-            }
+            } for _ in images]
     
-    def _validate_license_plate(self, text: str) -> bool:
+    def plan_scale(self, width: int, height: int) -> float:
+        """Tỉ lệ thu nhỏ ảnh trước OCR theo cấu hình của service (xem plan_ocr_scale)"""
+        return plan_ocr_scale(width, height, self.plate_height_ratio, self.target_plate_height, self.min_side)
+    
+    def _resize_for_ocr(self, image: np.ndarray):
+        """Thu nhỏ ảnh theo plan_scale, trả về (ảnh, tỉ lệ)"""
+        height, width = image.shape[:2]
+        scale = self.plan_scale(width, height)
+        if scale >= 1.0:
+            return image, 1.0
+        
+        size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+    
+    def _run_full_frame(self, indexes: list, scaled: list, images: list, frames: list):
         """
-        Validate Vietnamese license plate format
+        Chạy OCR một lần cho các ảnh (đã resize), bbox được đổi về toạ độ ảnh gốc
+        
+        Args:
+            indexes: Vị trí của các ảnh trong batch
+            scaled: Danh sách (ảnh đưa vào OCR, tỉ lệ so với ảnh gốc)
+            images: Ảnh gốc của cả batch
+            frames: Kết quả tạm của cả batch
+        """
+        call_start = time.perf_counter()
+        ocr_results = self.ocr.ocr([image for image, _ in scaled]) or []
+        elapsed = time.perf_counter() - call_start
+        for index in indexes:
+            self._add_timing(frames[index], 'ocr', call_start)
+        
+        # Cập nhật thời gian OCR trung bình trên mỗi pixel
+        input_pixels = [image.shape[0] * image.shape[1] for image, _ in scaled]
+        total_pixels = float(sum(input_pixels)) or 1.0
+        seconds_per_pixel = elapsed / total_pixels
+        if self._seconds_per_pixel is None:
+            self._seconds_per_pixel = seconds_per_pixel
+        else:
+            self._seconds_per_pixel = 0.9 * self._seconds_per_pixel + 0.1 * seconds_per_pixel
+        
+        # Xử lý format mới của PaddleOCR
+        for index, (image, scale), pixels, result in zip(indexes, scaled, input_pixels, ocr_results):
+            frame = frames[index]
+            stage_start = time.perf_counter()
+            self._collect_texts(result, (0, 0), frame['license_plates'], frame['all_texts'], scale)
+            self._add_timing(frame, 'postprocess', stage_start)
+            
+            original_pixels = images[index].shape[0] * images[index].shape[1]
+            actual_time = elapsed * pixels / total_pixels
+            if 'time_saved' not in frame:
+                frame['time_saved'] = self._seconds_per_pixel * original_pixels - actual_time
+            else:
+                # Lần thử lại ở độ phân giải gốc: trừ thêm thời gian của lần chạy này
+                frame['time_saved'] -= actual_time
+            frame['input_size'] = [image.shape[1], image.shape[0]]
+    
+    def _run_recognition(self, images: list, frames: list):
+        """
+        Chạy riêng model recognition trên các vùng biển số cắt sẵn, mỗi dòng text một ảnh.
+        Biển vuông được chia đôi theo chiều cao, hai dòng được ghép lại theo vị trí như kết quả OCR thường
+        """
+        lines = []
+        owners = []
+        for index, image in enumerate(images):
+            frames[index]['detection_path'] = 'recognition_only'
+            height, width = image.shape[:2]
+            if width < height * TWO_LINE_MAX_ASPECT and height >= 2:
+                half = height // 2
+                boxes = [(0, 0, width, half), (0, half, width, height - half)]
+            else:
+                boxes = [(0, 0, width, height)]
+            for (x, y, w, h) in boxes:
+                lines.append(image[y:y + h, x:x + w])
+                owners.append((index, [[x, y], [x + w, y], [x + w, y + h], [x, y + h]]))
+        
+        stage_start = time.perf_counter()
+        recognized = self.ocr.recognize(lines) if lines else []
+        for frame in frames:
+            self._add_timing(frame, 'ocr', stage_start)
+        
+        # Đưa về format rec_texts/rec_scores/rec_polys để kiểm tra biển số như mọi kết quả OCR khác
+        results = [{'rec_texts': [], 'rec_scores': [], 'rec_polys': []} for _ in images]
+        for (index, box), (text, score) in zip(owners, recognized):
+            results[index]['rec_texts'].append(text)
+            results[index]['rec_scores'].append(score)
+            results[index]['rec_polys'].append(box)
+        
+        for index, (image, result) in enumerate(zip(images, results)):
+            frame = frames[index]
+            stage_start = time.perf_counter()
+            self._collect_texts(result, (0, 0), frame['license_plates'], frame['all_texts'])
+            self._add_timing(frame, 'postprocess', stage_start)
+            frame['input_size'] = [image.shape[1], image.shape[0]]
+    
+    @staticmethod
+    def _add_timing(frame: dict, stage: str, stage_start: float):
+        """Cộng dồn thời gian của một bước (tính từ stage_start) vào kết quả tạm của ảnh"""
+        timings = frame['timings']
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - stage_start
+    
+    def _collect_texts(self, result, offset, license_plates: list, all_texts: list, scale=1.0):
+        """
+        Lấy text từ một kết quả PaddleOCR, bbox được đổi về toạ độ ảnh gốc
+        (chia cho tỉ lệ resize rồi cộng offset của vùng cắt)
+        """
+        # Lấy text và confidence từ format mới
+        if not result or 'rec_texts' not in result or 'rec_scores' not in result:
+            return
+        
+        texts = result['rec_texts']
+        scores = result['rec_scores']
+        polys = result.get('rec_polys', [])
+        offset_x, offset_y = offset
+        unmatched_lines = []
+        
+        for i, (text, confidence) in enumerate(zip(texts, scores)):
+            # Lấy bounding box nếu có
+            bbox = polys[i] if i < len(polys) else []
+            
+            # Convert bbox to list, đổi về toạ độ ảnh gốc
+            if len(bbox) > 0:
+                bbox_list = (np.asarray(bbox, dtype=float) / scale + (offset_x, offset_y)).tolist()
+            else:
+                bbox_list = []
+            
+            # Lưu tất cả text
+            all_texts.append({
+                'text': text,
+                'confidence': float(confidence),
+                'bbox': bbox_list
+            })
+            
+            # Kiểm tra và chuẩn hoá biển số trong một lần
+            normalized_text = self.plate_validator.parse(text)
+            if normalized_text:
+                license_plates.append({
+                    'text': text,
+                    'normalized_text': normalized_text,
+                    'confidence': float(confidence),
+                    'bbox': bbox_list,
+                    'is_valid': True
+                })
+            elif bbox_list:
+                unmatched_lines.append((text, float(confidence), bbox_list))
+        
+        # Biển xe máy / biển vuông bị OCR tách thành 2 dòng: ghép lại theo vị trí
+        if len(unmatched_lines) >= 2:
+            license_plates.extend(self._assemble_two_line_plates(unmatched_lines))
+    
+    def _assemble_two_line_plates(self, lines: list) -> list:
         """
-        if not text:
-            return False
+        Ghép các cặp dòng text nằm chồng lên nhau (dòng dưới ngay dưới dòng trên, chồng lấn theo chiều ngang,
+        chiều cao gần bằng nhau) thành một biển số và kiểm tra lại
         
-        # Clean text - chỉ giữ lại chữ và số
-        cleaned_text = re.sub(r'[^A-Z0-9]', '', text.upper())
+        Args:
+            lines: Các dòng chưa phải biển số hợp lệ: (text, confidence, bbox)
         
-        # Kiểm tra độ dài tối thiểu
-        if len(cleaned_text) < 6:
-            return False
+        Returns:
+            list: Các biển số 2 dòng hợp lệ
+        """
+        boxes = []
+        for text, confidence, bbox in lines:
+            points = np.asarray(bbox, dtype=float)
+            x0, y0 = points.min(axis=0).tolist()
+            x1, y1 = points.max(axis=0).tolist()
+            boxes.append((text, confidence, x0, y0, x1, y1))
         
-        # Check against patterns
-        for pattern in self.license_plate_patterns:
-            if re.match(pattern, cleaned_text):
-                return True
+        plates = []
+        used = set()
+        for top_index, (top_text, top_conf, tx0, ty0, tx1, ty1) in enumerate(boxes):
+            if top_index in used:
+                continue
+            top_height = ty1 - ty0
+            best = None
+            
+            for bottom_index, (bottom_text, bottom_conf, bx0, by0, bx1, by1) in enumerate(boxes):
+                if bottom_index == top_index or bottom_index in used:
+                    continue
+                bottom_height = by1 - by0
+                if top_height <= 0 or bottom_height <= 0:
+                    continue
+                
+                # Chiều cao hai dòng gần bằng nhau
+                if min(top_height, bottom_height) / max(top_height, bottom_height) < 0.6:
+                    continue
+                
+                # Dòng dưới bắt đầu dưới tâm dòng trên và cách không quá một dòng
+                gap = by0 - ty1
+                if by0 < (ty0 + ty1) / 2 or gap > max(top_height, bottom_height):
+                    continue
+                
+                # Chồng lấn theo chiều ngang so với dòng hẹp hơn
+                overlap = min(tx1, bx1) - max(tx0, bx0)
+                if overlap / min(tx1 - tx0, bx1 - bx0) < 0.5:
+                    continue
+                
+                if best is None or gap < best[1]:
+                    best = (bottom_index, gap)
+            
+            if best is None:
+                continue
+            
+            bottom_index = best[0]
+            bottom_text, bottom_conf, bx0, by0, bx1, by1 = boxes[bottom_index]
+            normalized_text = self.plate_validator.parse(top_text + bottom_text)
+            if not normalized_text:
+                continue
+            
+            used.update((top_index, bottom_index))
+            x0, y0, x1, y1 = min(tx0, bx0), ty0, max(tx1, bx1), by1
+            plates.append({
+                'text': f"{top_text} {bottom_text}",
+                'normalized_text': normalized_text,
+                'confidence': min(top_conf, bottom_conf),
+                'bbox': [[x0, y0], [x1, y0], [x1, y1], [x0, y1]],
+                'is_valid': True,
+                'lines': 2
+            })
         
-        return False
+        return plates
+    
+    def _validate_license_plate(self, text: str) -> bool:
+        """
+        Validate Vietnamese license plate format
+        """
+        return self.plate_validator.is_valid(text)
     
     def _normalize_license_plate(self, text: str) -> str:
         """
         Normalize license plate text
         """
-        # Clean text
-        cleaned_text = re.sub(r'[^A-Z0-9]', '', text.upper())
-        return cleaned_text
+        return self.plate_validator.parse(text) or re.sub(r'[^A-Z0-9]', '', text.upper())
     
     def get_detection_summary(self, results: dict) -> dict:
         """
@@ -199,6 +494,7 @@ def test_ocr_service():
     print("\n📊 OCR Results:")
     print(f"Success: {result.get('success')}")
     print(f"Processing Time: {result.get('processing_time', 0):.3f}s")
+    print(f"Detection Path: {result.get('detection_path')}")
     print(f"Total Texts Found: {result.get('total_texts_found', 0)}")
     print(f"Valid Plates Found: {result.get('valid_plates_found', 0)}")
     
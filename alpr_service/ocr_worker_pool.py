@@ -0,0 +1,588 @@
+#!/usr/bin/env python3
+"""
+OCR Worker Pool - Chạy OCR trên nhiều process, mỗi process một OCR backend riêng
+Ảnh đã decode được chuyển sang worker qua multiprocessing.shared_memory thay vì pickle
+"""
+
+import os
+import time
+import logging
+import itertools
+import threading
+import multiprocessing as mp
+from multiprocessing import connection as mp_connection
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class _ResultChannel:
+    """Đầu ghi pipe kết quả của một worker (thread OCR và thread điều khiển cùng gửi nên cần khoá)"""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._lock = threading.Lock()
+
+    def put(self, message):
+        with self._lock:
+            self._connection.send(message)
+
+def _control_loop(worker_index, control_queue, result_queue):
+    """Nhận lệnh điều khiển (profile) trên thread riêng, không chặn vòng lặp OCR"""
+    from profiler import sample_stacks
+
+    while True:
+        command = control_queue.get()
+        if command is None:
+            break
+
+        kind, request_id, seconds, interval = command
+        if kind == 'profile':
+            try:
+                stacks = sample_stacks(seconds, interval, prefix=f"ocr-worker-{worker_index}")
+            except Exception as e:
+                logger.error(f"❌ Profiling OCR worker {worker_index} failed: {e}")
+                stacks = {}
+            result_queue.put(('profile', request_id, (worker_index, stacks)))
+
+def _worker_main(worker_index, threads_per_worker, task_queue, result_connection, control_queue=None, backend_options=None):
+    """
+    Vòng lặp của một worker process (kết quả gửi qua pipe riêng của worker)
+    """
+    result_queue = _ResultChannel(result_connection)
+
+    # Giới hạn số thread tính toán trước khi import paddle/numpy backend
+    for env_name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[env_name] = str(threads_per_worker)
+
+    from ocr_service import SimpleOCRService
+
+    try:
+        service = SimpleOCRService(cpu_threads=threads_per_worker, **(backend_options or {}))
+    except Exception as e:
+        result_queue.put(('failed', worker_index, str(e)))
+        return
+
+    result_queue.put(('ready', worker_index, None))
+
+    if control_queue is not None:
+        threading.Thread(
+            target=_control_loop,
+            args=(worker_index, control_queue, result_queue),
+            name="ocr-worker-control",
+            daemon=True
+        ).start()
+
+    # Slot shared memory dùng lại giữa các task, chỉ attach một lần
+    attached_slots = {}
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        task_id, descriptors, recognize_only = task
+        temporary = []
+        images = []
+        try:
+            for shm_name, shape, dtype, is_slot in descriptors:
+                if is_slot:
+                    shm = attached_slots.get(shm_name)
+                    if shm is None:
+                        shm = shared_memory.SharedMemory(name=shm_name)
+                        attached_slots[shm_name] = shm
+                else:
+                    shm = shared_memory.SharedMemory(name=shm_name)
+                    temporary.append(shm)
+                images.append(np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf))
+
+            results = service.process_images(images, recognize_only=recognize_only)
+            result_queue.put(('result', task_id, results))
+        except Exception as e:
+            result_queue.put(('error', task_id, str(e)))
+        finally:
+            # Phải bỏ hết view vào buffer trước khi close shared memory
+            images = None
+            for shm in temporary:
+                shm.close()
+
+    for shm in attached_slots.values():
+        shm.close()
+
+class OCRWorkerPool:
+    def __init__(self, size=None, threads_per_worker=1, slot_bytes=8 * 1024 * 1024, slots=None, backend_options=None,
+                 max_batch_size=8, dispatchers=None, slot_wait=0.5, task_timeout=60, restart_delay=1.0, max_restarts=5):
+        """
+        Khởi tạo worker pool
+
+        Args:
+            size: Số worker process (mặc định = số core)
+            threads_per_worker: Số thread tính toán của OCR backend trong mỗi worker
+            slot_bytes: Kích thước mỗi slot shared memory (đủ cho một ảnh đã decode)
+            slots: Số slot shared memory tạo sẵn (mặc định 4 slot mỗi worker,
+                không ít hơn max_batch_size x dispatchers để mọi batch đang chạy cùng lúc đều có slot)
+            backend_options: Tham số OCR backend cho SimpleOCRService (backend, model_dir, precision)
+            max_batch_size: Số ảnh tối đa trong một batch của scheduler
+            dispatchers: Số batch gửi cùng lúc (mặc định = số worker)
+            slot_wait: Thời gian tối đa chờ slot rảnh (giây), quá thì ảnh còn thiếu slot dùng buffer tạm
+            task_timeout: Thời gian tối đa chờ kết quả một batch (giây), quá thì worker bị coi là treo và bị dừng
+            restart_delay: Thời gian chờ trước khi khởi động lại worker chết (tăng gấp đôi mỗi lần chết liên tiếp)
+            max_restarts: Số lần khởi động lại liên tiếp tối đa khi worker chết trước khi sẵn sàng
+        """
+        self.size = max(1, int(size or os.cpu_count() or 1))
+        self.threads_per_worker = max(1, int(threads_per_worker))
+        self.slot_bytes = int(slot_bytes)
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.dispatchers = max(1, int(dispatchers or self.size))
+        self.num_slots = max(int(slots or self.size * 4), self.max_batch_size * self.dispatchers)
+        self.slot_wait = slot_wait
+        self.task_timeout = task_timeout
+        self.restart_delay = restart_delay
+        self.max_restarts = max_restarts
+        self.backend_options = dict(backend_options or {})
+
+        self._context = mp.get_context('spawn')
+        self._processes = {}
+        self._task_queues = {}
+        # Pipe kết quả riêng mỗi worker: dừng (terminate) một worker chỉ làm hỏng pipe của chính nó
+        self._result_connections = {}
+        self._detached_connections = []
+        self._control_queues = {}
+        # Task đã gửi cho từng worker (chưa có kết quả), worker chết thì các task này bị báo lỗi
+        self._worker_tasks = {}
+        # Worker đã chết: lần chết liên tiếp và thời điểm khởi động lại (None = không khởi động lại)
+        self._crashes = {}
+        self._pending_restarts = {}
+        self._last_worker_check = 0.0
+
+        self._slots = []
+        self._free_slots = []
+        self._slot_available = threading.Condition()
+
+        self._futures = {}
+        self._profiles = {}
+        self._task_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._running = False
+        self._result_thread = None
+
+        self._stats = {
+            'tasks_total': 0,
+            'frames_total': 0,
+            'errors_total': 0,
+            'temporary_buffers_total': 0,
+            'worker_restarts_total': 0
+        }
+        self._ready_workers = set()
+        self._failed_workers = set()
+
+    def start(self):
+        """Tạo slot shared memory và khởi động các worker process"""
+        if self._running:
+            return
+        self._running = True
+
+        for _ in range(self.num_slots):
+            shm = shared_memory.SharedMemory(create=True, size=self.slot_bytes)
+            self._slots.append(shm)
+            self._free_slots.append(shm)
+
+        for worker_index in range(self.size):
+            self._start_worker(worker_index)
+
+        self._result_thread = threading.Thread(target=self._result_loop, name="ocr-pool-results", daemon=True)
+        self._result_thread.start()
+
+        logger.info(
+            f"✅ OCR worker pool started ({self.size} workers x {self.threads_per_worker} threads, "
+            f"{self.num_slots} shared memory slots)"
+        )
+
+    def wait_ready(self, timeout=None, poll_interval=0.2) -> int:
+        """
+        Chờ mọi worker load xong model (hoặc báo lỗi)
+
+        Returns:
+            int: Số worker sẵn sàng
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                ready = len(self._ready_workers)
+                done = ready + len(self._failed_workers)
+            if done >= self.size or (deadline is not None and time.monotonic() >= deadline):
+                return ready
+            time.sleep(poll_interval)
+
+    def stop(self):
+        """Dừng worker và giải phóng shared memory"""
+        if not self._running:
+            return
+        self._running = False
+
+        for task_queue in self._task_queues.values():
+            task_queue.put(None)
+        for control_queue in self._control_queues.values():
+            control_queue.put(None)
+        for process in self._processes.values():
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._processes = {}
+
+        if self._result_thread:
+            self._result_thread.join(timeout=5)
+        with self._lock:
+            connections = list(self._result_connections.values()) + self._detached_connections
+            self._result_connections = {}
+            self._detached_connections = []
+        for result_connection in connections:
+            result_connection.close()
+
+        with self._lock:
+            pending = list(self._futures.values())
+            self._futures = {}
+        # Task còn dở: báo lỗi cho người chờ và trả buffer trước khi giải phóng shared memory
+        for future, buffers, _ in pending:
+            self._release_buffers(buffers)
+            if not future.done():
+                future.set_exception(RuntimeError('OCR worker pool stopped'))
+
+        for shm in self._slots:
+            shm.close()
+            shm.unlink()
+        self._slots = []
+
+    def process_images(self, images: list, recognize_only=False, timeout=None) -> list:
+        """
+        Chạy OCR cho một batch ảnh trên một worker, cùng format với SimpleOCRService.process_images
+
+        Raises:
+            TimeoutError: Quá timeout (mặc định task_timeout) chưa có kết quả, worker giữ task bị dừng
+        """
+        future = self.submit(images, recognize_only)
+        try:
+            return future.result(timeout=timeout or self.task_timeout)
+        except FutureTimeoutError:
+            self._kill_worker_of(future)
+            raise TimeoutError(f"OCR worker did not answer within {timeout or self.task_timeout}s")
+
+    def process_image(self, image: np.ndarray) -> dict:
+        """Chạy OCR cho một ảnh"""
+        return self.process_images([image])[0]
+
+    def submit(self, images: list, recognize_only=False) -> Future:
+        """
+        Copy ảnh vào shared memory và gửi task cho worker (recognize_only: ảnh là vùng biển số cắt sẵn)
+
+        Returns:
+            Future: Danh sách kết quả cho từng ảnh
+        """
+        if not self._running:
+            raise RuntimeError('OCR worker pool is not running')
+
+        images = [np.ascontiguousarray(image) for image in images]
+        descriptors = []
+        buffers = []
+        try:
+            for image, (shm, is_slot) in zip(images, self._acquire_buffers([image.nbytes for image in images])):
+                buffers.append((shm, is_slot))
+                np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)[...] = image
+                descriptors.append((shm.name, image.shape, image.dtype.str, is_slot))
+        except Exception:
+            self._release_buffers(buffers)
+            raise
+
+        future = Future()
+        task_id = next(self._task_ids)
+        with self._lock:
+            worker_index = self._pick_worker()
+            if worker_index is None:
+                self._release_buffers(buffers)
+                raise RuntimeError('No OCR worker is available')
+            self._futures[task_id] = (future, buffers, worker_index)
+            self._worker_tasks[worker_index].add(task_id)
+            task_queue = self._task_queues[worker_index]
+            self._stats['tasks_total'] += 1
+            self._stats['frames_total'] += len(images)
+
+        task_queue.put((task_id, descriptors, recognize_only))
+        return future
+
+    def profile(self, seconds, interval=0.005) -> dict:
+        """
+        Lấy mẫu stack trong mọi worker đang chạy cùng lúc
+
+        Returns:
+            dict: worker_index -> collapsed stacks (xem profiler.sample_stacks)
+        """
+        with self._lock:
+            workers = [index for index in self._ready_workers if self._processes[index].is_alive()]
+        if not workers:
+            return {}
+
+        future = Future()
+        request_id = next(self._task_ids)
+        with self._lock:
+            self._profiles[request_id] = (future, len(workers), {})
+        for worker_index in workers:
+            self._control_queues[worker_index].put(('profile', request_id, seconds, interval))
+
+        try:
+            return future.result(timeout=seconds + 10)
+        except Exception:
+            # Worker không trả lời kịp: trả về phần đã nhận
+            with self._lock:
+                entry = self._profiles.pop(request_id, None)
+            return dict(entry[2]) if entry else {}
+
+    def get_stats(self) -> dict:
+        """Thống kê pool và độ sâu hàng đợi"""
+        with self._lock:
+            stats = dict(self._stats)
+            in_flight = len(self._futures)
+            ready = len(self._ready_workers)
+        stats.update({
+            'workers': self.size,
+            'workers_ready': ready,
+            'workers_alive': sum(1 for p in self._processes.values() if p.is_alive()),
+            'workers_failed': len(self._failed_workers),
+            'threads_per_worker': self.threads_per_worker,
+            'queue_depth': max(0, in_flight - ready),
+            'in_flight': in_flight,
+            'free_slots': len(self._free_slots),
+            'slots': self.num_slots,
+            'slot_bytes': self.slot_bytes
+        })
+        return stats
+
+    def _start_worker(self, worker_index):
+        # Hàng đợi riêng mỗi worker: biết chính xác task nào nằm ở worker nào
+        # (khởi động lại thì dùng hàng đợi mới tạo lúc worker chết, có thể đã có task chờ)
+        control_queue = self._context.Queue()
+        reader, writer = self._context.Pipe(duplex=False)
+        with self._lock:
+            task_queue = self._task_queues.get(worker_index) or self._context.Queue()
+            self._task_queues[worker_index] = task_queue
+            self._control_queues[worker_index] = control_queue
+            self._worker_tasks.setdefault(worker_index, set())
+        process = self._context.Process(
+            target=_worker_main,
+            args=(worker_index, self.threads_per_worker, task_queue, writer, control_queue,
+                  self.backend_options),
+            name=f"ocr-worker-{worker_index}",
+            daemon=True
+        )
+        process.start()
+        # Chỉ worker giữ đầu ghi: worker chết thì đầu đọc nhận EOF
+        writer.close()
+        with self._lock:
+            self._result_connections[worker_index] = reader
+        self._processes[worker_index] = process
+
+    def _detach_connection(self, worker_index):
+        """Bỏ pipe kết quả của worker khỏi vòng nhận kết quả (thread nhận kết quả đóng pipe ở vòng sau)"""
+        with self._lock:
+            result_connection = self._result_connections.pop(worker_index, None)
+            if result_connection is not None:
+                self._detached_connections.append(result_connection)
+
+    def _pick_worker(self):
+        """Worker ít task nhất, ưu tiên worker đã load xong model; worker đang chờ khởi động lại nhận task sau cùng (gọi khi giữ _lock)"""
+        candidates = [
+            index for index, process in self._processes.items()
+            if index not in self._failed_workers and (
+                self._pending_restarts.get(index) is not None if index in self._pending_restarts else process.is_alive())
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda index: (
+            index in self._pending_restarts, index not in self._ready_workers, len(self._worker_tasks[index])))
+
+    def _acquire_buffers(self, sizes):
+        """
+        Lấy slot cho cả batch trong một lần (không giữ một phần slot trong lúc chờ nên các batch không chặn nhau)
+        Chờ tối đa slot_wait, ảnh lớn hơn slot hoặc không đủ slot rảnh thì dùng buffer shared memory tạm
+
+        Returns:
+            list: (shm, is_slot) theo thứ tự sizes
+        """
+        needed = sum(1 for nbytes in sizes if nbytes <= self.slot_bytes)
+        with self._slot_available:
+            if needed:
+                self._slot_available.wait_for(lambda: len(self._free_slots) >= needed, timeout=self.slot_wait)
+            slots = [self._free_slots.pop() for _ in range(min(needed, len(self._free_slots)))]
+
+        buffers = []
+        try:
+            for nbytes in sizes:
+                if nbytes <= self.slot_bytes and slots:
+                    buffers.append((slots.pop(), True))
+                    continue
+                buffers.append((shared_memory.SharedMemory(create=True, size=max(1, nbytes)), False))
+                with self._lock:
+                    self._stats['temporary_buffers_total'] += 1
+        except Exception:
+            self._release_buffers(buffers + [(shm, True) for shm in slots])
+            raise
+        return buffers
+
+    def _release_buffers(self, buffers):
+        released = []
+        for shm, is_slot in buffers:
+            if is_slot:
+                released.append(shm)
+            else:
+                shm.close()
+                shm.unlink()
+        if released:
+            with self._slot_available:
+                self._free_slots.extend(released)
+                self._slot_available.notify_all()
+
+    def _result_loop(self):
+        """Nhận kết quả từ worker, trả về Future và thu hồi buffer"""
+        while self._running:
+            # Kiểm tra worker chết cả khi đang có tải (không chỉ lúc hàng đợi kết quả trống)
+            if time.monotonic() - self._last_worker_check >= 1.0:
+                self._last_worker_check = time.monotonic()
+                self._check_workers()
+            with self._lock:
+                # Pipe đã bỏ chỉ đóng ở thread này, không đóng khi đang chờ trên nó
+                detached, self._detached_connections = self._detached_connections, []
+                connections = {conn: index for index, conn in self._result_connections.items()}
+            for result_connection in detached:
+                result_connection.close()
+            if not connections:
+                time.sleep(0.2)
+                continue
+
+            for result_connection in mp_connection.wait(list(connections), timeout=1):
+                with self._lock:
+                    attached = self._result_connections.get(connections[result_connection]) is result_connection
+                if not attached:
+                    continue
+                try:
+                    message = result_connection.recv()
+                except (EOFError, OSError):
+                    # Worker đã thoát: vòng sau _check_workers báo lỗi task và khởi động lại ngay
+                    self._detach_connection(connections[result_connection])
+                    self._last_worker_check = 0.0
+                    continue
+                self._handle_message(*message)
+
+    def _handle_message(self, kind, key, payload):
+        """Xử lý một message từ worker: trạng thái khởi động, profile hoặc kết quả task"""
+        if kind == 'ready':
+            with self._lock:
+                self._ready_workers.add(key)
+                self._crashes[key] = 0
+            logger.info(f"✅ OCR worker {key} ready")
+            return
+
+        if kind == 'profile':
+            self._collect_profile(key, payload)
+            return
+
+        if kind == 'failed':
+            logger.error(f"❌ OCR worker {key} failed to initialize: {payload}")
+            with self._lock:
+                self._failed_workers.add(key)
+            return
+
+        with self._lock:
+            entry = self._futures.pop(key, None)
+            if entry is not None:
+                self._worker_tasks[entry[2]].discard(key)
+            if kind == 'error':
+                self._stats['errors_total'] += 1
+        if entry is None:
+            return
+
+        future, buffers, _ = entry
+        self._release_buffers(buffers)
+        if future.done():
+            return
+        if kind == 'result':
+            future.set_result(payload)
+        else:
+            future.set_exception(RuntimeError(payload))
+
+    def _collect_profile(self, request_id, payload):
+        worker_index, stacks = payload
+        with self._lock:
+            entry = self._profiles.get(request_id)
+            if entry is None:
+                return
+            future, expected, collected = entry
+            collected[worker_index] = stacks
+            if len(collected) < expected:
+                return
+            del self._profiles[request_id]
+        future.set_result(collected)
+
+    def _kill_worker_of(self, future):
+        """Dừng worker đang giữ task của future (treo quá task_timeout), _check_workers báo lỗi và khởi động lại"""
+        with self._lock:
+            worker_index = next((entry[2] for entry in self._futures.values() if entry[0] is future), None)
+            process = self._processes.get(worker_index)
+        if process is not None and process.is_alive():
+            logger.error(f"❌ OCR worker {worker_index} did not answer within {self.task_timeout}s, terminating")
+            # Bỏ pipe kết quả trước khi terminate, pipe có thể hỏng nếu worker đang ghi dở
+            self._detach_connection(worker_index)
+            process.terminate()
+
+    def _check_workers(self):
+        """Báo lỗi các task của worker đã chết, khởi động lại worker với backoff (chết liên tục thì bỏ)"""
+        now = time.monotonic()
+        for worker_index, process in list(self._processes.items()):
+            if not self._running:
+                return
+
+            if worker_index in self._pending_restarts:
+                restart_at = self._pending_restarts[worker_index]
+                if restart_at is not None and now >= restart_at and worker_index not in self._failed_workers:
+                    with self._lock:
+                        del self._pending_restarts[worker_index]
+                        self._stats['worker_restarts_total'] += 1
+                    self._start_worker(worker_index)
+                continue
+
+            if process.is_alive():
+                continue
+
+            self._detach_connection(worker_index)
+            with self._lock:
+                self._ready_workers.discard(worker_index)
+                orphaned = [(task_id, self._futures.pop(task_id)) for task_id in self._worker_tasks[worker_index]
+                            if task_id in self._futures]
+                self._worker_tasks[worker_index] = set()
+                # Task trong hàng đợi cũ đã bị báo lỗi, task mới chờ ở hàng đợi mới cho đến khi worker chạy lại
+                self._task_queues[worker_index] = self._context.Queue()
+                crashes = self._crashes.get(worker_index, 0) + 1
+                self._crashes[worker_index] = crashes
+                gave_up = worker_index not in self._failed_workers and crashes > self.max_restarts
+                if worker_index in self._failed_workers or gave_up:
+                    # Worker không load được model (hoặc chết liên tục) thì không khởi động lại nữa
+                    self._failed_workers.add(worker_index)
+                    restart_at = None
+                else:
+                    restart_at = now + min(60.0, self.restart_delay * 2 ** (crashes - 1))
+                self._pending_restarts[worker_index] = restart_at
+
+            for task_id, (future, buffers, _) in orphaned:
+                self._release_buffers(buffers)
+                if not future.done():
+                    future.set_exception(RuntimeError(f"OCR worker {worker_index} exited ({process.exitcode})"))
+
+            if restart_at is not None:
+                logger.warning(
+                    f"⚠️ OCR worker {worker_index} exited ({process.exitcode}), {len(orphaned)} tasks failed, "
+                    f"restarting in {restart_at - now:.0f}s"
+                )
+            elif gave_up:
+                logger.error(f"❌ OCR worker {worker_index} exited {crashes} times in a row, not restarting")
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Plate Detector - Tìm vùng nghi là biển số trước khi chạy OCR
+Dùng contour/edge của OpenCV, chạy nhanh trên CPU
+"""
+
+import cv2
+import numpy as np
+import logging
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class PlateDetector:
+    def __init__(self, work_width=640, min_aspect=1.0, max_aspect=8.0,
+                 min_area_ratio=0.002, max_area_ratio=0.25, max_candidates=3, padding=(0.15, 0.5)):
+        """
+        Khởi tạo plate detector
+
+        Args:
+            work_width: Chiều rộng ảnh dùng để tìm contour (ảnh lớn hơn sẽ được thu nhỏ)
+            min_aspect: Tỉ lệ rộng/cao nhỏ nhất (biển vuông 2 dòng ~1.3)
+            max_aspect: Tỉ lệ rộng/cao lớn nhất (dòng chữ của biển dài 1 dòng ~7)
+            min_area_ratio: Diện tích tối thiểu so với cả ảnh
+            max_area_ratio: Diện tích tối đa so với cả ảnh
+            max_candidates: Số vùng tối đa trả về
+            padding: Phần mở rộng (ngang, dọc) quanh mỗi vùng theo tỉ lệ kích thước vùng,
+                     mở rộng dọc nhiều hơn để không cắt mất dòng thứ hai của biển 2 dòng
+        """
+        self.work_width = work_width
+        self.min_aspect = min_aspect
+        self.max_aspect = max_aspect
+        self.min_area_ratio = min_area_ratio
+        self.max_area_ratio = max_area_ratio
+        self.max_candidates = max_candidates
+        self.padding = padding
+
+        self.blackhat_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (13, 5))
+        self.close_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (21, 7))
+        self.square_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+
+    def detect(self, image: np.ndarray) -> list:
+        """
+        Tìm các vùng nghi là biển số
+
+        Args:
+            image: Ảnh BGR (hoặc grayscale)
+
+        Returns:
+            list: Danh sách box (x, y, w, h) theo toạ độ ảnh gốc, vùng lớn trước
+        """
+        if image is None or image.size == 0:
+            return []
+
+        height, width = image.shape[:2]
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+        # Thu nhỏ ảnh để tìm contour nhanh hơn
+        scale = min(1.0, self.work_width / float(width))
+        if scale < 1.0:
+            gray = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+        # Blackhat làm nổi ký tự tối trên nền sáng, gradient theo trục x giữ lại vùng nhiều nét dọc
+        blackhat = cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, self.blackhat_kernel)
+        grad_x = cv2.Sobel(blackhat, cv2.CV_32F, 1, 0, ksize=-1)
+        grad_x = np.absolute(grad_x)
+        min_val, max_val = float(grad_x.min()), float(grad_x.max())
+        if max_val - min_val < 1e-6:
+            return []
+        grad_x = (255 * (grad_x - min_val) / (max_val - min_val)).astype(np.uint8)
+
+        # Nối các ký tự thành một khối rồi nhị phân hoá
+        grad_x = cv2.GaussianBlur(grad_x, (5, 5), 0)
+        grad_x = cv2.morphologyEx(grad_x, cv2.MORPH_CLOSE, self.close_kernel)
+        _, thresh = cv2.threshold(grad_x, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        thresh = cv2.erode(thresh, self.square_kernel, iterations=2)
+        thresh = cv2.dilate(thresh, self.square_kernel, iterations=2)
+
+        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        work_area = float(gray.shape[0] * gray.shape[1])
+        candidates = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if h == 0:
+                continue
+
+            aspect = w / float(h)
+            area_ratio = (w * h) / work_area
+            if not (self.min_aspect <= aspect <= self.max_aspect):
+                continue
+            if not (self.min_area_ratio <= area_ratio <= self.max_area_ratio):
+                continue
+
+            candidates.append((w * h, x, y, w, h))
+
+        candidates.sort(reverse=True)
+
+        boxes = []
+        for _, x, y, w, h in candidates[:self.max_candidates]:
+            # Mở rộng vùng và đổi về toạ độ ảnh gốc
+            pad_x = int(w * self.padding[0])
+            pad_y = int(h * self.padding[1])
+            x0 = max(0, int((x - pad_x) / scale))
+            y0 = max(0, int((y - pad_y) / scale))
+            x1 = min(width, int((x + w + pad_x) / scale))
+            y1 = min(height, int((y + h + pad_y) / scale))
+            boxes.append((x0, y0, x1 - x0, y1 - y0))
+
+        return boxes
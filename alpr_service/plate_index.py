@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Plate Index - Danh sách biển số xe đã đăng ký (đồng bộ từ server chính), tìm biển số gần nhất với text OCR
+Symmetric delete: mỗi biển số lưu hash của các biến thể xoá tối đa max_distance ký tự trong một mảng numpy
+đã sắp xếp, tra cứu chỉ băm vài biến thể của text OCR rồi searchsorted. Ứng viên được chấm bằng khoảng cách
+sửa có trọng số (cặp ký tự OCR hay nhầm rẻ hơn). Thay đổi nhỏ nằm trong delta/tombstone, gộp lại khi đủ lớn
+"""
+
+import re
+import time
+import random
+import logging
+import threading
+from itertools import combinations
+
+import numpy as np
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Chi phí thay một ký tự bằng ký tự khác / thêm hoặc bớt một ký tự
+SUBSTITUTION_COST = 1.0
+INDEL_COST = 1.0
+
+# Cặp ký tự OCR hay nhầm trên biển số (hai chiều): giống nhau về hình dạng thì rẻ hơn
+CONFUSION_COSTS = {
+    'O0': 0.25, 'D0': 0.25, 'Q0': 0.25, 'I1': 0.25, 'L1': 0.25, 'T1': 0.25,
+    'B8': 0.25, 'S5': 0.25, 'Z2': 0.25, 'G6': 0.25, 'A4': 0.25,
+    '86': 0.4, '83': 0.4, '89': 0.4, '80': 0.4, '60': 0.4, '90': 0.4, '56': 0.4, '35': 0.4, '17': 0.4,
+    'DO': 0.4, 'MN': 0.4, 'HN': 0.4, 'UV': 0.4, 'CG': 0.4, 'EF': 0.4, 'KX': 0.4, 'PR': 0.4
+}
+_SUBSTITUTION_COSTS = {}
+for _pair, _cost in CONFUSION_COSTS.items():
+    _SUBSTITUTION_COSTS[(_pair[0], _pair[1])] = _cost
+    _SUBSTITUTION_COSTS[(_pair[1], _pair[0])] = _cost
+
+# Text dài hơn thì không phải biển số, không đưa vào index
+MAX_PLATE_LENGTH = 16
+
+_NON_ALNUM = re.compile(r'[^A-Z0-9]')
+
+# Hash đa thức trên các byte của biến thể (byte 0 của phần đệm không đóng góp), rồi trộn bit kiểu splitmix64
+_MASK64 = (1 << 64) - 1
+_HASH_BASE = 0x100000001B3
+_POWERS = [pow(_HASH_BASE, exponent, 1 << 64) for exponent in range(1, MAX_PLATE_LENGTH + 1)]
+_HASH_POWERS = np.array(_POWERS, dtype=np.uint64)
+_ID_MASK = np.uint64(0xFFFFFFFF)
+
+def normalize_plate(text) -> str:
+    """Biển số viết hoa, chỉ giữ chữ và số (cùng dạng với normalized_text của OCR)"""
+    return _NON_ALNUM.sub('', str(text).upper()) if text else ''
+
+def weighted_distance(a: str, b: str, max_cost=None) -> float:
+    """Khoảng cách Levenshtein có trọng số theo CONFUSION_COSTS, dừng sớm (inf) khi chắc chắn vượt max_cost"""
+    if max_cost is not None:
+        if abs(len(a) - len(b)) * INDEL_COST > max_cost:
+            return float('inf')
+        if len(a) == len(b) and max_cost < 2 * INDEL_COST:
+            # Cùng độ dài mà thêm + bớt đã vượt max_cost: chỉ có thể là thay ký tự, không cần dựng bảng
+            cost = 0.0
+            for char_a, char_b in zip(a, b):
+                if char_a != char_b:
+                    cost += _SUBSTITUTION_COSTS.get((char_a, char_b), SUBSTITUTION_COST)
+                    if cost > max_cost:
+                        return float('inf')
+            return cost
+    previous = [j * INDEL_COST for j in range(len(b) + 1)]
+    for i, char_a in enumerate(a, 1):
+        current = [i * INDEL_COST]
+        for j, char_b in enumerate(b, 1):
+            substitution = 0.0 if char_a == char_b else _SUBSTITUTION_COSTS.get((char_a, char_b), SUBSTITUTION_COST)
+            current.append(min(previous[j] + INDEL_COST, current[j - 1] + INDEL_COST, previous[j - 1] + substitution))
+        if max_cost is not None and min(current) > max_cost:
+            return float('inf')
+        previous = current
+    return previous[-1]
+
+def _encode(plates, width):
+    """Danh sách biển số -> ma trận byte (n x width, đệm 0) và độ dài từng biển số"""
+    encoded = np.array(plates, dtype=f'S{width}')
+    matrix = encoded.view(np.uint8).reshape(len(plates), width)
+    return matrix, np.count_nonzero(matrix, axis=1)
+
+def _hash_rows(matrix):
+    hashes = (matrix.astype(np.uint64) * _HASH_POWERS[:matrix.shape[1]]).sum(axis=1, dtype=np.uint64)
+    hashes ^= hashes >> np.uint64(30)
+    hashes *= np.uint64(0xBF58476D1CE4E5B9)
+    hashes ^= hashes >> np.uint64(27)
+    hashes *= np.uint64(0x94D049BB133111EB)
+    hashes ^= hashes >> np.uint64(31)
+    # 32 bit là đủ: hash trùng chỉ thêm ứng viên, ứng viên luôn được chấm lại bằng khoảng cách thật
+    return (hashes >> np.uint64(32)).astype(np.uint32)
+
+def _hash_text(text):
+    """Cùng hash với _hash_rows cho một chuỗi (tra cứu một text nhanh hơn đi qua numpy)"""
+    value = sum(byte * power for byte, power in zip(text.encode('ascii'), _POWERS)) & _MASK64
+    value ^= value >> 30
+    value = (value * 0xBF58476D1CE4E5B9) & _MASK64
+    value ^= value >> 27
+    value = (value * 0x94D049BB133111EB) & _MASK64
+    value ^= value >> 31
+    return value >> 32
+
+def _variant_hashes(matrix, lengths, max_distance):
+    """
+    Hash của biển số và mọi biến thể xoá 1..max_distance ký tự, xử lý cả ma trận theo từng tổ hợp vị trí
+
+    Returns:
+        tuple: (hash uint32, chỉ số dòng) cùng độ dài
+    """
+    hashes = [_hash_rows(matrix)]
+    rows = [np.arange(len(matrix))]
+    for count in range(1, max_distance + 1):
+        for positions in combinations(range(matrix.shape[1]), count):
+            # Xoá vị trí nằm trong phần đệm thì trùng biến thể ít ký tự hơn, bỏ qua
+            valid = np.flatnonzero(lengths > positions[-1])
+            if not len(valid):
+                continue
+            hashes.append(_hash_rows(np.delete(matrix[valid], positions, axis=1)))
+            rows.append(valid)
+    return np.concatenate(hashes), np.concatenate(rows)
+
+class PlateIndex:
+    def __init__(self, max_distance=1, merge_threshold=2048):
+        """
+        Khởi tạo index
+
+        Args:
+            max_distance: Số ký tự xoá tối đa trong biến thể (1 = tìm được biển số lệch một lần thay/thêm/bớt)
+            merge_threshold: Số thay đổi (delta + tombstone) tối đa trước khi dựng lại mảng chính
+        """
+        self.max_distance = max_distance
+        self.merge_threshold = merge_threshold
+
+        # Mảng chính: biển số đã sắp xếp (bytes, id = vị trí) và biến thể (hash << 32 | id) đã sắp xếp
+        self._plates = np.array([], dtype='S1')
+        self._variants = np.array([], dtype=np.uint64)
+        # Thay đổi sau lần dựng gần nhất: biển số thêm mới (hash biến thể -> biển số) và biển số đã bỏ
+        self._delta = set()
+        self._delta_variants = {}
+        self._tombstones = set()
+
+        self._lock = threading.Lock()
+        self._stats = {
+            'lookups_total': 0,
+            'lookup_seconds_total': 0.0,
+            'builds_total': 0,
+            'last_build_seconds': None
+        }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._plates) - len(self._tombstones) + len(self._delta)
+
+    def build(self, plates):
+        """Dựng lại toàn bộ index từ danh sách biển số (thay hết dữ liệu cũ)"""
+        start_time = time.perf_counter()
+        plates = sorted({plate for plate in map(normalize_plate, plates) if 0 < len(plate) <= MAX_PLATE_LENGTH})
+        if plates:
+            matrix, lengths = _encode(plates, max(len(plate) for plate in plates))
+            hashes, rows = _variant_hashes(matrix, lengths, self.max_distance)
+            # Sắp xếp theo hash (id trong 32 bit thấp), bỏ biến thể trùng của cùng biển số (vd. xoá một trong hai ký tự giống nhau)
+            variants = np.unique((hashes.astype(np.uint64) << np.uint64(32)) | rows.astype(np.uint64))
+            encoded = matrix.view(f'S{matrix.shape[1]}').ravel()
+        else:
+            variants = np.array([], dtype=np.uint64)
+            encoded = np.array([], dtype='S1')
+
+        with self._lock:
+            self._plates = encoded
+            self._variants = variants
+            self._delta = set()
+            self._delta_variants = {}
+            self._tombstones = set()
+            self._stats['builds_total'] += 1
+            self._stats['last_build_seconds'] = round(time.perf_counter() - start_time, 3)
+
+    def update(self, added=(), removed=()):
+        """Thêm/bỏ một số biển số (đồng bộ dần), gộp vào mảng chính khi delta đủ lớn. Chỉ một thread ghi"""
+        with self._lock:
+            for plate in filter(None, map(normalize_plate, removed)):
+                if plate in self._delta:
+                    self._delta.discard(plate)
+                    for variant in self._hashes(plate):
+                        self._delta_variants.get(variant, set()).discard(plate)
+                elif self._in_base(plate):
+                    self._tombstones.add(plate)
+
+            for plate in map(normalize_plate, added):
+                if not 0 < len(plate) <= MAX_PLATE_LENGTH:
+                    continue
+                if self._in_base(plate):
+                    self._tombstones.discard(plate)
+                elif plate not in self._delta:
+                    self._delta.add(plate)
+                    for variant in self._hashes(plate):
+                        self._delta_variants.setdefault(variant, set()).add(plate)
+
+            needs_merge = len(self._delta) + len(self._tombstones) > self.merge_threshold
+            plates = self._all_plates() if needs_merge else None
+
+        if needs_merge:
+            self.build(plates)
+
+    def contains(self, plate) -> bool:
+        plate = normalize_plate(plate)
+        with self._lock:
+            return plate in self._delta or (self._in_base(plate) and plate not in self._tombstones)
+
+    def search(self, text, max_cost=0.5):
+        """
+        Biển số đã đăng ký gần text (khoảng cách có trọng số <= max_cost)
+
+        Returns:
+            list: (chi phí, biển số) tăng dần theo chi phí, [(0.0, text)] nếu text đã đăng ký
+        """
+        start_time = time.perf_counter()
+        text = normalize_plate(text)
+        if not text or len(text) > MAX_PLATE_LENGTH:
+            return []
+
+        with self._lock:
+            plates, variants = self._plates, self._variants
+            tombstones = self._tombstones
+            exact = text in self._delta or (self._in_base(text) and text not in tombstones)
+            query = self._hashes(text)
+            candidates = set()
+            if not exact:
+                for variant in query:
+                    candidates.update(self._delta_variants.get(variant, ()))
+                tombstones = set(tombstones)
+
+        if exact:
+            matches = [(0.0, text)]
+        else:
+            keys = np.array(sorted(query), dtype=np.uint64) << np.uint64(32)
+            starts = np.searchsorted(variants, keys, side='left')
+            ends = np.searchsorted(variants, keys | _ID_MASK, side='right')
+            ids = [variants[start:end] & _ID_MASK for start, end in zip(starts.tolist(), ends.tolist()) if end > start]
+            if ids:
+                for plate in plates[np.unique(np.concatenate(ids))].tolist():
+                    candidates.add(plate.decode('ascii'))
+            candidates -= tombstones
+
+            matches = []
+            for plate in candidates:
+                cost = weighted_distance(text, plate, max_cost)
+                if cost <= max_cost:
+                    matches.append((round(cost, 4), plate))
+            matches.sort()
+
+        with self._lock:
+            self._stats['lookups_total'] += 1
+            self._stats['lookup_seconds_total'] += time.perf_counter() - start_time
+        return matches
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'plates': len(self._plates) - len(self._tombstones) + len(self._delta),
+                'base_plates': len(self._plates),
+                'delta_plates': len(self._delta),
+                'tombstones': len(self._tombstones),
+                'variants': len(self._variants),
+                'memory_bytes': int(self._plates.nbytes + self._variants.nbytes)
+            })
+        lookups = stats.pop('lookup_seconds_total')
+        stats['avg_lookup_ms'] = round(lookups / stats['lookups_total'] * 1000, 4) if stats['lookups_total'] else None
+        stats['max_distance'] = self.max_distance
+        return stats
+
+    def _hashes(self, plate):
+        """Hash của plate và các biến thể xoá ký tự (không trùng)"""
+        variants = {plate}
+        for count in range(1, min(self.max_distance, len(plate)) + 1):
+            for positions in combinations(range(len(plate)), count):
+                variants.add(''.join(char for i, char in enumerate(plate) if i not in positions))
+        return {_hash_text(variant) for variant in variants}
+
+    def _in_base(self, plate) -> bool:
+        if not len(self._plates) or len(plate) > self._plates.dtype.itemsize:
+            return False
+        encoded = plate.encode('ascii')
+        position = int(np.searchsorted(self._plates, encoded))
+        return position < len(self._plates) and self._plates[position] == encoded
+
+    def _all_plates(self):
+        plates = [plate.decode('ascii') for plate in self._plates.tolist()]
+        return [plate for plate in plates if plate not in self._tombstones] + list(self._delta)
+
+class PlateIndexSync:
+    def __init__(self, index, fetch_page, interval=60, full_sync_interval=3600, retry_delay=10):
+        """
+        Đồng bộ index với danh sách xe của server chính ở thread nền
+
+        Args:
+            index: PlateIndex cần cập nhật
+            fetch_page: Hàm fetch_page(cursor) -> {'data': [{'licensePlate', 'isActive'}], 'cursor', 'hasMore'},
+                cursor None = từ đầu; raise khi không lấy được
+            interval: Chu kỳ lấy thay đổi mới (giây)
+            full_sync_interval: Chu kỳ tải lại toàn bộ (xe bị xoá hẳn không có trong thay đổi)
+            retry_delay: Thời gian chờ sau khi đồng bộ lỗi (giây)
+        """
+        self.index = index
+        self.fetch_page = fetch_page
+        self.interval = interval
+        self.full_sync_interval = full_sync_interval
+        self.retry_delay = retry_delay
+
+        self._cursor = None
+        self._last_full_sync = None
+        self._ready = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats = {
+            'full_syncs_total': 0,
+            'incremental_syncs_total': 0,
+            'changes_total': 0,
+            'failures_total': 0,
+            'last_sync': None,
+            'last_error': None
+        }
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._sync_loop, name="plate-index-sync", daemon=True)
+        self._thread.start()
+        logger.info(f"✅ Plate index sync started (interval: {self.interval}s)")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def is_ready(self) -> bool:
+        """Đã tải xong danh sách đầy đủ ít nhất một lần"""
+        return self._ready.is_set()
+
+    def sync_now(self):
+        """Tải lại toàn bộ (lần đầu hoặc đến hạn), ngược lại chỉ lấy thay đổi sau cursor"""
+        if self._cursor is None or time.monotonic() - self._last_full_sync >= self.full_sync_interval:
+            self._full_sync()
+        else:
+            self._incremental_sync()
+        self._stats['last_sync'] = time.time()
+        self._stats['last_error'] = None
+
+    def get_stats(self) -> dict:
+        stats = dict(self._stats)
+        stats.update({
+            'ready': self.is_ready(),
+            'cursor': self._cursor,
+            'last_sync_age_seconds': round(time.time() - stats['last_sync'], 1) if stats['last_sync'] else None,
+            'interval': self.interval
+        })
+        return stats
+
+    def _pages(self, cursor):
+        while True:
+            page = self.fetch_page(cursor)
+            cursor = page.get('cursor') or cursor
+            yield page.get('data', []), cursor
+            if not page.get('hasMore'):
+                return
+
+    def _full_sync(self):
+        start_time = time.perf_counter()
+        plates, cursor = [], None
+        for vehicles, cursor in self._pages(None):
+            plates.extend(vehicle['licensePlate'] for vehicle in vehicles if vehicle.get('isActive', True))
+        self.index.build(plates)
+        self._cursor = cursor
+        self._last_full_sync = time.monotonic()
+        self._stats['full_syncs_total'] += 1
+        self._ready.set()
+        logger.info(f"🗂️ Plate index loaded: {len(self.index)} registered plates in {time.perf_counter() - start_time:.2f}s")
+
+    def _incremental_sync(self):
+        for vehicles, cursor in self._pages(self._cursor):
+            if vehicles:
+                self.index.update(
+                    added=[vehicle['licensePlate'] for vehicle in vehicles if vehicle.get('isActive', True)],
+                    removed=[vehicle['licensePlate'] for vehicle in vehicles if not vehicle.get('isActive', True)]
+                )
+                self._stats['changes_total'] += len(vehicles)
+            self._cursor = cursor
+        self._stats['incremental_syncs_total'] += 1
+
+    def _sync_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.sync_now()
+                delay = self.interval
+            except Exception as e:
+                self._stats['failures_total'] += 1
+                self._stats['last_error'] = str(e)
+                logger.warning(f"⚠️ Plate index sync failed: {e}")
+                delay = self.retry_delay
+            self._stop_event.wait(delay)
+
+def _random_plate(rng):
+    digits, letters = '0123456789', 'ABCDEFGHKLMNPSTUVXYZ'
+    return f"{rng.randint(11, 99)}{rng.choice(letters)}{''.join(rng.choice(digits) for _ in range(rng.choice([4, 5])))}"
+
+def _misread(rng, plate):
+    """Đọc sai một ký tự theo một cặp nhầm lẫn có trong plate (không có thì giữ nguyên)"""
+    positions = [i for i, char in enumerate(plate) if any(pair[0] == char for pair in _SUBSTITUTION_COSTS)]
+    if not positions:
+        return plate
+    position = rng.choice(positions)
+    replacement = rng.choice([pair[1] for pair in _SUBSTITUTION_COSTS if pair[0] == plate[position]])
+    return plate[:position] + replacement + plate[position + 1:]
+
+def benchmark_plate_index(count=300000, queries=5000, max_cost=0.5, seed=42):
+    """Thời gian dựng, bộ nhớ, thời gian tra cứu và tỉ lệ sửa đúng, so với duyệt toàn bộ danh sách"""
+    print("🧪 Benchmarking plate index...")
+    rng = random.Random(seed)
+    registered = sorted({_random_plate(rng) for _ in range(count)})
+    index = PlateIndex()
+    index.build(registered)
+    stats = index.get_stats()
+    print(f"📊 {stats['plates']} plates: built in {stats['last_build_seconds']:.2f}s, "
+          f"{stats['variants']} variants, {stats['memory_bytes'] / 1024 / 1024:.1f}MB")
+
+    samples = []
+    for _ in range(queries):
+        plate = rng.choice(registered)
+        samples.append(('misread', plate, _misread(rng, plate)))
+        samples.append(('unregistered', None, _random_plate(rng)))
+
+    outcomes = {}
+    start_time = time.perf_counter()
+    for kind, plate, text in samples:
+        matches = index.search(text, max_cost)
+        unique = matches and (len(matches) == 1 or matches[1][0] > matches[0][0])
+        if kind == 'misread':
+            result = 'corrected' if unique and matches[0][1] == plate else 'ambiguous' if matches else 'missed'
+        else:
+            result = 'exact' if matches and matches[0][0] == 0 else 'snapped' if matches else 'no_match'
+        outcomes[f"{kind}:{result}"] = outcomes.get(f"{kind}:{result}", 0) + 1
+    index_time = (time.perf_counter() - start_time) / len(samples)
+
+    # Duyệt toàn bộ danh sách trên vài truy vấn (cùng kết quả, chậm hơn nhiều)
+    linear_samples = samples[:20]
+    start_time = time.perf_counter()
+    for _, _, text in linear_samples:
+        linear = sorted((cost, plate) for plate in registered
+                        for cost in [weighted_distance(text, plate, max_cost)] if cost <= max_cost)
+        assert [plate for _, plate in linear] == [plate for _, plate in index.search(text, max_cost)]
+    linear_time = (time.perf_counter() - start_time) / len(linear_samples)
+
+    print(f"   Index lookup: {index_time * 1000:.3f}ms/query, linear scan: {linear_time * 1000:.0f}ms/query")
+    print(f"   Outcomes: {dict(sorted(outcomes.items()))}")
+
+if __name__ == "__main__":
+    benchmark_plate_index()
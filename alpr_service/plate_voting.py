@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Plate Voting - Bỏ phiếu biển số trên nhiều ảnh của cùng một lượt xe
+Mỗi ký tự được bỏ phiếu theo vị trí, trọng số là confidence của OCR
+Kết quả ghép từ nhiều ảnh phải là biển số hợp lệ, không thì dùng biển số hợp lệ tốt nhất của một ảnh
+"""
+
+import logging
+
+from plate_validator import PlateValidator
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class PlateVoter:
+    def __init__(self, threshold=0.9, validator=None):
+        """
+        Khởi tạo plate voter
+
+        Args:
+            threshold: Độ tin cậy của kết quả bỏ phiếu để dừng sớm
+            validator: PlateValidator kiểm tra kết quả bỏ phiếu (mặc định khuôn mẫu/mã tỉnh Việt Nam)
+        """
+        self.threshold = threshold
+        self.validator = validator or PlateValidator()
+        self.frames_seen = 0
+
+        # Mỗi quan sát: (normalized_text, confidence, frame_index)
+        self._observations = []
+        self._consensus = None
+
+    def add(self, ocr_result: dict, frame_index: int):
+        """
+        Thêm kết quả process_image của một ảnh (chỉ dùng biển số có confidence cao nhất)
+        """
+        self.frames_seen += 1
+
+        # Kết quả dùng lại từ cache không phải một lần nhận diện mới, không tính là phiếu độc lập
+        if ocr_result.get('cache_hit'):
+            return
+
+        plates = ocr_result.get('license_plates', [])
+        if not plates:
+            return
+
+        best_plate = max(plates, key=lambda plate: plate.get('confidence', 0))
+        text = best_plate.get('normalized_text', '')
+        if text:
+            self._observations.append((text, float(best_plate.get('confidence', 0)), frame_index))
+            self._consensus = None
+
+    def is_confident(self) -> bool:
+        consensus = self.consensus()
+        return consensus is not None and consensus['confidence'] >= self.threshold
+
+    def consensus(self):
+        """
+        Kết quả bỏ phiếu hiện tại
+
+        Returns:
+            dict: text, confidence, votes, frame_index (ảnh khớp tốt nhất), voted (False = lấy nguyên kết quả
+                một ảnh vì chuỗi ghép không hợp lệ); None nếu chưa có biển số hợp lệ nào
+        """
+        if not self._observations:
+            return None
+        if self._consensus is not None:
+            return self._consensus
+
+        # Bỏ phiếu độ dài biển số trước, chỉ so ký tự giữa các quan sát cùng độ dài
+        length_weights = {}
+        for text, confidence, _ in self._observations:
+            length_weights[len(text)] = length_weights.get(len(text), 0) + confidence
+        length = max(length_weights, key=length_weights.get)
+        same_length = [obs for obs in self._observations if len(obs[0]) == length]
+        other_weight = sum(confidence for text, confidence, _ in self._observations if len(text) != length)
+
+        characters = []
+        position_confidences = []
+        for position in range(length):
+            weights = {}
+            for text, confidence, _ in same_length:
+                weights[text[position]] = weights.get(text[position], 0) + confidence
+            winner = max(weights, key=weights.get)
+
+            # Độ đồng thuận (phần trọng số ủng hộ) nhân với xác suất ít nhất một quan sát ủng hộ là đúng
+            support = weights[winner]
+            against = sum(weights.values()) - support + other_weight
+            miss_probability = 1.0
+            for text, confidence, _ in same_length:
+                if text[position] == winner:
+                    miss_probability *= max(0.0, 1.0 - confidence)
+
+            characters.append(winner)
+            position_confidences.append(support / (support + against) * (1.0 - miss_probability))
+
+        # Chuỗi ghép từ nhiều ảnh có thể không ảnh nào đọc ra, phải qua kiểm tra như kết quả OCR thường
+        text = self.validator.parse(''.join(characters))
+        if text is None:
+            return self._best_single()
+
+        matching = [obs for obs in self._observations if obs[0] == text]
+        best_frame = max(matching or same_length, key=lambda obs: obs[1])[2]
+
+        self._consensus = {
+            'text': text,
+            'confidence': round(min(position_confidences), 4),
+            'votes': len(matching),
+            'observations': len(self._observations),
+            'frame_index': best_frame,
+            'voted': True
+        }
+        return self._consensus
+
+    def _best_single(self):
+        """Biển số hợp lệ có tổng trọng số lớn nhất trong các quan sát (cả chuỗi, không ghép ký tự)"""
+        weights = {}
+        for text, confidence, _ in self._observations:
+            parsed = self.validator.parse(text)
+            if parsed is not None:
+                weights[parsed] = weights.get(parsed, 0) + confidence
+        if not weights:
+            return None
+
+        text = max(weights, key=weights.get)
+        matching = [obs for obs in self._observations if self.validator.parse(obs[0]) == text]
+        miss_probability = 1.0
+        for _, confidence, _ in matching:
+            miss_probability *= max(0.0, 1.0 - confidence)
+        total = sum(confidence for _, confidence, _ in self._observations)
+
+        self._consensus = {
+            'text': text,
+            'confidence': round(weights[text] / total * (1.0 - miss_probability), 4),
+            'votes': len(matching),
+            'observations': len(self._observations),
+            'frame_index': max(matching, key=lambda obs: obs[1])[2],
+            'voted': False
+        }
+        return self._consensus
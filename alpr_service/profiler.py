@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Profiler - Lấy mẫu stack của các thread trong process đang chạy (không cần restart service)
+Kết quả dạng collapsed stack (flamegraph.pl, speedscope), kèm bộ đo thời gian từng bước của một request
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def sample_stacks(seconds, interval=0.005, prefix=None):
+    """
+    Lấy mẫu stack của mọi thread (trừ thread đang gọi) trong khoảng thời gian cho trước
+
+    Args:
+        seconds: Thời gian lấy mẫu
+        interval: Khoảng cách giữa hai lần lấy mẫu (giây)
+        prefix: Thêm vào đầu mỗi stack (vd. tên worker process)
+
+    Returns:
+        dict: collapsed stack ("thread;hàm (file:dòng);...") -> số lần gặp
+    """
+    own_thread = threading.get_ident()
+    stacks = {}
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            names.append(thread_names.get(thread_id, f"thread-{thread_id}"))
+            if prefix:
+                names.append(prefix)
+
+            stack = ';'.join(reversed(names))
+            stacks[stack] = stacks.get(stack, 0) + 1
+        time.sleep(interval)
+
+    return stacks
+
+def merge_stacks(*stack_maps):
+    merged = {}
+    for stacks in stack_maps:
+        for stack, count in stacks.items():
+            merged[stack] = merged.get(stack, 0) + count
+    return merged
+
+def format_collapsed(stacks) -> str:
+    """Định dạng collapsed stack: mỗi dòng "stack số_lần", stack nhiều mẫu nhất trước"""
+    lines = [f"{stack} {count}" for stack, count in sorted(stacks.items(), key=lambda item: -item[1])]
+    return '\n'.join(lines) + '\n'
+
+class RequestTrace:
+    def __init__(self):
+        """Đo thời gian từng bước của một request (bước lặp lại, vd. nhiều ảnh trong burst, được cộng dồn)"""
+        self.started_at = time.perf_counter()
+        self.steps = {}
+
+    def add(self, step, seconds):
+        self.steps[step] = self.steps.get(step, 0.0) + max(0.0, seconds)
+
+    def to_dict(self) -> dict:
+        """Thời gian từng bước (ms), total là thời gian từ lúc bắt đầu request"""
+        steps = {step: round(seconds * 1000, 3) for step, seconds in self.steps.items()}
+        steps['total'] = round((time.perf_counter() - self.started_at) * 1000, 3)
+        return steps
+
+    def server_timing(self) -> str:
+        """Giá trị header Server-Timing"""
+        return ', '.join(f"{step};dur={duration}" for step, duration in self.to_dict().items())
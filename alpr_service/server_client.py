@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Smart Parking Server Client - HTTP client dùng chung cho mọi request gửi đến server chính
+Giữ kết nối keep-alive, timeout theo endpoint, retry có jitter và circuit breaker
+"""
+
+import time
+import random
+import logging
+import threading
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Circuit breaker đang mở, request bị từ chối ngay không gửi đi"""
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=10):
+        """
+        Khởi tạo circuit breaker
+
+        Args:
+            failure_threshold: Số lần lỗi liên tiếp để mở breaker
+            reset_timeout: Thời gian (giây) breaker mở trước khi cho một request thử lại
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self._stats = {'opened_total': 0, 'rejected_total': 0}
+
+    def allow_request(self) -> bool:
+        """Kiểm tra có được gửi request không"""
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+
+            if self._state == self.CLOSED:
+                return True
+
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                # Chỉ cho một request thử khi half-open
+                self._trial_in_flight = True
+                return True
+
+            self._stats['rejected_total'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("✅ Smart Parking Server reachable again, circuit closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"⚠️ Circuit opened after {self._failures} failures")
+                    self._stats['opened_total'] += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def get_state(self) -> dict:
+        with self._lock:
+            state = {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_timeout': self.reset_timeout
+            }
+            state.update(self._stats)
+            if self._state == self.OPEN:
+                state['retry_in'] = round(max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at)), 2)
+        return state
+
+class SmartParkingClient:
+    # Endpoint của server chính: (method, path)
+    ENDPOINTS = {
+        'health': ('GET', '/api/health'),
+        'parking_entry': ('POST', '/api/parking/entry'),
+        'parking_entry_batch': ('POST', '/api/parking/entry/batch'),
+        'entry_image': ('POST', '/api/parking/entry-image'),
+        'vehicle_detected': ('POST', '/api/iot/vehicle_detected'),
+        'barrier_control': ('POST', '/api/iot/barrier-control'),
+        'registered_plates': ('GET', '/api/iot/registered-plates')
+    }
+
+    # Timeout (connect, read) theo endpoint, tính bằng giây
+    DEFAULT_TIMEOUTS = {
+        'health': (1, 2),
+        'parking_entry': (2, 5),
+        'parking_entry_batch': (2, 30),
+        'entry_image': (2, 5),
+        'vehicle_detected': (1, 3),
+        'barrier_control': (1, 3),
+        'registered_plates': (2, 15)
+    }
+
+    def __init__(self, base_url, pool_size=10, max_retries=2, backoff_base=0.1,
+                 timeouts=None, failure_threshold=5, reset_timeout=10):
+        """
+        Khởi tạo client
+
+        Args:
+            base_url: URL server chính
+            pool_size: Số kết nối keep-alive tối đa giữ lại
+            max_retries: Số lần thử lại tối đa mỗi request
+            backoff_base: Thời gian chờ cơ bản giữa các lần thử (giây, có jitter)
+            timeouts: Ghi đè timeout theo endpoint
+            failure_threshold: Số lần lỗi liên tiếp để mở circuit breaker
+            reset_timeout: Thời gian breaker mở trước khi thử lại
+        """
+        self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.timeouts = dict(self.DEFAULT_TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._counters = {}
+
+    def get(self, endpoint, **kwargs) -> requests.Response:
+        return self.request(endpoint, **kwargs)
+
+    def post(self, endpoint, json=None, **kwargs) -> requests.Response:
+        return self.request(endpoint, json=json, **kwargs)
+
+    def request(self, endpoint, json=None, headers=None, params=None) -> requests.Response:
+        """
+        Gửi request đến một endpoint đã khai báo trong ENDPOINTS
+
+        Raises:
+            CircuitOpenError: Breaker đang mở, không gửi request
+            requests.exceptions.RequestException: Lỗi kết nối sau khi đã thử lại
+        """
+        method, path = self.ENDPOINTS[endpoint]
+        url = f"{self.base_url}{path}"
+        timeout = self.timeouts.get(endpoint, (2, 5))
+
+        if not self.breaker.allow_request():
+            self._count(endpoint, 'rejected')
+            raise CircuitOpenError(f"Circuit open, not calling {path}")
+
+        attempt = 0
+        while True:
+            start_time = time.monotonic()
+            try:
+                response = self.session.request(method, url, json=json, headers=headers, params=params, timeout=timeout)
+            except requests.exceptions.RequestException as e:
+                self._record(endpoint, start_time, 'error')
+                # POST chỉ thử lại khi chưa kết nối được (request chắc chắn chưa tới server)
+                retryable = method == 'GET' or isinstance(e, requests.exceptions.ConnectionError)
+                if retryable and attempt < self.max_retries:
+                    attempt += 1
+                    self._backoff(attempt)
+                    continue
+                self.breaker.record_failure()
+                raise
+
+            if response.status_code >= 500:
+                self._record(endpoint, start_time, 'server_error')
+                if method == 'GET' and attempt < self.max_retries:
+                    attempt += 1
+                    self._backoff(attempt)
+                    continue
+                self.breaker.record_failure()
+                return response
+
+            self._record(endpoint, start_time, 'ok')
+            self.breaker.record_success()
+            return response
+
+    def probe(self, endpoint='health'):
+        """
+        Gọi thử một endpoint, không qua retry và circuit breaker (dùng cho health prober)
+
+        Returns:
+            tuple: (thành công hay không, RTT tính bằng ms, lỗi nếu có)
+        """
+        method, path = self.ENDPOINTS[endpoint]
+        start_time = time.monotonic()
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeouts.get(endpoint, (1, 2)))
+            rtt_ms = (time.monotonic() - start_time) * 1000
+            if response.status_code == 200:
+                return True, rtt_ms, None
+            return False, rtt_ms, f"HTTP {response.status_code}"
+        except requests.exceptions.RequestException as e:
+            return False, (time.monotonic() - start_time) * 1000, str(e)
+
+    def get_stats(self) -> dict:
+        """Trạng thái breaker và thống kê latency theo endpoint (ms)"""
+        endpoints = {}
+        with self._lock:
+            for endpoint, samples in self._latencies.items():
+                values = sorted(samples)
+                endpoints[endpoint] = {
+                    'samples': len(values),
+                    'avg_ms': round(sum(values) / len(values), 2) if values else 0,
+                    'p50_ms': round(values[len(values) // 2], 2) if values else 0,
+                    'p95_ms': round(values[min(len(values) - 1, int(len(values) * 0.95))], 2) if values else 0,
+                    'max_ms': round(values[-1], 2) if values else 0
+                }
+            for endpoint, counters in self._counters.items():
+                endpoints.setdefault(endpoint, {}).update(counters)
+
+        return {
+            'base_url': self.base_url,
+            'circuit_breaker': self.breaker.get_state(),
+            'endpoints': endpoints
+        }
+
+    def _backoff(self, attempt):
+        time.sleep(self.backoff_base * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+
+    def _count(self, endpoint, outcome):
+        with self._lock:
+            counters = self._counters.setdefault(endpoint, {})
+            counters[outcome] = counters.get(outcome, 0) + 1
+
+    def _record(self, endpoint, start_time, outcome):
+        elapsed_ms = (time.monotonic() - start_time) * 1000
+        with self._lock:
+            self._latencies.setdefault(endpoint, deque(maxlen=500)).append(elapsed_ms)
+        self._count(endpoint, outcome)
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+Stream Ingest - Đọc liên tục camera (RTSP/MJPEG, hoặc file video khi test) của từng barrier
+Giữ ring buffer các frame gần nhất, chỉ đánh thức OCR khi có chuyển động trong ROI (frame differencing),
+kết quả tốt nhất gần đây sẵn sàng trước khi có sự kiện RFID
+Nhiều process (gunicorn worker) dùng chung: một process giữ khoá đọc camera, kết quả và frame mới nhất
+được ghi ra thư mục chung để process nào nhận /api/detect cũng trả lời giống nhau
+"""
+
+import os
+import json
+import time
+import fcntl
+import pickle
+import logging
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Ảnh dùng để phát hiện chuyển động: ROI thu nhỏ về chiều rộng này, xám, làm mờ
+MOTION_WIDTH = 160
+# Chênh lệch độ sáng (0-255) để một pixel được coi là thay đổi
+MOTION_PIXEL_THRESHOLD = 25
+# Tốc độ cập nhật nền (xe dừng lâu sẽ dần thành nền)
+BACKGROUND_ALPHA = 0.05
+# Khoảng cách tối thiểu giữa hai lần ghi frame mới nhất ra thư mục chung (giây)
+SHARED_FRAME_INTERVAL = 0.25
+SHARED_JPEG_QUALITY = 90
+
+def parse_stream_config(value):
+    """
+    Đọc cấu hình ALPR_STREAMS: JSON list, mỗi phần tử
+    {"parkingLotId": ..., "barrierId": ..., "source": "rtsp://...|http://...mjpg|file.mp4|0", "roi": [x, y, w, h]}
+    """
+    if not value:
+        return []
+    streams = json.loads(value)
+    for stream in streams:
+        for key in ('parkingLotId', 'barrierId', 'source'):
+            if key not in stream:
+                raise ValueError(f"Stream config is missing '{key}': {stream}")
+    return streams
+
+def _write_shared(path, value):
+    """Ghi file chung (ghi file tạm rồi rename, process khác không đọc phải file ghi dở)"""
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        pickle.dump(value, f)
+    os.replace(temporary, path)
+
+def _read_shared(path):
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+def _take_shared(path):
+    """Lấy và xoá file chung, rename là một bước nên chỉ một process lấy được"""
+    claimed = f"{path}.{os.getpid()}.{threading.get_ident()}.taken"
+    try:
+        os.rename(path, claimed)
+    except FileNotFoundError:
+        return None
+    try:
+        return _read_shared(claimed)
+    finally:
+        os.remove(claimed)
+
+def _encode_frame(frame) -> bytes:
+    _, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, SHARED_JPEG_QUALITY])
+    return encoded.tobytes()
+
+def _decode_frame(data: bytes):
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+class BarrierStream:
+    def __init__(self, parking_lot_id, barrier_id, source, submit, roi=None, buffer_size=16,
+                 motion_threshold=0.02, ocr_interval=0.5, settle_frames=5, reconnect_delay=2.0, loop=None,
+                 shared_dir=None):
+        """
+        Khởi tạo stream của một barrier
+
+        Args:
+            parking_lot_id: ID bãi xe
+            barrier_id: ID barrier
+            source: URL RTSP/MJPEG, đường dẫn file video hoặc số thứ tự camera
+            submit: Hàm submit(ảnh) -> Future kết quả OCR, None nếu OCR chưa sẵn sàng
+            roi: Vùng xe dừng trước barrier (x, y, w, h), None = cả frame
+            buffer_size: Số frame gần nhất giữ trong ring buffer
+            motion_threshold: Tỉ lệ pixel thay đổi trong ROI để coi là có xe
+            ocr_interval: Khoảng cách tối thiểu giữa hai lần OCR khi xe đang di chuyển (giây)
+            settle_frames: Số frame không còn chuyển động để coi là xe đã dừng (OCR thêm một lần)
+            reconnect_delay: Thời gian chờ trước khi mở lại stream bị mất (giây)
+            loop: Phát lại file video từ đầu khi hết (mặc định bật với file)
+            shared_dir: Thư mục chung giữa các process (None = kết quả chỉ nằm trong process này)
+        """
+        self.parking_lot_id = parking_lot_id
+        self.barrier_id = barrier_id
+        self.source = int(source) if str(source).isdigit() else source
+        self.submit = submit
+        self.roi = tuple(int(v) for v in roi) if roi else None
+        self.motion_threshold = motion_threshold
+        self.ocr_interval = ocr_interval
+        self.settle_frames = settle_frames
+        self.reconnect_delay = reconnect_delay
+        self.is_file = isinstance(self.source, str) and os.path.isfile(self.source)
+        self.loop = self.is_file if loop is None else loop
+
+        self._frames = deque(maxlen=max(1, int(buffer_size)))
+        self._background = None
+        self._in_motion = False
+        self._still_frames = 0
+        self._last_ocr_at = 0.0
+        self._pending = None
+        self._best = None  # (timestamp, frame, ocr_result)
+        self._shared_prefix = os.path.join(shared_dir, f"{parking_lot_id}__{barrier_id}") if shared_dir else None
+        self._last_shared_at = 0.0
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats = {
+            'frames_total': 0,
+            'motion_events_total': 0,
+            'ocr_runs_total': 0,
+            'plates_found_total': 0,
+            'reconnects_total': 0,
+            'last_motion_ratio': 0.0
+        }
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"stream-{self.parking_lot_id}-{self.barrier_id}",
+            daemon=True
+        )
+        self._thread.start()
+        logger.info(f"📹 Stream started for {self.parking_lot_id}/{self.barrier_id}: {self.source}")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def latest_frame(self):
+        """Frame mới nhất trong ring buffer: (timestamp, frame) hoặc None"""
+        if self._shared_prefix and self._thread is None:
+            # Process khác đọc camera: dùng frame mới nhất process đó ghi ra
+            shared = _read_shared(self._shared_prefix + '.latest')
+            return (shared[0], _decode_frame(shared[1])) if shared else None
+        with self._lock:
+            return self._frames[-1] if self._frames else None
+
+    def take(self, max_age):
+        """
+        Lấy và bỏ kết quả OCR có biển số tin cậy nhất trong max_age giây gần nhất
+        (một lượt xe chỉ dùng một lần, hai request cùng lúc không lấy trùng)
+
+        Returns:
+            tuple: (timestamp, frame, ocr_result theo toạ độ ROI) hoặc None
+        """
+        if self._shared_prefix:
+            # Process đọc camera ghi kết quả ra file chung, process nào lấy trước thì được
+            shared = _take_shared(self._shared_prefix + '.best')
+            best = (shared[0], _decode_frame(shared[1]), shared[2]) if shared else None
+            with self._lock:
+                self._best = None
+        else:
+            with self._lock:
+                best, self._best = self._best, None
+        if best is None or time.time() - best[0] > max_age:
+            return None
+        return best
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            best = self._best
+            latest = self._frames[-1][0] if self._frames else None
+            buffered = len(self._frames)
+        stats.update({
+            'source': str(self.source),
+            'roi': list(self.roi) if self.roi else None,
+            'buffered_frames': buffered,
+            'in_motion': self._in_motion,
+            'last_frame_age': round(time.time() - latest, 2) if latest else None,
+            'reading': self._thread is not None,
+            'best_plate': best[2]['license_plates'][0]['normalized_text'] if best else None
+        })
+        return stats
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            capture = cv2.VideoCapture(self.source)
+            if not capture.isOpened():
+                logger.warning(f"⚠️ Cannot open stream {self.source}, retrying in {self.reconnect_delay}s")
+                capture.release()
+                with self._lock:
+                    self._stats['reconnects_total'] += 1
+                self._stop_event.wait(self.reconnect_delay)
+                continue
+
+            # File video: phát theo FPS gốc để giống camera thật
+            fps = capture.get(cv2.CAP_PROP_FPS) if self.is_file else 0
+            frame_interval = 1.0 / fps if fps and fps > 0 else 0.0
+            self._read_frames(capture, frame_interval)
+            capture.release()
+
+            if not self._stop_event.is_set():
+                with self._lock:
+                    self._stats['reconnects_total'] += 1
+                self._stop_event.wait(self.reconnect_delay)
+
+    def _read_frames(self, capture, frame_interval):
+        next_frame_at = time.monotonic()
+        rewound = False
+        while not self._stop_event.is_set():
+            ok, frame = capture.read()
+            if not ok:
+                # Hết file: quay lại đầu (file rỗng/lỗi thì thoát để mở lại sau reconnect_delay)
+                if self.loop and not rewound and capture.set(cv2.CAP_PROP_POS_FRAMES, 0):
+                    rewound = True
+                    continue
+                return
+            rewound = False
+
+            self._on_frame(frame, time.time())
+
+            if frame_interval:
+                next_frame_at += frame_interval
+                delay = next_frame_at - time.monotonic()
+                if delay > 0:
+                    self._stop_event.wait(delay)
+                else:
+                    next_frame_at = time.monotonic()
+
+    def crop_roi(self, frame):
+        """Vùng ROI của frame (toạ độ kết quả OCR trên vùng này lệch roi[:2] so với frame)"""
+        if not self.roi:
+            return frame
+        x, y, w, h = self.roi
+        return frame[y:y + h, x:x + w]
+
+    def _motion_ratio(self, frame) -> float:
+        """Tỉ lệ pixel trong ROI khác nền (nền cập nhật dần theo thời gian)"""
+        region = self.crop_roi(frame)
+        height, width = region.shape[:2]
+        if not height or not width:
+            return 0.0
+
+        small = cv2.resize(region, (MOTION_WIDTH, max(1, int(height * MOTION_WIDTH / float(width)))),
+                           interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray.astype(np.float32)
+            return 0.0
+
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self._background))
+        cv2.accumulateWeighted(gray, self._background, BACKGROUND_ALPHA)
+        return np.count_nonzero(diff > MOTION_PIXEL_THRESHOLD) / float(diff.size)
+
+    def _on_frame(self, frame, timestamp):
+        with self._lock:
+            self._frames.append((timestamp, frame))
+            self._stats['frames_total'] += 1
+
+        if self._shared_prefix and timestamp - self._last_shared_at >= SHARED_FRAME_INTERVAL:
+            self._last_shared_at = timestamp
+            _write_shared(self._shared_prefix + '.latest', (timestamp, _encode_frame(frame)))
+
+        ratio = self._motion_ratio(frame)
+        with self._lock:
+            self._stats['last_motion_ratio'] = round(ratio, 4)
+
+        if ratio >= self.motion_threshold:
+            if not self._in_motion:
+                self._in_motion = True
+                with self._lock:
+                    self._stats['motion_events_total'] += 1
+                logger.info(f"🚗 Motion at {self.parking_lot_id}/{self.barrier_id} ({ratio:.1%} of ROI)")
+            self._still_frames = 0
+            if timestamp - self._last_ocr_at >= self.ocr_interval:
+                self._run_ocr(frame, timestamp)
+        elif self._in_motion:
+            self._still_frames += 1
+            if self._still_frames >= self.settle_frames:
+                # Xe đã dừng trước barrier: frame lúc này thường nét nhất
+                self._in_motion = False
+                self._run_ocr(frame, timestamp, force=True)
+
+    def _run_ocr(self, frame, timestamp, force=False):
+        """Gửi ROI cho OCR không chặn thread đọc frame, mỗi lúc chỉ một frame đang chờ kết quả"""
+        if self._pending is not None and not self._pending.done() and not force:
+            return
+
+        future = self.submit(self.crop_roi(frame))
+        if future is None:
+            return
+
+        self._last_ocr_at = timestamp
+        self._pending = future
+        with self._lock:
+            self._stats['ocr_runs_total'] += 1
+        future.add_done_callback(lambda done: self._on_result(done, timestamp, frame))
+
+    def _on_result(self, future, timestamp, frame):
+        try:
+            ocr_result = future.result()
+        except Exception as e:
+            logger.error(f"❌ Stream OCR failed for {self.parking_lot_id}/{self.barrier_id}: {e}")
+            return
+        if not ocr_result.get('success') or not ocr_result.get('license_plates'):
+            return
+
+        confidence = ocr_result['license_plates'][0]['confidence']
+        with self._lock:
+            self._stats['plates_found_total'] += 1
+            # Giữ kết quả tin cậy nhất, kết quả cũ hơn ocr_interval * 20 thì thay luôn (lượt xe khác)
+            best = self._best
+            if best is not None and self._shared_prefix and not os.path.exists(self._shared_prefix + '.best'):
+                # Process khác đã lấy kết quả này
+                best = None
+            if (best is None or confidence >= best[2]['license_plates'][0]['confidence']
+                    or timestamp - best[0] > self.ocr_interval * 20):
+                self._best = (timestamp, frame, ocr_result)
+                if self._shared_prefix:
+                    _write_shared(self._shared_prefix + '.best', (timestamp, _encode_frame(frame), ocr_result))
+
+class StreamManager:
+    def __init__(self, submit, buffer_size=16, motion_threshold=0.02, ocr_interval=0.5, settle_frames=5,
+                 shared_dir=None, ownership_poll=5.0):
+        """
+        Quản lý stream của các barrier
+
+        Args:
+            submit: Hàm submit(ảnh) -> Future kết quả OCR (qua inference scheduler)
+            buffer_size, motion_threshold, ocr_interval, settle_frames: Mặc định cho mọi stream (xem BarrierStream)
+            shared_dir: Thư mục chung giữa các process: chỉ process giữ khoá (flock) đọc camera,
+                process khác đọc kết quả từ thư mục này (None = process này luôn đọc camera)
+            ownership_poll: Chu kỳ thử lấy khoá của process không đọc camera (giây)
+        """
+        self.submit = submit
+        self.defaults = {
+            'buffer_size': buffer_size,
+            'motion_threshold': motion_threshold,
+            'ocr_interval': ocr_interval,
+            'settle_frames': settle_frames
+        }
+        self.streams = {}
+        self.shared_dir = shared_dir
+        self.ownership_poll = ownership_poll
+        self._owner_lock_fd = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+
+    def add(self, config: dict):
+        """Thêm stream theo một phần tử của ALPR_STREAMS (có thể ghi đè các tham số mặc định)"""
+        options = dict(self.defaults)
+        for key in ('buffer_size', 'motion_threshold', 'ocr_interval', 'settle_frames'):
+            if key in config:
+                options[key] = config[key]
+        stream = BarrierStream(
+            config['parkingLotId'],
+            config['barrierId'],
+            config['source'],
+            self.submit,
+            roi=config.get('roi'),
+            shared_dir=self.shared_dir,
+            **options
+        )
+        self.streams[(stream.parking_lot_id, stream.barrier_id)] = stream
+        return stream
+
+    def get(self, parking_lot_id, barrier_id):
+        return self.streams.get((parking_lot_id, barrier_id))
+
+    def start(self):
+        if not self.shared_dir:
+            for stream in self.streams.values():
+                stream.start()
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._ownership_loop, name="stream-ownership", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        for stream in self.streams.values():
+            stream.stop()
+        if self._owner_lock_fd is not None:
+            os.close(self._owner_lock_fd)
+            self._owner_lock_fd = None
+
+    def _acquire_ownership(self) -> bool:
+        """Chỉ một process đọc camera (flock, tự nhả khi process chết), các process khác đọc kết quả chung"""
+        fd = os.open(os.path.join(self.shared_dir, 'streams.lock'), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._owner_lock_fd = fd
+        return True
+
+    def _ownership_loop(self):
+        # Process đang đọc camera chết (vd. gunicorn thay worker) thì process khác lấy khoá và đọc tiếp
+        while not self._stop_event.is_set():
+            if self._acquire_ownership():
+                logger.info(f"📹 Process {os.getpid()} owns the camera streams")
+                for stream in self.streams.values():
+                    stream.start()
+                return
+            self._stop_event.wait(self.ownership_poll)
+
+    def get_stats(self) -> dict:
+        return {f"{lot}/{barrier}": stream.get_stats() for (lot, barrier), stream in self.streams.items()}
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Synthetic Plates - Sinh bộ ảnh biển số giả lập có thể tái lập (theo seed) để benchmark
+Nhiều font, biển 1 dòng (ô tô) và 2 dòng (xe máy/biển vuông), blur, nhiễu, phối cảnh, ảnh ban đêm
+"""
+
+import cv2
+import logging
+
+import numpy as np
+
+from plate_validator import PROVINCE_CODES
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FONTS = {
+    'simplex': cv2.FONT_HERSHEY_SIMPLEX,
+    'duplex': cv2.FONT_HERSHEY_DUPLEX,
+    'complex': cv2.FONT_HERSHEY_COMPLEX,
+    'triplex': cv2.FONT_HERSHEY_TRIPLEX
+}
+
+LAYOUTS = ('one_line', 'two_line')
+
+CONDITIONS = ('clean', 'blur', 'noise', 'perspective', 'night')
+
+# Chữ cái dùng cho seri biển số Việt Nam
+SERIES_LETTERS = 'ABCDEFGHKLMNPSTUVXYZ'
+
+def random_plate(rng, layout):
+    """
+    Sinh một biển số ngẫu nhiên
+
+    Returns:
+        tuple: (các dòng hiển thị trên biển, biển số đã chuẩn hoá)
+    """
+    province = rng.choice(sorted(PROVINCE_CODES))
+    letter = rng.choice(list(SERIES_LETTERS))
+    digits = ''.join(str(d) for d in rng.randint(0, 10, size=5))
+
+    if layout == 'one_line':
+        # 51A-123.45
+        return [f"{province}{letter}-{digits[:3]}.{digits[3:]}"], f"{province}{letter}{digits}"
+
+    # 59-X1 / 123.45
+    series_digit = str(rng.randint(1, 10))
+    return [f"{province}-{letter}{series_digit}", f"{digits[:3]}.{digits[3:]}"], f"{province}{letter}{series_digit}{digits}"
+
+def render_plate(lines, font, plate_height=110):
+    """Vẽ biển số trắng viền đen, trả về ảnh BGR của riêng biển số"""
+    thickness = 3
+    font_scale = 1.0
+    sizes = [cv2.getTextSize(line, font, font_scale, thickness)[0] for line in lines]
+    line_height = max(height for _, height in sizes)
+
+    # Chọn font_scale để chữ chiếm khoảng 60% chiều cao mỗi dòng
+    target_line_height = plate_height * 0.6 / len(lines)
+    font_scale = target_line_height / float(line_height)
+    sizes = [cv2.getTextSize(line, font, font_scale, thickness)[0] for line in lines]
+
+    padding = int(plate_height * 0.15)
+    width = max(w for w, _ in sizes) + 2 * padding
+    plate = np.full((plate_height, width, 3), 245, np.uint8)
+    cv2.rectangle(plate, (2, 2), (width - 3, plate_height - 3), (20, 20, 20), 3)
+
+    slot = plate_height / float(len(lines))
+    for index, (line, (text_width, text_height)) in enumerate(zip(lines, sizes)):
+        x = (width - text_width) // 2
+        y = int(slot * index + (slot + text_height) / 2)
+        cv2.putText(plate, line, (x, y), font, font_scale, (10, 10, 10), thickness, cv2.LINE_AA)
+    return plate
+
+def apply_condition(image, condition, rng):
+    """Áp dụng điều kiện chụp lên ảnh toàn cảnh"""
+    if condition == 'blur':
+        kernel = int(rng.choice([3, 5, 7]))
+        return cv2.GaussianBlur(image, (kernel, kernel), 0)
+
+    if condition == 'noise':
+        noise = rng.normal(0, 18, image.shape)
+        return np.clip(image.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+
+    if condition == 'perspective':
+        height, width = image.shape[:2]
+        shift = 0.08
+        source = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+        jitter = rng.uniform(-shift, shift, size=(4, 2)) * (width, height)
+        matrix = cv2.getPerspectiveTransform(source, (source + jitter).astype(np.float32))
+        return cv2.warpPerspective(image, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE)
+
+    if condition == 'night':
+        # Tối và nhiễu như ảnh ban đêm, biển số vẫn được đèn chiếu sáng một phần
+        gamma = rng.uniform(2.2, 3.0)
+        table = (np.linspace(0, 1, 256) ** gamma * 255).astype(np.uint8)
+        dark = cv2.LUT(image, table)
+        noise = rng.normal(0, 6, image.shape)
+        return np.clip(dark.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+
+    return image
+
+def generate_sample(rng, layout, font_name, condition, frame_size=(1280, 720)):
+    """
+    Sinh một ảnh toàn cảnh chứa biển số
+
+    Returns:
+        dict: image, expected (biển số chuẩn hoá), layout, font, condition,
+            plate_box (x, y, w, h của biển số trước khi áp dụng điều kiện chụp)
+    """
+    frame_width, frame_height = frame_size
+    lines, expected = random_plate(rng, layout)
+
+    # Biển số cao khoảng 8-14% ảnh (cùng giả định với plan_ocr_scale)
+    plate_height = int(frame_height * rng.uniform(0.08, 0.14)) * (2 if layout == 'two_line' else 1)
+    plate = render_plate(lines, FONTS[font_name], plate_height)
+    if plate.shape[1] > frame_width * 0.6:
+        ratio = frame_width * 0.6 / plate.shape[1]
+        plate = cv2.resize(plate, (int(plate.shape[1] * ratio), int(plate.shape[0] * ratio)), interpolation=cv2.INTER_AREA)
+
+    # Nền: gradient + vài khối màu như thân xe/đường
+    background = np.tile(np.linspace(60, 160, frame_width, dtype=np.uint8), (frame_height, 1))
+    frame = cv2.cvtColor(background, cv2.COLOR_GRAY2BGR)
+    for _ in range(4):
+        x0, y0 = int(rng.randint(0, frame_width)), int(rng.randint(0, frame_height))
+        color = tuple(int(c) for c in rng.randint(0, 255, size=3))
+        cv2.rectangle(frame, (x0, y0), (x0 + int(rng.randint(80, 400)), y0 + int(rng.randint(40, 200))), color, -1)
+
+    plate_h, plate_w = plate.shape[:2]
+    x = int(rng.randint(0, frame_width - plate_w))
+    y = int(rng.randint(frame_height // 3, frame_height - plate_h))
+    frame[y:y + plate_h, x:x + plate_w] = plate
+
+    return {
+        'image': apply_condition(frame, condition, rng),
+        'expected': expected,
+        'layout': layout,
+        'font': font_name,
+        'condition': condition,
+        'plate_box': (x, y, plate_w, plate_h)
+    }
+
+def generate_corpus(count, seed=0, frame_size=(1280, 720)):
+    """
+    Sinh bộ ảnh có thể tái lập: cùng count/seed/frame_size luôn cho cùng ảnh,
+    các tổ hợp layout x font x điều kiện được chia đều
+
+    Returns:
+        list: Danh sách sample (xem generate_sample)
+    """
+    rng = np.random.RandomState(seed)
+    font_names = sorted(FONTS)
+    samples = []
+    for index in range(count):
+        layout = LAYOUTS[index % len(LAYOUTS)]
+        font_name = font_names[(index // len(LAYOUTS)) % len(font_names)]
+        condition = CONDITIONS[(index // (len(LAYOUTS) * len(font_names))) % len(CONDITIONS)]
+        samples.append(generate_sample(rng, layout, font_name, condition, frame_size))
+    return samples
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else 'synthetic_plates'
+    os.makedirs(output_dir, exist_ok=True)
+    for index, sample in enumerate(generate_corpus(40)):
+        name = f"{index:03d}_{sample['layout']}_{sample['font']}_{sample['condition']}_{sample['expected']}.jpg"
+        cv2.imwrite(os.path.join(output_dir, name), sample['image'])
+    print(f"📸 Wrote 40 synthetic plates to {output_dir}")
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Upload Pipeline - Upload ảnh Cloudinary chạy nền, không chặn việc mở barrier
+Ảnh được ghi vào spool trên đĩa trước, worker upload có retry rồi báo kết quả về server
+"""
+
+import os
+import json
+import fcntl
+import time
+import random
+import queue
+import logging
+import threading
+from datetime import datetime
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class UploadPipeline:
+    def __init__(self, cloudinary_service, spool_dir, max_queue=100, max_retries=5,
+                 retry_base_delay=2.0, num_workers=2, rescan_interval=5, on_complete=None, report_window=600):
+        """
+        Khởi tạo upload pipeline
+
+        Args:
+            cloudinary_service: CloudinaryService dùng để upload
+            spool_dir: Thư mục lưu ảnh chờ upload (giữ lại qua restart)
+            max_queue: Số job tối đa trong hàng đợi bộ nhớ (job dư vẫn nằm trong spool)
+            max_retries: Số lần thử upload tối đa trước khi đánh dấu thất bại
+            retry_base_delay: Thời gian chờ cơ bản giữa các lần thử (tăng gấp đôi mỗi lần)
+            num_workers: Số thread upload
+            rescan_interval: Chu kỳ quét lại spool (giây)
+            on_complete: Hàm callback(job, status) báo kết quả về server, trả về True nếu báo thành công
+            report_window: Thời gian tối đa báo lại kết quả (giây, tính từ lần báo lỗi đầu tiên),
+                quá thì job được chuyển vào thư mục failed
+        """
+        self.cloudinary_service = cloudinary_service
+        self.spool_dir = spool_dir
+        self.failed_dir = os.path.join(spool_dir, 'failed')
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.num_workers = max(1, int(num_workers))
+        self.rescan_interval = rescan_interval
+        self.on_complete = on_complete
+        self.report_window = report_window
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._threads = []
+
+        self._stats = {
+            'enqueued_total': 0,
+            'uploaded_total': 0,
+            'failed_total': 0,
+            'retries_total': 0,
+            'queue_full_total': 0,
+            'report_failures_total': 0,
+            'report_given_up_total': 0
+        }
+
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+    def start(self):
+        """Khởi động worker upload và nạp lại các job còn trong spool"""
+        self._stop_event.clear()
+        for index in range(self.num_workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"upload-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        thread = threading.Thread(target=self._rescan_loop, name="upload-spool-rescan", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+        logger.info(f"✅ Upload pipeline started (spool: {self.spool_dir}, pending: {self._spooled_count()})")
+
+    def stop(self):
+        """Dừng worker (job chưa xong vẫn nằm trong spool)"""
+        self._stop_event.set()
+        for _ in range(self.num_workers):
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def enqueue(self, image_bytes, license_plate, parking_lot_id, image_type="entry", barrier_id=None):
+        """
+        Ghi ảnh vào spool và đưa vào hàng đợi upload
+
+        Returns:
+            dict: public_id và URL (trạng thái pending) để gửi ngay cho server
+        """
+        public_id = self.cloudinary_service.build_parking_public_id(
+            license_plate, parking_lot_id, image_type, datetime.now()
+        )
+        job = {
+            'job_id': public_id.replace('/', '__'),
+            'public_id': public_id,
+            'url': self.cloudinary_service.build_image_url(public_id),
+            'license_plate': license_plate,
+            'parking_lot_id': parking_lot_id,
+            'barrier_id': barrier_id,
+            'image_type': image_type,
+            'stage': 'upload',
+            'attempts': 0,
+            'next_attempt_at': 0,
+            'created_at': datetime.now().isoformat()
+        }
+
+        # Ghi ảnh trước rồi mới ghi metadata, metadata có nghĩa là job hợp lệ
+        image_path = self._image_path(job['job_id'])
+        with open(image_path + '.tmp', 'wb') as f:
+            f.write(image_bytes)
+        os.replace(image_path + '.tmp', image_path)
+        self._write_job(job)
+
+        with self._lock:
+            self._stats['enqueued_total'] += 1
+        self._offer(job['job_id'])
+
+        return {
+            'public_id': job['public_id'],
+            'url': job['url'],
+            'status': 'pending'
+        }
+
+    def get_stats(self) -> dict:
+        """Thống kê pipeline"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'queue_depth': self._queue.qsize(),
+            'spooled': self._spooled_count(),
+            'failed_spooled': len([n for n in os.listdir(self.failed_dir) if n.endswith('.json')])
+        })
+        return stats
+
+    def _image_path(self, job_id):
+        return os.path.join(self.spool_dir, f"{job_id}.jpg")
+
+    def _job_path(self, job_id):
+        return os.path.join(self.spool_dir, f"{job_id}.json")
+
+    def _lock_path(self, job_id):
+        return os.path.join(self.spool_dir, f"{job_id}.lock")
+
+    def _write_job(self, job):
+        path = self._job_path(job['job_id'])
+        with open(path + '.tmp', 'w') as f:
+            json.dump(job, f)
+        os.replace(path + '.tmp', path)
+
+    def _read_job(self, job_id):
+        try:
+            with open(self._job_path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _spooled_count(self):
+        return len([n for n in os.listdir(self.spool_dir) if n.endswith('.json')])
+
+    def _offer(self, job_id):
+        """Đưa job vào hàng đợi, hàng đợi đầy thì để lần quét spool sau xử lý"""
+        with self._lock:
+            if job_id in self._queued:
+                return
+            try:
+                self._queue.put_nowait(job_id)
+                self._queued.add(job_id)
+            except queue.Full:
+                self._stats['queue_full_total'] += 1
+                logger.warning(f"⚠️ Upload queue full, {job_id} stays in spool")
+
+    def _rescan_loop(self):
+        """Quét spool: nạp job sót lại sau restart, job bị đầy hàng đợi và job đến hạn retry"""
+        while not self._stop_event.is_set():
+            now = time.time()
+            names = sorted(n for n in os.listdir(self.spool_dir) if n.endswith('.json'))
+            for name in names:
+                job = self._read_job(name[:-len('.json')])
+                if job and job.get('next_attempt_at', 0) <= now:
+                    self._offer(job['job_id'])
+            self._stop_event.wait(self.rescan_interval)
+
+    def _worker_loop(self):
+        while not self._stop_event.is_set():
+            job_id = self._queue.get()
+            if job_id is None:
+                break
+            lock_fd = None
+            try:
+                # Process khác dùng chung spool (vd. gunicorn worker) đang xử lý job này thì bỏ qua
+                lock_fd = self._claim(job_id)
+                if lock_fd is not None:
+                    # Đọc lại sau khi khoá: process khác có thể vừa xử lý xong hoặc hẹn retry
+                    job = self._read_job(job_id)
+                    if job and job.get('next_attempt_at', 0) <= time.time():
+                        self._process_job(job)
+            except Exception as e:
+                logger.error(f"❌ Error processing upload job {job_id}: {e}")
+            finally:
+                if lock_fd is not None:
+                    self._release_claim(job_id, lock_fd)
+                with self._lock:
+                    self._queued.discard(job_id)
+
+    def _claim(self, job_id):
+        """Khoá job bằng flock (tự nhả khi process chết), trả về fd hoặc None nếu process khác đang giữ"""
+        fd = os.open(self._lock_path(job_id), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _release_claim(self, job_id, lock_fd):
+        # Job đã xong (không còn metadata trong spool) thì xoá luôn file khoá
+        if not os.path.exists(self._job_path(job_id)):
+            try:
+                os.remove(self._lock_path(job_id))
+            except OSError:
+                pass
+        os.close(lock_fd)
+
+    def _process_job(self, job):
+        image_path = self._image_path(job['job_id'])
+
+        if job['stage'] == 'upload':
+            upload_start = time.monotonic()
+            result = self.cloudinary_service.upload_parking_image(
+                image_bytes=image_path,
+                license_plate=job['license_plate'],
+                parking_lot_id=job['parking_lot_id'],
+                image_type=job['image_type'],
+                public_id=job['public_id']
+            )
+
+            upload_time = time.monotonic() - upload_start
+
+            if result['success']:
+                job['upload_time'] = upload_time
+                job['url'] = result['url']
+                job['stage'] = 'report'
+                job['status'] = 'uploaded'
+                job['attempts'] = 0
+                with self._lock:
+                    self._stats['uploaded_total'] += 1
+            elif job['attempts'] + 1 < self.max_retries:
+                self._schedule_retry(job)
+                return
+            else:
+                logger.error(f"❌ Giving up upload of {job['public_id']} after {self.max_retries} attempts")
+                job['upload_time'] = upload_time
+                job['stage'] = 'report'
+                job['status'] = 'failed'
+                job['attempts'] = 0
+                with self._lock:
+                    self._stats['failed_total'] += 1
+            self._write_job(job)
+
+        # Báo kết quả upload về server, lỗi thì thử lại ở lần quét sau (trong report_window)
+        if self.on_complete and not self._report(job):
+            report_failed_since = job.setdefault('report_failed_since', time.time())
+            if time.time() - report_failed_since < self.report_window:
+                self._schedule_retry(job)
+                return
+            logger.error(f"❌ Giving up reporting {job['public_id']} after {self.report_window:.0f}s")
+            job['report_failed'] = True
+            self._write_job(job)
+            with self._lock:
+                self._stats['report_given_up_total'] += 1
+            self._move_to_failed(job)
+            return
+
+        self._finish(job)
+
+    def _report(self, job):
+        try:
+            if self.on_complete(job, job['status']):
+                return True
+        except Exception as e:
+            logger.error(f"❌ Error reporting upload result for {job['public_id']}: {e}")
+        with self._lock:
+            self._stats['report_failures_total'] += 1
+        return False
+
+    def _schedule_retry(self, job):
+        job['attempts'] += 1
+        delay = min(300, self.retry_base_delay * (2 ** (job['attempts'] - 1)))
+        job['next_attempt_at'] = time.time() + delay * random.uniform(0.5, 1.5)
+        self._write_job(job)
+        with self._lock:
+            self._stats['retries_total'] += 1
+
+    def _finish(self, job):
+        """Xoá job khỏi spool, ảnh upload thất bại được giữ lại trong thư mục failed"""
+        image_path = self._image_path(job['job_id'])
+        if job['status'] == 'failed' and os.path.exists(image_path):
+            self._move_to_failed(job)
+            return
+
+        for path in (image_path, self._job_path(job['job_id'])):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _move_to_failed(self, job):
+        """Giữ ảnh và metadata của job trong thư mục failed để kiểm tra hoặc báo lại bằng tay"""
+        for path in (self._image_path(job['job_id']), self._job_path(job['job_id'])):
+            if os.path.exists(path):
+                os.replace(path, os.path.join(self.failed_dir, os.path.basename(path)))
@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+"""
+WSGI entry point cho production (gunicorn, xem gunicorn.conf.py)
+Model OCR được load một lần khi master import module này (preload_app), các worker fork ra dùng chung
+"""
+
+from main import app, preload_model
+
+preload_model()
+
+__all__ = ['app']
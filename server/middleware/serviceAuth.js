@@ -0,0 +1,27 @@
+const crypto = require('crypto');
+
+// Xác thực request từ ALPR service bằng token dùng chung (ALPR_SERVICE_TOKEN, cấu hình ở cả server và ALPR service)
+module.exports = (req, res, next) => {
+  const expected = process.env.ALPR_SERVICE_TOKEN;
+
+  // Chưa cấu hình token thì từ chối, không mở endpoint cho mọi người
+  if (!expected) {
+    return res.status(503).json({
+      success: false,
+      message: 'Chưa cấu hình token ALPR service'
+    });
+  }
+
+  // So sánh hash (cùng độ dài) bằng timingSafeEqual, thời gian không lộ vị trí ký tự sai
+  const token = req.header('x-alpr-service-token') || '';
+  const expectedHash = crypto.createHash('sha256').update(expected).digest();
+  const tokenHash = crypto.createHash('sha256').update(token).digest();
+  if (!token || !crypto.timingSafeEqual(expectedHash, tokenHash)) {
+    return res.status(401).json({
+      success: false,
+      message: 'Token ALPR service không hợp lệ'
+    });
+  }
+
+  next();
+};
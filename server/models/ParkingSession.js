@@ -42,6 +42,14 @@ const parkingSessionSchema = new mongoose.Schema({
     type: String,
     required: true
   },
+  entryImagePublicId: {
+    type: String
+  },
+  entryImageStatus: {
+    type: String,
+    enum: ['pending', 'uploaded', 'failed'],
+    default: 'uploaded'
+  },
   exitImage: {
     type: String
   },
@@ -114,6 +122,10 @@ const parkingSessionSchema = new mongoose.Schema({
   },
   tempTicketNumber: {
     type: String
+  },
+  // Khoá idempotency do ALPR gửi kèm: entry gửi lại (journal) không tạo phiên trùng
+  idempotencyKey: {
+    type: String
   }
 }, {
   timestamps: true
@@ -142,5 +154,7 @@ parkingSessionSchema.index({ user: 1 });
 parkingSessionSchema.index({ status: 1 });
 parkingSessionSchema.index({ entryTime: 1 });
 parkingSessionSchema.index({ detectedLicensePlate: 1 });
+parkingSessionSchema.index({ entryImagePublicId: 1 }, { sparse: true });
+parkingSessionSchema.index({ idempotencyKey: 1 }, { unique: true, sparse: true });
 
 module.exports = mongoose.model('ParkingSession', parkingSessionSchema); 
\ No newline at end of file
@@ -69,5 +69,7 @@ const vehicleSchema = new mongoose.Schema({
 vehicleSchema.index({ licensePlate: 1 });
 vehicleSchema.index({ owner: 1 });
 vehicleSchema.index({ isRegistered: 1 });
+// Đồng bộ danh sách biển số cho ALPR service theo thứ tự thay đổi
+vehicleSchema.index({ updatedAt: 1, _id: 1 });
 
 module.exports = mongoose.model('Vehicle', vehicleSchema); 
\ No newline at end of file
@@ -1,8 +1,10 @@
 const express = require('express');
 const { body, validationResult } = require('express-validator');
 const ParkingLot = require('../models/ParkingLot');
+const Vehicle = require('../models/Vehicle');
 // Import Socket.IO middleware
 const socketMiddleware = require('../middleware/socket');
+const serviceAuth = require('../middleware/serviceAuth');
 
 // Tạo model RFIDData nếu chưa có
 const mongoose = require('mongoose');
@@ -47,6 +49,28 @@ const RFIDData = mongoose.model('RFIDData', rfidDataSchema);
 
 const router = express.Router();
 
+// ALPR service chỉ nhận request khi model đã load và warm-up xong (/readyz)
+const ALPR_SERVICE_URL = 'http://192.168.102.3:5001';
+const ALPR_READY_CACHE_MS = 2000;
+let alprReadyCache = { ready: false, checkedAt: 0 };
+
+const isAlprReady = async () => {
+  if (Date.now() - alprReadyCache.checkedAt < ALPR_READY_CACHE_MS) {
+    return alprReadyCache.ready;
+  }
+
+  const axios = require('axios');
+  let ready = false;
+  try {
+    const response = await axios.get(`${ALPR_SERVICE_URL}/readyz`, { timeout: 1000 });
+    ready = response.status === 200;
+  } catch (error) {
+    ready = false;
+  }
+  alprReadyCache = { ready, checkedAt: Date.now() };
+  return ready;
+};
+
 // @route   POST /api/iot/barrier-control
 // @desc    Điều khiển barrier
 // @access  Public (IoT device)
@@ -281,6 +305,60 @@ router.post('/rfid-data', [
   }
 });
 
+// @route   GET /api/iot/registered-plates
+// @desc    Biển số xe đã đăng ký cho ALPR service, đồng bộ dần theo cursor (updatedAt + _id)
+// @access  Private (ALPR service, header x-alpr-service-token)
+router.get('/registered-plates', serviceAuth, async (req, res) => {
+  try {
+    const limit = Math.min(Math.max(parseInt(req.query.limit) || 5000, 1), 10000);
+    const { since } = req.query;
+
+    let query = {};
+    if (since) {
+      // Cursor "<updatedAt ms>_<_id>" của trang trước: chỉ lấy xe thay đổi sau đó
+      const [time, id] = String(since).split('_');
+      const updatedAt = new Date(parseInt(time));
+      if (isNaN(updatedAt.getTime()) || !mongoose.Types.ObjectId.isValid(id)) {
+        return res.status(400).json({
+          success: false,
+          message: 'Invalid cursor'
+        });
+      }
+      query = {
+        $or: [
+          { updatedAt: { $gt: updatedAt } },
+          { updatedAt, _id: { $gt: new mongoose.Types.ObjectId(id) } }
+        ]
+      };
+    }
+
+    const vehicles = await Vehicle.find(query)
+      .select('licensePlate isActive updatedAt')
+      .sort({ updatedAt: 1, _id: 1 })
+      .limit(limit)
+      .lean();
+
+    const last = vehicles[vehicles.length - 1];
+    res.json({
+      success: true,
+      data: vehicles.map(vehicle => ({
+        licensePlate: vehicle.licensePlate,
+        isActive: vehicle.isActive
+      })),
+      cursor: last ? `${last.updatedAt.getTime()}_${last._id}` : (since || null),
+      hasMore: vehicles.length === limit
+    });
+
+  } catch (error) {
+    console.error('Error fetching registered plates:', error);
+    res.status(500).json({
+      success: false,
+      message: 'Internal server error',
+      error: error.message
+    });
+  }
+});
+
 // @route   GET /api/iot/rfid-data
 // @desc    Lấy dữ liệu RFID
 // @access  Private
@@ -463,23 +541,27 @@ router.post('/rfid-alpr-integration', [
     await newRFIDData.save();
 
         // 2. Gọi ALPR service để nhận diện biển số
+    if (!(await isAlprReady())) {
+      return res.status(503).json({
+        success: false,
+        message: 'ALPR service đang khởi động',
+        rfid_saved: true,
+        alpr_error: true
+      });
+    }
+
     const axios = require('axios');
-    const FormData = require('form-data');
     
-    const formData = new FormData();
+    // Gửi thẳng JPEG trong body (không bọc multipart), thông tin barrier nằm trong header
     const imageBuffer = Buffer.from(entry_image, 'base64');
-    formData.append('image', imageBuffer, {
-      filename: 'entry_image.jpg',
-      contentType: 'image/jpeg'
-    });
-    formData.append('parkingLotId', parking_lot_id);
-    formData.append('barrierId', barrier_id);
     
     let alprResult;
     try {
-      const alprResponse = await axios.post('http://192.168.102.3:5001/api/detect', formData, {
+      const alprResponse = await axios.post(`${ALPR_SERVICE_URL}/api/detect/raw`, imageBuffer, {
         headers: {
-          ...formData.getHeaders()
+          'Content-Type': 'image/jpeg',
+          'X-Parking-Lot-Id': parking_lot_id,
+          'X-Barrier-Id': barrier_id
         }
       });
       alprResult = alprResponse.data;
@@ -15,13 +15,148 @@ const {
 
 const router = express.Router();
 
+// Số entry tối đa mỗi request /api/parking/entry/batch
+const MAX_ENTRY_BATCH = 100;
+
+// Kết quả trả về cho entry đã tạo phiên (gọi lần đầu hoặc gửi lại cùng idempotencyKey)
+const entryResult = (parkingSession, replayed = false) => ({
+  status: 200,
+  body: {
+    success: true,
+    message: parkingSession.isRegisteredVehicle ? 'Xe đã đăng ký - Mở barrier' : 'Xe chưa đăng ký - Cấp vé tạm',
+    replayed,
+    data: {
+      sessionId: parkingSession.sessionId,
+      isRegisteredVehicle: parkingSession.isRegisteredVehicle,
+      tempTicketNumber: parkingSession.tempTicketNumber,
+      shouldOpenBarrier: parkingSession.isRegisteredVehicle
+    }
+  }
+});
+
+// Tạo phiên gửi xe cho một entry, trả về { status, body } (dùng chung cho /entry và /entry/batch)
+const createEntry = async (entry) => {
+  const { licensePlate, parkingLotId, barrierId, entryImagePublicId, entryImageStatus, idempotencyKey, entryTime } = entry;
+  // ALPR gửi URL ảnh trong entryImageUrl
+  const entryImage = entry.entryImage || entry.entryImageUrl;
+
+  if (!licensePlate || !parkingLotId || !entryImage || !barrierId) {
+    return {
+      status: 400,
+      body: {
+        success: false,
+        message: 'Dữ liệu không hợp lệ'
+      }
+    };
+  }
+
+  // Entry đã nhận trước đó (ALPR gửi lại từ journal): trả lại kết quả cũ, không tạo phiên mới
+  if (idempotencyKey) {
+    const existingSession = await ParkingSession.findOne({ idempotencyKey });
+    if (existingSession) {
+      return entryResult(existingSession, true);
+    }
+  }
+
+  // Kiểm tra bãi xe tồn tại
+  const parkingLot = await ParkingLot.findById(parkingLotId);
+  if (!parkingLot || !parkingLot.isActive) {
+    return {
+      status: 400,
+      body: {
+        success: false,
+        message: 'Bãi xe không tồn tại hoặc đã đóng'
+      }
+    };
+  }
+
+  // Kiểm tra xe đã có phiên gửi xe đang hoạt động
+  const activeSession = await ParkingSession.findOne({
+    detectedLicensePlate: licensePlate.toUpperCase(),
+    status: 'active'
+  });
+
+  if (activeSession) {
+    return {
+      status: 400,
+      body: {
+        success: false,
+        message: 'Xe này đã có phiên gửi xe đang hoạt động'
+      }
+    };
+  }
+
+  // Tìm xe trong database
+  let vehicle = await Vehicle.findOne({ 
+    licensePlate: licensePlate.toUpperCase() 
+  }).populate('owner');
+
+  let isRegisteredVehicle = false;
+  let userId = null;
+  let vehicleId = null;
+
+  if (vehicle && vehicle.isActive) {
+    isRegisteredVehicle = true;
+    userId = vehicle.owner._id;
+    vehicleId = vehicle._id;
+  }
+
+  // Tạo phiên gửi xe mới (entry gửi lại từ journal giữ thời điểm xe vào thật)
+  const suffix = Math.random().toString(36).substr(2, 4).toUpperCase();
+  const parkingSession = new ParkingSession({
+    sessionId: `SESS${Date.now()}${suffix}`,
+    vehicle: vehicleId,
+    user: userId,
+    parkingLot: parkingLotId,
+    entryTime: entryTime ? new Date(entryTime) : Date.now(),
+    entryImage,
+    entryImagePublicId,
+    entryImageStatus: entryImageStatus || 'uploaded',
+    detectedLicensePlate: licensePlate.toUpperCase(),
+    barrierEntry: barrierId,
+    isRegisteredVehicle,
+    tempTicketNumber: !isRegisteredVehicle ? `TEMP${Date.now()}${suffix}` : null,
+    idempotencyKey
+  });
+
+  try {
+    await parkingSession.save();
+  } catch (err) {
+    // Hai request cùng idempotencyKey đến cùng lúc: request sau trả lại phiên của request trước
+    if (err.code === 11000 && idempotencyKey) {
+      const existingSession = await ParkingSession.findOne({ idempotencyKey });
+      if (existingSession) {
+        return entryResult(existingSession, true);
+      }
+    }
+    throw err;
+  }
+
+  // Cập nhật số chỗ trống
+  await parkingLot.updateAvailableSpaces();
+
+  // Emit socket event
+  const io = socketMiddleware.getIO();
+  if (io) {
+    io.to(`parking-lot-${parkingLotId}`).emit('vehicle-entered', {
+      sessionId: parkingSession.sessionId,
+      licensePlate: licensePlate.toUpperCase(),
+      isRegisteredVehicle,
+      entryTime: parkingSession.entryTime,
+      availableSpaces: parkingLot.availableSpaces
+    });
+  }
+
+  return entryResult(parkingSession);
+};
+
 // @route   POST /api/parking/entry
 // @desc    Xe vào bãi
 // @access  Public (IoT device)
 router.post('/entry', [
   body('licensePlate', 'Biển số xe không được để trống').notEmpty(),
   body('parkingLotId', 'ID bãi xe không được để trống').notEmpty(),
-  body('entryImage', 'Ảnh xe vào không được để trống').notEmpty(),
+  body('entryImage', 'Ảnh xe vào không được để trống').custom((value, { req }) => Boolean(value || req.body.entryImageUrl)),
   body('barrierId', 'ID barrier không được để trống').notEmpty()
 ], async (req, res) => {
   try {
@@ -34,83 +169,102 @@ router.post('/entry', [
       });
     }
 
-    const { licensePlate, parkingLotId, entryImage, barrierId } = req.body;
+    const { status, body: result } = await createEntry({
+      ...req.body,
+      idempotencyKey: req.body.idempotencyKey || req.get('Idempotency-Key')
+    });
+    res.status(status).json(result);
 
-    // Kiểm tra bãi xe tồn tại
-    const parkingLot = await ParkingLot.findById(parkingLotId);
-    if (!parkingLot || !parkingLot.isActive) {
-      return res.status(400).json({
-        success: false,
-        message: 'Bãi xe không tồn tại hoặc đã đóng'
-      });
-    }
+  } catch (err) {
+    console.error(err.message);
+    res.status(500).json({
+      success: false,
+      message: 'Lỗi server'
+    });
+  }
+});
 
-    // Kiểm tra xe đã có phiên gửi xe đang hoạt động
-    const activeSession = await ParkingSession.findOne({
-      detectedLicensePlate: licensePlate.toUpperCase(),
-      status: 'active'
+// @route   POST /api/parking/entry/batch
+// @desc    ALPR gửi lại các entry trong journal (lúc server không trả lời), xử lý lần lượt theo thứ tự
+// @access  Public (IoT device)
+router.post('/entry/batch', [
+  body('entries', `Danh sách entry không hợp lệ (tối đa ${MAX_ENTRY_BATCH})`).isArray({ min: 1, max: MAX_ENTRY_BATCH })
+], async (req, res) => {
+  const errors = validationResult(req);
+  if (!errors.isEmpty()) {
+    return res.status(400).json({
+      success: false,
+      message: 'Dữ liệu không hợp lệ',
+      errors: errors.array()
     });
+  }
+
+  // Entry lỗi phía server (500) thì dừng, các entry sau trả 503 để ALPR gửi lại đúng thứ tự
+  const results = [];
+  let blocked = false;
+  for (const entry of req.body.entries) {
+    if (blocked) {
+      results.push({ status: 503, idempotencyKey: entry.idempotencyKey, success: false, message: 'Chưa xử lý' });
+      continue;
+    }
+    try {
+      const { status, body: result } = await createEntry(entry);
+      results.push({ status, idempotencyKey: entry.idempotencyKey, ...result });
+    } catch (err) {
+      console.error(err.message);
+      blocked = true;
+      results.push({ status: 500, idempotencyKey: entry.idempotencyKey, success: false, message: 'Lỗi server' });
+    }
+  }
 
-    if (activeSession) {
+  res.json({
+    success: true,
+    results
+  });
+});
+
+// @route   POST /api/parking/entry-image
+// @desc    ALPR service báo kết quả upload ảnh xe vào (upload chạy nền sau khi mở barrier)
+// @access  Public (IoT device)
+router.post('/entry-image', [
+  body('entryImagePublicId', 'Public ID ảnh không được để trống').notEmpty(),
+  body('status', 'Trạng thái upload không hợp lệ').isIn(['uploaded', 'failed'])
+], async (req, res) => {
+  try {
+    const errors = validationResult(req);
+    if (!errors.isEmpty()) {
       return res.status(400).json({
         success: false,
-        message: 'Xe này đã có phiên gửi xe đang hoạt động'
+        message: 'Dữ liệu không hợp lệ',
+        errors: errors.array()
       });
     }
 
-    // Tìm xe trong database
-    let vehicle = await Vehicle.findOne({ 
-      licensePlate: licensePlate.toUpperCase() 
-    }).populate('owner');
+    const { entryImagePublicId, entryImageUrl, status } = req.body;
 
-    let isRegisteredVehicle = false;
-    let userId = null;
-    let vehicleId = null;
-
-    if (vehicle && vehicle.isActive) {
-      isRegisteredVehicle = true;
-      userId = vehicle.owner._id;
-      vehicleId = vehicle._id;
+    const update = { entryImageStatus: status };
+    if (status === 'uploaded' && entryImageUrl) {
+      update.entryImage = entryImageUrl;
     }
 
-    // Tạo phiên gửi xe mới
-    const parkingSession = new ParkingSession({
-      sessionId: `SESS${Date.now()}`,
-      vehicle: vehicleId,
-      user: userId,
-      parkingLot: parkingLotId,
-      entryImage,
-      detectedLicensePlate: licensePlate.toUpperCase(),
-      barrierEntry: barrierId,
-      isRegisteredVehicle,
-      tempTicketNumber: !isRegisteredVehicle ? `TEMP${Date.now()}` : null
-    });
-
-    await parkingSession.save();
-
-    // Cập nhật số chỗ trống
-    await parkingLot.updateAvailableSpaces();
+    const parkingSession = await ParkingSession.findOneAndUpdate(
+      { entryImagePublicId },
+      update,
+      { new: true }
+    );
 
-    // Emit socket event
-    const io = socketMiddleware.getIO();
-    if (io) {
-      io.to(`parking-lot-${parkingLotId}`).emit('vehicle-entered', {
-        sessionId: parkingSession.sessionId,
-        licensePlate: licensePlate.toUpperCase(),
-        isRegisteredVehicle,
-        entryTime: parkingSession.entryTime,
-        availableSpaces: parkingLot.availableSpaces
+    if (!parkingSession) {
+      return res.status(404).json({
+        success: false,
+        message: 'Không tìm thấy phiên gửi xe với ảnh này'
       });
     }
 
     res.json({
       success: true,
-      message: isRegisteredVehicle ? 'Xe đã đăng ký - Mở barrier' : 'Xe chưa đăng ký - Cấp vé tạm',
       data: {
         sessionId: parkingSession.sessionId,
-        isRegisteredVehicle,
-        tempTicketNumber: parkingSession.tempTicketNumber,
-        shouldOpenBarrier: isRegisteredVehicle
+        entryImageStatus: parkingSession.entryImageStatus
       }
     });
 